@@ -0,0 +1,332 @@
+"""
+全部接口的基准测试：生成合成语料到本地 SQLite，以 gunicorn 启动服务后逐个接口压测
+
+用法：
+    python benchmarks/endpoints.py [--poems 10000] [--characters 20000] [--concurrency 16] [--duration 5]
+                                   [--output baseline.json] [--compare baseline.json] [--threshold 10]
+同一规模的语料只生成一次并缓存在 --cache-dir 中，每次运行复制一份再压测，写接口不会影响下一次运行
+--output 写出机器可读的结果，--compare 与之前的结果对比，吞吐下降或 p95 上升超过 --threshold% 时退出码为 1
+压测前另在独立进程中测量联想补全的进程内延迟，p99 超过 --suggest-target-ms 时退出码同样为 1
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+from corpus import generate
+from loadgen import run_load, wait_until_up
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+NDJSON_HEADERS = {'Content-Type': 'application/x-ndjson'}
+
+# 写接口每次提交的批量行数
+BULK_ROWS = 20
+
+# 语料库表结构的版本，模型增加列后加一，不再复用缓存中的旧语料
+CORPUS_VERSION = 2
+
+# 增量同步压测拉取的变更条数
+SYNC_TAIL = 1000
+
+# 预置在写入队列状态日志中的 ticket，供 /api/write/status 压测
+WRITE_TICKET = 'benchmark'
+
+
+def _samples(path):
+    """从语料库中取各接口的查询参数"""
+    conn = sqlite3.connect(path)
+    try:
+        poetry_id, author, content = conn.execute(
+            'SELECT id, author, content FROM Poetry ORDER BY id LIMIT 1 OFFSET '
+            '(SELECT COUNT(*) / 2 FROM Poetry)').fetchone()
+        character, radical, stroke_count = conn.execute(
+            'SELECT character, radical, stroke_count FROM CharacterEtymology ORDER BY id LIMIT 1').fetchone()
+        characters = ''.join(row[0] for row in conn.execute(
+            'SELECT character FROM CharacterEtymology ORDER BY id LIMIT 50'))
+        constellation = conn.execute('SELECT constellation FROM AstronomyKnowledge LIMIT 1').fetchone()[0]
+        category = conn.execute('SELECT category FROM CulturalKnowledge LIMIT 1').fetchone()[0]
+        title = conn.execute('SELECT title FROM Poetry ORDER BY id LIMIT 1').fetchone()[0]
+        change_seq = conn.execute("SELECT version FROM TableVersions WHERE table_name = '$change_seq'").fetchone()
+    finally:
+        conn.close()
+    return {
+        'poetry_id': poetry_id,
+        'author': author,
+        'keyword': content[:1],
+        'keyword2': content[:2],
+        'character': character,
+        'characters': characters,
+        'radical': radical,
+        'stroke_count': stroke_count,
+        'constellation': constellation,
+        'category': category,
+        'author_prefix': author[:1],
+        'title_prefix': title[:1],
+        # 增量同步只拉取最后 SYNC_TAIL 个序号之后的变化，模拟客户端的日常追平
+        'since': max(0, (change_seq[0] if change_seq else 0) - SYNC_TAIL),
+        'ticket': WRITE_TICKET,
+    }
+
+
+def _ndjson(rows):
+    return '\n'.join(json.dumps(row, ensure_ascii=False) for row in rows).encode('utf-8')
+
+
+def _routes(samples):
+    """
+    views.py 中的全部接口，依次为 (名称, 方法, 路径, 请求体, 请求头, 是否写接口)
+    写接口排在读接口之后，避免写入影响读接口的结果
+    """
+    poem = {'title': '基准', 'author': '压测', 'dynasty': '唐', 'content': '床前明月光，疑是地上霜。', 'tags': '基准'}
+    calendar = {'title': '基准', 'content': '基准测试写入的历法知识', 'category': '节气', 'date_info': '1月1日'}
+    astronomy = {'title': '基准', 'content': '基准测试写入的天文知识', 'constellation': '角宿', 'period': '唐'}
+    culture = {'title': '基准', 'content': '基准测试写入的文化知识', 'category': '礼仪', 'tags': '基准'}
+    # 字源表的汉字唯一，重复提交只会走到唯一约束的错误分支
+    etymology = {'character': '𠀀', 'pinyin': 'qiū', 'radical': '一', 'stroke_count': 5, 'meaning': '基准'}
+    reads = [
+        ('index', 'GET', '/', None, None),
+        ('count_get', 'GET', '/api/count', None, None),
+        ('poetry_search_keyword', 'GET', '/api/poetry/search?keyword={keyword}', None, None),
+        ('poetry_search_bigram', 'GET', '/api/poetry/search?keyword={keyword2}', None, None),
+        ('poetry_search_author', 'GET', '/api/poetry/search?author={author}', None, None),
+        ('suggest_author', 'GET', '/api/suggest?type=author&prefix={author_prefix}', None, None),
+        ('suggest_title', 'GET', '/api/suggest?type=title&prefix={title_prefix}', None, None),
+        ('suggest_character', 'GET', '/api/suggest?type=character&prefix=s', None, None),
+        ('poetry_random', 'GET', '/api/poetry/random', None, None),
+        ('poetry_annotated', 'GET', '/api/poetry/{poetry_id}/annotated', None, None),
+        ('etymology_search', 'GET', '/api/etymology/search?character={character}', None, None),
+        ('etymology_batch_get', 'GET', '/api/etymology/batch?characters={characters}', None, None),
+        ('etymology_batch_post', 'POST', '/api/etymology/batch', {'characters': list(samples['characters'])},
+         JSON_HEADERS),
+        ('etymology_radical', 'GET', '/api/etymology/radical?radical={radical}', None, None),
+        ('etymology_strokes', 'GET', '/api/etymology/strokes?count={stroke_count}', None, None),
+        ('calendar_solar_terms', 'GET', '/api/calendar/solar-terms', None, None),
+        ('calendar_festivals', 'GET', '/api/calendar/festivals', None, None),
+        ('astronomy_constellations', 'GET', '/api/astronomy/constellations?constellation={constellation}', None, None),
+        ('culture_daily', 'GET', '/api/culture/daily', None, None),
+        ('culture_category', 'GET', '/api/culture/category?category={category}', None, None),
+        ('write_status', 'GET', '/api/write/status?ticket={ticket}', None, None),
+        ('sync', 'GET', '/api/sync?since={since}', None, None),
+        ('snapshot_latest', 'GET', '/api/snapshot/latest', None, None),
+        ('cache_stats', 'GET', '/api/cache/stats', None, None),
+        ('pool_stats', 'GET', '/api/pool/stats', None, None),
+        ('metrics', 'GET', '/metrics', None, None),
+    ]
+    writes = [
+        ('count_post', 'POST', '/api/count', {'action': 'inc'}, JSON_HEADERS),
+        ('poetry_add', 'POST', '/api/poetry/add', poem, JSON_HEADERS),
+        ('poetry_bulk', 'POST', '/api/poetry/bulk', _ndjson([poem] * BULK_ROWS), NDJSON_HEADERS),
+        ('etymology_add', 'POST', '/api/etymology/add', etymology, JSON_HEADERS),
+        ('etymology_bulk', 'POST', '/api/etymology/bulk', _ndjson([etymology] * BULK_ROWS), NDJSON_HEADERS),
+        ('calendar_add', 'POST', '/api/calendar/add', calendar, JSON_HEADERS),
+        ('calendar_bulk', 'POST', '/api/calendar/bulk', _ndjson([calendar] * BULK_ROWS), NDJSON_HEADERS),
+        ('astronomy_add', 'POST', '/api/astronomy/add', astronomy, JSON_HEADERS),
+        ('astronomy_bulk', 'POST', '/api/astronomy/bulk', _ndjson([astronomy] * BULK_ROWS), NDJSON_HEADERS),
+        ('culture_add', 'POST', '/api/culture/add', culture, JSON_HEADERS),
+        ('culture_bulk', 'POST', '/api/culture/bulk', _ndjson([culture] * BULK_ROWS), NDJSON_HEADERS),
+        ('init_data', 'POST', '/api/init-data', None, None),
+    ]
+    params = {key: quote(str(value)) for key, value in samples.items()}
+    routes = []
+    for is_write, group in ((False, reads), (True, writes)):
+        for name, method, path, body, headers in group:
+            if isinstance(body, dict):
+                body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            routes.append((name, method, path.format(**params), body, headers, is_write))
+    return routes
+
+
+def _git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                                  capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, check=True,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _corpus(args):
+    """返回缓存的语料库路径，不存在或指定 --regenerate 时重新生成"""
+    os.makedirs(args.cache_dir, exist_ok=True)
+    path = os.path.join(args.cache_dir, 'corpus_v{}_{}_{}_{}_{}.db'.format(
+        CORPUS_VERSION, args.poems, args.characters, args.knowledge, args.seed))
+    if args.regenerate or not os.path.exists(path):
+        print('generating corpus {}'.format(path))
+        generate(path + '.tmp', args.poems, args.characters, args.knowledge, args.seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def _prepare_state(args, database_path):
+    """
+    写入队列与离线快照包使用本次运行的目录，不写到仓库的 data 目录；
+    在写入队列的状态日志中预置一个已完成的 ticket，并预先生成离线快照包（接口只在后台重新生成）
+    :return: 服务进程的环境变量
+    """
+    write_queue_dir = os.path.abspath(os.path.join(args.cache_dir, 'write_queue'))
+    bundle_dir = os.path.abspath(os.path.join(args.cache_dir, 'offline_bundle'))
+    for directory in (write_queue_dir, bundle_dir):
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+    with open(os.path.join(write_queue_dir, 'status.log'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'ticket': WRITE_TICKET, 'table': 'Poetry', 'status': 'done', 'id': 1,
+                            'at': time.time()}) + '\n')
+    env = {'WRITE_QUEUE_DIR': write_queue_dir, 'OFFLINE_BUNDLE_DIR': bundle_dir}
+    subprocess.run([sys.executable, '-m', 'flask', 'offline-bundle-build'], cwd=ROOT, check=True,
+                   env=dict(os.environ, DATABASE_URI='sqlite:///' + database_path, FLASK_APP='wxcloudrun', **env),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return env
+
+
+def _suggest_latency(args, database_path):
+    """在独立进程中测量联想补全的进程内延迟，见 suggest_latency.py"""
+    output = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'suggest_latency.py'), database_path, '--json',
+         '--target-ms', str(args.suggest_target_ms)],
+        cwd=ROOT, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _start_server(args, database_path):
+    env = dict(os.environ, DATABASE_URI='sqlite:///' + database_path, DEBUG='false', PORT=str(args.port))
+    env.update(_prepare_state(args, database_path))
+    if args.workers:
+        env['GUNICORN_WORKERS'] = str(args.workers)
+    if args.server == 'dev':
+        cmd = [sys.executable, 'run.py', '127.0.0.1', str(args.port)]
+    else:
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wxcloudrun:app']
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_suite(args):
+    corpus_path = _corpus(args)
+    database_path = os.path.abspath(os.path.join(args.cache_dir, 'run.db'))
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(database_path + suffix):
+            os.remove(database_path + suffix)
+    shutil.copyfile(corpus_path, database_path)
+    routes = _routes(_samples(database_path))
+    if args.only:
+        routes = [route for route in routes if any(pattern in route[0] for pattern in args.only)]
+    if args.skip_writes:
+        routes = [route for route in routes if not route[5]]
+
+    suggest_latency = _suggest_latency(args, database_path)
+    print('{:<28}{:>10}{:>10}{:>10}'.format('suggest_inprocess', 'prefix', 'p50_ms', 'p99_ms'))
+    for kind, result in suggest_latency.items():
+        print('{:<28}{:>10}{:>10.3f}{:>10.3f}{}'.format(
+            kind, result['prefix'], result['p50_ms'], result['p99_ms'],
+            '  OVER TARGET' if result['p99_ms'] > args.suggest_target_ms else ''))
+
+    process = _start_server(args, database_path)
+    base = 'http://127.0.0.1:{}'.format(args.port)
+    results = {}
+    try:
+        wait_until_up(base)
+        print('{:<28}{:>10}{:>8}{:>10}{:>10}{:>10}'.format('endpoint', 'rps', 'errors', 'p50_ms', 'p95_ms', 'p99_ms'))
+        for name, method, path, body, headers, _ in routes:
+            if args.warmup:
+                run_load(base + path, args.concurrency, args.warmup, method, body, headers)
+            result = run_load(base + path, args.concurrency, args.duration, method, body, headers)
+            result.update(method=method, path=path)
+            results[name] = result
+            print('{:<28}{:>10}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+                name, result['rps'], result['errors'],
+                result['p50_ms'] or 0, result['p95_ms'] or 0, result['p99_ms'] or 0))
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'server': args.server,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'scale': {'poems': args.poems, 'characters': args.characters, 'knowledge': args.knowledge,
+                      'seed': args.seed},
+        },
+        'results': results,
+        'suggest_latency': suggest_latency,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    逐个接口对比吞吐与 p95
+    :return: 超过阈值的退化接口名列表
+    """
+    if baseline['meta'].get('scale') != current['meta'].get('scale'):
+        print('warning: 语料规模不同，结果不可直接比较')
+    regressions = []
+    print('{:<28}{:>12}{:>12}{:>9}{:>12}{:>12}{:>9}'.format(
+        'endpoint', 'base_rps', 'rps', 'Δ%', 'base_p95', 'p95', 'Δ%'))
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None or not old['rps'] or not old['p95_ms'] or result['p95_ms'] is None:
+            print('{:<28}{:>12}{:>12}'.format(name, '-', result['rps']))
+            continue
+        rps_delta = (result['rps'] - old['rps']) * 100.0 / old['rps']
+        p95_delta = (result['p95_ms'] - old['p95_ms']) * 100.0 / old['p95_ms']
+        regressed = rps_delta < -threshold or p95_delta > threshold
+        if regressed:
+            regressions.append(name)
+        print('{:<28}{:>12}{:>12}{:>+9.1f}{:>12.2f}{:>12.2f}{:>+9.1f}{}'.format(
+            name, old['rps'], result['rps'], rps_delta, old['p95_ms'], result['p95_ms'], p95_delta,
+            '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--poems', type=int, default=10000)
+    parser.add_argument('--characters', type=int, default=20000)
+    parser.add_argument('--knowledge', type=int, default=2000, help='历法、天文、文化知识表各自的行数')
+    parser.add_argument('--seed', type=int, default=20240101)
+    parser.add_argument('--regenerate', action='store_true', help='忽略缓存重新生成语料')
+    parser.add_argument('--cache-dir', default='/tmp/wxcloudrun_bench')
+    parser.add_argument('--server', choices=('gunicorn', 'dev'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=0, help='gunicorn 进程数，默认按 gunicorn.conf.py')
+    parser.add_argument('--port', type=int, default=18081)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--warmup', type=float, default=1, help='每个接口正式计时前的预热秒数')
+    parser.add_argument('--only', action='append', help='只压测名称包含该子串的接口，可重复')
+    parser.add_argument('--skip-writes', action='store_true', help='跳过写接口')
+    parser.add_argument('--output', help='结果写入的 JSON 文件')
+    parser.add_argument('--compare', help='作为基线对比的 JSON 文件')
+    parser.add_argument('--threshold', type=float, default=10, help='判定退化的百分比')
+    parser.add_argument('--suggest-target-ms', type=float, default=1.0, help='联想单次补全的进程内 p99 目标（毫秒）')
+    args = parser.parse_args()
+
+    current = run_suite(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+    failed = any(result['p99_ms'] > args.suggest_target_ms for result in current['suggest_latency'].values())
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(baseline, current, args.threshold):
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
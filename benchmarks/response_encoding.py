@@ -0,0 +1,79 @@
+"""
+响应序列化基准：对比旧的 ASCII 转义 JSON、紧凑 UTF-8 JSON 与 orjson 的字节数和单次耗时
+
+用法：python benchmarks/response_encoding.py [--number 2000]
+"""
+import argparse
+import json
+import timeit
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+POEM = {
+    'id': 1,
+    'title': '静夜思',
+    'author': '李白',
+    'dynasty': '唐',
+    'content': '床前明月光，疑是地上霜。举头望明月，低头思故乡。',
+    'tags': '思乡,月亮'
+}
+
+ETYMOLOGY = {
+    'id': 1,
+    'character': '爱',
+    'pinyin': 'ài',
+    'radical': '爪',
+    'stroke_count': 10,
+    'etymology': '爱字从爪从心，表示用心去抓取、呵护。古文字中，爪表示手，心表示情感，合起来表示用心去关爱。',
+    'ancient_forms': '甲骨文：𢆶 金文：愛 小篆：愛',
+    'meaning': '喜爱、关爱',
+    'extended_meanings': '爱护、爱惜、爱慕',
+    'examples': '爱心、爱情、爱国',
+    'stroke_order': '撇、点、点、撇、点、横钩、竖、横折、横、横',
+    'dictionary_source': '说文解字、康熙字典'
+}
+
+CULTURE = {
+    'id': 1,
+    'title': '二十四节气',
+    'content': '二十四节气是中国古代订立的一种用来指导农事的补充历法，' * 20,
+    'category': '历法',
+    'tags': '节气,农事'
+}
+
+# 有代表性的响应体：一页诗词检索结果、单字字源、一页文化百科
+PAYLOADS = {
+    'poetry_search_page': {'code': 0, 'data': [dict(POEM, id=i) for i in range(20)], 'nextCursor': 20},
+    'etymology_search': {'code': 0, 'data': ETYMOLOGY},
+    'culture_category_page': {'code': 0, 'data': [dict(CULTURE, id=i) for i in range(20)], 'nextCursor': 20}
+}
+
+
+def _encoders():
+    encoders = {
+        'json_ascii': lambda obj: json.dumps(obj).encode('utf-8'),
+        'json_utf8': lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    }
+    if orjson is not None:
+        encoders['orjson'] = orjson.dumps
+    return encoders
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000, help='每种组合的执行次数')
+    args = parser.parse_args()
+
+    print('{:<24}{:<12}{:>10}{:>12}'.format('payload', 'encoder', 'bytes', 'us/resp'))
+    for name, payload in PAYLOADS.items():
+        for encoder_name, encode in _encoders().items():
+            size = len(encode(payload))
+            seconds = timeit.timeit(lambda: encode(payload), number=args.number)
+            print('{:<24}{:<12}{:>10}{:>12.2f}'.format(name, encoder_name, size, seconds / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
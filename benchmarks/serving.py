@@ -0,0 +1,62 @@
+"""
+对比 Flask 开发服务器与 gunicorn 生产模式的吞吐和延迟
+
+用法：python benchmarks/serving.py [--concurrency 32] [--duration 10] [--path /]
+使用 DATABASE_URI（默认临时 SQLite 文件）作为数据库，需已安装 gunicorn
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from loadgen import run_load, wait_until_up
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _start(name, port, env):
+    if name == 'dev':
+        cmd = [sys.executable, 'run.py', '127.0.0.1', str(port)]
+    else:
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wxcloudrun:app']
+        env = dict(env, PORT=str(port))
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _create_tables(env):
+    code = 'from wxcloudrun import app, db\nwith app.app_context():\n    db.create_all()'
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--path', action='append', help='压测路径，可重复，默认 / 与 /api/count')
+    parser.add_argument('--port', type=int, default=18080)
+    args = parser.parse_args()
+    paths = args.path or ['/', '/api/count']
+
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URI', 'sqlite:////tmp/wxcloudrun_serving_bench.db')
+    env.setdefault('DEBUG', 'false')
+    _create_tables(env)
+
+    print('{:<10}{:<16}{:>10}{:>8}{:>10}{:>10}{:>10}'.format('server', 'path', 'rps', 'errors', 'p50_ms', 'p95_ms', 'p99_ms'))
+    for name in ('dev', 'gunicorn'):
+        process = _start(name, args.port, env)
+        base = 'http://127.0.0.1:{}'.format(args.port)
+        try:
+            wait_until_up(base)
+            for path in paths:
+                result = run_load(base + path, args.concurrency, args.duration)
+                print('{:<10}{:<16}{:>10}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+                    name, path, result['rps'], result['errors'],
+                    result['p50_ms'] or 0, result['p95_ms'] or 0, result['p99_ms'] or 0))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
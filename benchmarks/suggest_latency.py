@@ -0,0 +1,95 @@
+"""
+前缀联想的进程内延迟：对语料库建立联想索引后，对每种联想取最常见的单字（单字母）前缀，即候选最多的最坏情况，
+绕过结果缓存重复补全，输出单次调用的 p50/p99；接口的目标是单次补全在 1 毫秒内
+
+用法：python benchmarks/suggest_latency.py <语料库.db> [--calls 2000] [--limit 10] [--target-ms 1] [--json]
+p99 超过 --target-ms 时退出码为 1
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _prefixes(path, strip_tones):
+    """各种联想候选最多的单字前缀"""
+    conn = sqlite3.connect(path)
+    try:
+        prefixes = {}
+        for kind in ('author', 'title'):
+            row = conn.execute('SELECT substr({0}, 1, 1), COUNT(DISTINCT {0}) FROM Poetry GROUP BY 1 '
+                               'ORDER BY 2 DESC LIMIT 1'.format(kind)).fetchone()
+            prefixes[kind] = row[0] if row else '一'
+        letters = Counter(reading[0] for (pinyin,) in conn.execute('SELECT pinyin FROM CharacterEtymology')
+                          for reading in strip_tones(pinyin or ''))
+        prefixes['character'] = letters.most_common(1)[0][0] if letters else 'a'
+    finally:
+        conn.close()
+    return prefixes
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def measure(path, calls, limit):
+    """
+    :return: {联想类型: {prefix, p50_ms, p99_ms}}
+    """
+    os.environ.update(DATABASE_URI='sqlite:///' + os.path.abspath(path), SCHEMA_CHECK_ON_STARTUP='false')
+    sys.path.insert(0, ROOT)
+    from wxcloudrun import app
+    from wxcloudrun.search_index import poetry_index
+    from wxcloudrun.suggest import poetry_suggester, character_suggester, strip_tones
+
+    results = {}
+    with app.app_context():
+        poetry_index.build()
+        poetry_suggester.build()
+        character_suggester.build()
+        character_suggester.reweigh()
+        prefixes = _prefixes(path, strip_tones)
+        for kind, prefix in prefixes.items():
+            if kind == 'character':
+                complete, complete_args = character_suggester.complete, (prefix, limit)
+            else:
+                complete, complete_args = poetry_suggester.complete, (kind, prefix, limit)
+            complete(*complete_args)
+            timings = []
+            for _ in range(calls):
+                started = time.perf_counter()
+                complete(*complete_args)
+                timings.append((time.perf_counter() - started) * 1000)
+            results[kind] = {'prefix': prefix, 'p50_ms': round(_percentile(timings, 50), 4),
+                             'p99_ms': round(_percentile(timings, 99), 4)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--target-ms', type=float, default=1.0)
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出结果')
+    args = parser.parse_args()
+
+    results = measure(args.database, args.calls, args.limit)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False))
+    else:
+        print('{:<12}{:>8}{:>10}{:>10}'.format('type', 'prefix', 'p50_ms', 'p99_ms'))
+        for kind, result in results.items():
+            print('{:<12}{:>8}{:>10.3f}{:>10.3f}'.format(kind, result['prefix'], result['p50_ms'], result['p99_ms']))
+    if any(result['p99_ms'] > args.target_ms for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
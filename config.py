@@ -1,9 +1,116 @@
 import os
 
-# 是否开启debug模式
-DEBUG = True
+# 是否开启debug模式，生产环境保持关闭，本地调试时设置环境变量 DEBUG=true
+DEBUG = os.environ.get("DEBUG", 'false').lower() == 'true'
 
 # 读取数据库环境变量
 username = os.environ.get("MYSQL_USERNAME", 'root')
 password = os.environ.get("MYSQL_PASSWORD", 'root')
 db_address = os.environ.get("MYSQL_ADDRESS", '127.0.0.1:3306')
+# 完整的数据库连接串，设置后代替上面的 MySQL 配置，如本地压测使用 sqlite:////tmp/bench.db
+database_uri = os.environ.get("DATABASE_URI")
+# 只读副本地址或完整连接串，设置后读查询走副本，写入及同一请求内写入之后的读查询走主库
+db_read_address = os.environ.get("MYSQL_READ_ADDRESS")
+database_read_uri = os.environ.get("DATABASE_READ_URI")
+# 副本连接失败后读查询改走主库的时长（秒），到期后探活恢复
+REPLICA_RETRY_SECONDS = float(os.environ.get("REPLICA_RETRY_SECONDS", '10'))
+
+# 诗词关键词检索是否使用内存倒排索引
+POETRY_INDEX_ENABLED = os.environ.get("POETRY_INDEX_ENABLED", 'true').lower() == 'true'
+# 倒排索引追平其他实例新增诗词的最小间隔（秒）
+POETRY_INDEX_REFRESH_SECONDS = float(os.environ.get("POETRY_INDEX_REFRESH_SECONDS", '1'))
+# 倒排索引键与诗词 id 的总数上限，超过后放弃索引，关键词检索回退为全表扫描
+POETRY_INDEX_MAX_POSTINGS = int(os.environ.get("POETRY_INDEX_MAX_POSTINGS", '50000000'))
+
+# 列表接口默认每页条数与服务端允许的最大每页条数
+PAGE_SIZE_DEFAULT = int(os.environ.get("PAGE_SIZE_DEFAULT", '20'))
+PAGE_SIZE_MAX = int(os.environ.get("PAGE_SIZE_MAX", '100'))
+
+# 随机抽样 id 池追平其他实例新增记录的最小间隔（秒）
+RANDOM_POOL_REFRESH_SECONDS = float(os.environ.get("RANDOM_POOL_REFRESH_SECONDS", '30'))
+
+# 历法、天文参考数据快照比对表版本、追平其他实例写入的最小间隔（秒）
+REFERENCE_SNAPSHOT_REFRESH_SECONDS = float(os.environ.get("REFERENCE_SNAPSHOT_REFRESH_SECONDS", '10'))
+
+# 本地时区相对 UTC 的小时数，决定每日文化知识的切换时刻与缓存过期时间
+LOCAL_TZ_OFFSET_HOURS = float(os.environ.get("LOCAL_TZ_OFFSET_HOURS", '8'))
+
+# 前缀联想：追平其他实例新增记录的最小间隔（秒）、结果缓存的条目数与过期时间（秒）、默认与最大返回条数
+SUGGEST_REFRESH_SECONDS = float(os.environ.get("SUGGEST_REFRESH_SECONDS", '5'))
+SUGGEST_CACHE_SIZE = int(os.environ.get("SUGGEST_CACHE_SIZE", '2000'))
+SUGGEST_CACHE_TTL = float(os.environ.get("SUGGEST_CACHE_TTL", '60'))
+SUGGEST_LIMIT_DEFAULT = int(os.environ.get("SUGGEST_LIMIT_DEFAULT", '10'))
+SUGGEST_LIMIT_MAX = int(os.environ.get("SUGGEST_LIMIT_MAX", '50'))
+
+# /add 接口的异步写入：开启后校验通过的记录追加到本地队列文件并立即返回 ticket，由后台线程分批写库
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", 'false').lower() == 'true'
+# 队列与状态日志所在目录，应位于同一实例各进程共享且重启后保留的磁盘上
+WRITE_QUEUE_DIR = os.environ.get(
+    "WRITE_QUEUE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'write_queue'))
+# 后台刷新间隔（秒）、每个事务写入的最多记录数，以及入队后是否 fsync（关闭后掉电可能丢失已确认的写入）
+WRITE_QUEUE_FLUSH_INTERVAL = float(os.environ.get("WRITE_QUEUE_FLUSH_INTERVAL", '1'))
+WRITE_QUEUE_BATCH_SIZE = int(os.environ.get("WRITE_QUEUE_BATCH_SIZE", '500'))
+WRITE_QUEUE_FSYNC = os.environ.get("WRITE_QUEUE_FSYNC", 'true').lower() == 'true'
+# 后台线程定期压缩队列时保留最近多少秒的写入结果，更早的 ticket 查询不到；为 0 时不自动压缩
+WRITE_QUEUE_KEEP_SECONDS = float(os.environ.get("WRITE_QUEUE_KEEP_SECONDS", '604800'))
+
+# 离线快照包所在目录，以及 /api/snapshot/latest 比对表版本、决定是否重新生成的间隔（秒）
+OFFLINE_BUNDLE_DIR = os.environ.get(
+    "OFFLINE_BUNDLE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'offline_bundle'))
+OFFLINE_BUNDLE_CHECK_SECONDS = float(os.environ.get("OFFLINE_BUNDLE_CHECK_SECONDS", '60'))
+
+# 计数器分片数，只能调大，调小会丢失高编号分片上的计数
+COUNTER_SHARDS = int(os.environ.get("COUNTER_SHARDS", '8'))
+# 计数写入合并的刷新间隔（秒），为 0 时不合并，每次自增直接写库
+COUNTER_FLUSH_INTERVAL = float(os.environ.get("COUNTER_FLUSH_INTERVAL", '0'))
+
+# 汉字字源查询缓存的最大条目数与过期时间（秒）
+ETYMOLOGY_CACHE_SIZE = int(os.environ.get("ETYMOLOGY_CACHE_SIZE", '5000'))
+ETYMOLOGY_CACHE_TTL = float(os.environ.get("ETYMOLOGY_CACHE_TTL", '600'))
+# 读穿缓存在 ETag 之外的请求中沿用表版本的秒数，其他实例的写入最多延迟这么久可见，为 0 时每次查询表版本
+TABLE_VERSION_CACHE_TTL = float(os.environ.get("TABLE_VERSION_CACHE_TTL", '10'))
+
+# 批量字源查询单次允许的最多汉字数（去重后）
+ETYMOLOGY_BATCH_MAX = int(os.environ.get("ETYMOLOGY_BATCH_MAX", '500'))
+
+# 安装了 orjson 时是否用它序列化响应
+JSON_FAST_ENCODER = os.environ.get("JSON_FAST_ENCODER", 'true').lower() == 'true'
+
+# 响应压缩：小于该字节数的响应不压缩，以及 gzip/brotli 的压缩级别
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", '1024'))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", '6'))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", '5'))
+
+# 批量导入每个事务插入的行数、允许的最大值，以及响应中最多列出的错误行数
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", '500'))
+BULK_CHUNK_SIZE_MAX = int(os.environ.get("BULK_CHUNK_SIZE_MAX", '5000'))
+BULK_MAX_REPORTED_ERRORS = int(os.environ.get("BULK_MAX_REPORTED_ERRORS", '1000'))
+
+# 增量同步接口每批从数据库服务端游标读取的行数
+SYNC_BATCH_SIZE = int(os.environ.get("SYNC_BATCH_SIZE", '1000'))
+
+# 数据库连接池（仅 MySQL 生效）：常驻连接数、高峰时额外允许的连接数、连接回收时间（秒）、
+# 使用前是否探活以及等待空闲连接的超时时间（秒）
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", '5'))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", '10'))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", '1800'))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", 'true').lower() == 'true'
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", '10'))
+
+# ASGI 入口（wxcloudrun.asgi）：异步读连接池的常驻与额外连接数，以及执行写接口等同步代码的线程数
+ASYNC_DB_POOL_SIZE = int(os.environ.get("ASYNC_DB_POOL_SIZE", '20'))
+ASYNC_DB_MAX_OVERFLOW = int(os.environ.get("ASYNC_DB_MAX_OVERFLOW", '20'))
+ASYNC_SYNC_THREADS = int(os.environ.get("ASYNC_SYNC_THREADS", '16'))
+
+# 启动时是否检查模型声明的索引在数据库中是否存在
+SCHEMA_CHECK_ON_STARTUP = os.environ.get("SCHEMA_CHECK_ON_STARTUP", 'true').lower() == 'true'
+
+# 慢查询日志阈值（毫秒），为 0 时关闭；开启后记录语句、参数与发起查询的接口
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", '0'))
+
+# 多 worker 部署时各工作进程写入指标快照的目录，任一进程响应 /metrics 时合并全部进程的指标；为空时只输出本进程
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", '')
+
+# 运维接口（/metrics、/api/cache/stats、/api/pool/stats）的访问令牌，请求头为 Authorization: Bearer <令牌>；
+# 为空时只允许本机访问
+OPS_TOKEN = os.environ.get("OPS_TOKEN", '')
@@ -0,0 +1,89 @@
+# gunicorn 生产环境配置，启动命令：gunicorn -c gunicorn.conf.py wxcloudrun:app
+import os
+
+
+def container_cpus():
+    """
+    容器可用的 CPU 数（即 container.config.json 中的 cpu），读取 cgroup 配额，读不到时退回 os.cpu_count()
+    """
+    try:
+        # cgroup v2，内容如 "100000 100000"，不限额时为 "max 100000"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, int(quota / period))
+    except (OSError, ValueError):
+        pass
+    return os.cpu_count() or 1
+
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '80'))
+
+# 进程数默认按 gunicorn 推荐的 2 * CPU + 1，每个进程再开多个线程处理等待数据库的请求
+workers = int(os.environ.get('GUNICORN_WORKERS', container_cpus() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+# fork 之前加载应用，子进程共享模板、代码等只读内存
+preload_app = True
+
+# 收到 SIGTERM 后等待进行中的请求完成的时间
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def when_ready(server):
+    # fork 之前在 master 中建立诗词倒排索引与联想索引，工作进程共享同一份内存，请求线程不再全量建立
+    import gc
+
+    import config
+    from wxcloudrun import app, db
+    from wxcloudrun.search_index import poetry_index
+    from wxcloudrun.suggest import poetry_suggester, character_suggester
+    with app.app_context():
+        if config.POETRY_INDEX_ENABLED:
+            try:
+                poetry_index.build()
+            except Exception as e:
+                # 数据库不可用或尚未迁移时照常启动，工作进程之后在后台线程中重建，期间检索回退为全表扫描
+                server.log.warning('poetry index build failed before fork: %s', e)
+        try:
+            poetry_suggester.build()
+            character_suggester.build()
+            character_suggester.reweigh()
+        except Exception as e:
+            server.log.warning('suggest index build failed before fork: %s', e)
+        # 预加载与建索引用过的数据库连接不能跨进程共享，在 fork 之前由 master 关闭一次，
+        # 子进程从空连接池开始；若在子进程中 dispose，会经共享的套接字关闭 master 与其他子进程的连接
+        db.session.remove()
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or {}):
+            db.get_engine(app, bind=bind).dispose()
+    # 之后不再回收这些对象，避免垃圾回收改写对象头导致共享内存页被复制
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    # 退出前写回计数缓冲中尚未刷新的增量
+    from wxcloudrun.counter import flush_count
+    flush_count()
+
+
+def child_exit(server, worker):
+    # 删除已退出工作进程的指标快照，/metrics 不再输出它的序列
+    from wxcloudrun.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -1,7 +1,8 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 import pymysql
 import config
+from wxcloudrun.pool import engine_options
+from wxcloudrun.routing import REPLICA_BIND, RoutingSQLAlchemy, replica_uri
 
 # 因MySQLDB不支持Python3，使用pymysql扩展库代替MySQLDB库
 pymysql.install_as_MySQLdb()
@@ -11,14 +12,41 @@ app = Flask(__name__, instance_relative_config=True)
 app.config['DEBUG'] = config.DEBUG
 
 # 设定数据库链接
-app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql://{}:{}@{}/flask_demo'.format(config.username, config.password,
-                                                                             config.db_address)
+app.config['SQLALCHEMY_DATABASE_URI'] = config.database_uri or 'mysql://{}:{}@{}/flask_demo'.format(
+    config.username, config.password, config.db_address)
 
-# 初始化DB操作对象
-db = SQLAlchemy(app)
+# 设定只读副本，未配置时全部查询走主库
+if replica_uri(config):
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: replica_uri(config)}
+
+# 设定数据库连接池
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config)
+
+# 初始化DB操作对象，读查询按配置路由到只读副本
+db = RoutingSQLAlchemy(app)
+
+# 加载请求指标，须先于其他 after_request 钩子注册，才能统计到压缩后的耗时与字节数
+from wxcloudrun import metrics
 
 # 加载控制器
 from wxcloudrun import views
 
+# 加载响应压缩
+from wxcloudrun import compression
+
+# 加载命令行工具
+from wxcloudrun import commands
+
 # 加载配置
 app.config.from_object('config')
+
+# 检查数据库索引
+if config.SCHEMA_CHECK_ON_STARTUP:
+    from wxcloudrun.migrations import check_indexes
+    with app.app_context():
+        check_indexes()
+
+# 加载历法、天文参考数据快照
+from wxcloudrun.reference_data import load_snapshots
+with app.app_context():
+    load_snapshots()
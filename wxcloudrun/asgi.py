@@ -0,0 +1,261 @@
+"""
+ASGI 入口：读多写少的 GET 接口在事件循环中用异步驱动查询，一个进程可同时等待大量数据库往返；
+其余请求（写接口、批量导入等）原样交给 Flask 应用，在线程池中执行；接口实现与同步视图共用 read_api
+
+gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker wxcloudrun.asgi:application
+"""
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from werkzeug.exceptions import HTTPException
+
+import config
+from wxcloudrun import app
+from wxcloudrun import async_dao, read_api
+from wxcloudrun.async_dao import async_engines, run_plan, run_sync
+from wxcloudrun.cache import request_versions
+from wxcloudrun.http_cache import conditional_response, add_cache_headers
+from wxcloudrun.model import Poetry, CharacterEtymology, CulturalKnowledge
+from wxcloudrun.reference_data import calendar_snapshot, astronomy_snapshot
+
+# {视图的 endpoint: 异步实现}，URL 匹配与同步视图共用 app.url_map
+async_views = {}
+
+# 执行 Flask 应用与 run_sync 的线程池，工作进程启动（lifespan）时创建
+_executor = None
+
+
+def async_view(endpoint):
+    """登记某个 GET 视图的异步实现"""
+    def decorator(view):
+        async_views[endpoint] = view
+        return view
+    return decorator
+
+
+def async_cache_by_versions(get_versions, max_age=0):
+    """http_cache.cache_by_versions 的异步版本，get_versions 为协程函数"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper():
+            versions = await get_versions()
+            if versions is None:
+                return await view()
+            etag, response = conditional_response(versions, max_age)
+            if response is not None:
+                return response
+            token = request_versions.set(versions)
+            try:
+                return add_cache_headers(await view(), etag, max_age)
+            finally:
+                request_versions.reset(token)
+        return wrapper
+    return decorator
+
+
+def async_cache_by_table_version(*models, max_age=0):
+    """按相关表在数据库中的版本做条件请求"""
+    table_names = [model.__tablename__ for model in models]
+    return async_cache_by_versions(lambda: async_dao.query_table_versions(table_names), max_age)
+
+
+def _snapshot_versions(snapshot):
+    # 快照过期时的版本比对走同步会话，放到线程池执行
+    return lambda: run_sync(snapshot.versions)
+
+
+# 诗词相关API
+@async_view('search_poetry')
+@async_cache_by_table_version(Poetry, max_age=60)
+async def search_poetry():
+    """搜索诗词"""
+    return await run_plan(read_api.search_poetry())
+
+
+@async_view('get_random_poetry')
+async def get_random_poetry():
+    """获取随机诗词"""
+    return await run_plan(read_api.get_random_poetry())
+
+
+# 汉字字源相关API
+@async_view('search_character_etymology')
+@async_cache_by_table_version(CharacterEtymology, max_age=300)
+async def search_character_etymology():
+    """查询单个汉字的字源信息"""
+    return await run_plan(read_api.search_character_etymology())
+
+
+@async_view('get_characters_by_radical')
+@async_cache_by_table_version(CharacterEtymology, max_age=300)
+async def get_characters_by_radical():
+    """按部首查询汉字"""
+    return await run_plan(read_api.get_characters_by_radical())
+
+
+@async_view('get_characters_by_stroke_count')
+@async_cache_by_table_version(CharacterEtymology, max_age=300)
+async def get_characters_by_stroke_count():
+    """按笔画数查询汉字"""
+    return await run_plan(read_api.get_characters_by_stroke_count())
+
+
+# 历法知识相关API
+@async_view('get_solar_terms')
+@async_cache_by_versions(_snapshot_versions(calendar_snapshot), max_age=300)
+async def get_solar_terms():
+    """获取节气信息"""
+    return await run_plan(read_api.get_solar_terms())
+
+
+@async_view('get_festivals')
+@async_cache_by_versions(_snapshot_versions(calendar_snapshot), max_age=300)
+async def get_festivals():
+    """获取传统节日"""
+    return await run_plan(read_api.get_festivals())
+
+
+# 天文知识相关API
+@async_view('get_constellations')
+@async_cache_by_versions(_snapshot_versions(astronomy_snapshot), max_age=300)
+async def get_constellations():
+    """获取星宿信息"""
+    return await run_plan(read_api.get_constellations())
+
+
+# 文化百科相关API
+@async_view('get_daily_culture')
+async def get_daily_culture():
+    """获取每日文化知识，同一天内所有请求返回同一条"""
+    return await run_plan(read_api.get_daily_culture())
+
+
+@async_view('get_culture_by_category')
+@async_cache_by_table_version(CulturalKnowledge, max_age=300)
+async def get_culture_by_category():
+    """根据分类获取文化知识"""
+    return await run_plan(read_api.get_culture_by_category())
+
+
+def _build_environ(scope, body):
+    """由 ASGI 的 HTTP scope 与请求体构造 WSGI environ"""
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope['http_version']),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def _call_wsgi(scope, receive, send):
+    """读完请求体后在线程池中执行 Flask 应用，各请求并发执行"""
+    with SpooledTemporaryFile(max_size=65536) as body:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        environ = _build_environ(scope, body)
+        response = await asyncio.get_running_loop().run_in_executor(
+            _executor, partial(app.response_class.from_app, app, environ, buffered=True))
+    await _send_response(response, send)
+
+
+def _match_async_view(environ):
+    """按 app.url_map 匹配请求，有异步实现时返回它，否则返回 None"""
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return async_views.get(endpoint)
+
+
+async def _dispatch(view, environ):
+    """
+    在请求上下文中执行异步视图，before_request/after_request 钩子（指标、压缩等）与同步请求相同
+    Flask 的请求上下文基于 contextvars，各请求的协程互不干扰
+    """
+    ctx = app.request_context(environ)
+    error = None
+    ctx.push()
+    try:
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await view()
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        return app.finalize_request(rv)
+    except Exception as e:
+        error = e
+        return app.handle_exception(e)
+    finally:
+        ctx.pop(error)
+
+
+async def _send_response(response, send):
+    headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            global _executor
+            _executor = ThreadPoolExecutor(config.ASYNC_SYNC_THREADS)
+            asyncio.get_running_loop().set_default_executor(_executor)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_engines.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    if scope['method'] == 'GET':
+        environ = _build_environ(scope, BytesIO())
+        view = _match_async_view(environ)
+        if view is not None:
+            return await _send_response(await _dispatch(view, environ), send)
+    await _call_wsgi(scope, receive, send)
@@ -0,0 +1,114 @@
+import asyncio
+from functools import partial
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import config
+from wxcloudrun import app
+from wxcloudrun import queries
+from wxcloudrun.pool import async_engine_options
+from wxcloudrun.routing import replica_health, replica_uri
+
+# 各数据库对应的异步驱动
+ASYNC_DRIVERS = {'mysql': 'aiomysql', 'sqlite': 'aiosqlite'}
+
+
+def async_uri(uri):
+    """把同步连接串换成异步驱动，如 mysql:// -> mysql+aiomysql://"""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError('不支持异步查询的数据库: {}'.format(backend))
+    return url.set(drivername='{}+{}'.format(backend, ASYNC_DRIVERS[backend]))
+
+
+class AsyncEngines(object):
+    """
+    异步读查询使用的引擎，配置了只读副本时优先读副本
+    引擎绑定事件循环，须在工作进程内（fork 之后）首次使用时创建
+    """
+
+    def __init__(self):
+        self._primary = None
+        self._replica = None
+
+    def _create(self, uri):
+        url = async_uri(uri)
+        return create_async_engine(url, **async_engine_options(config, url))
+
+    def primary(self):
+        if self._primary is None:
+            self._primary = self._create(app.config['SQLALCHEMY_DATABASE_URI'])
+        return self._primary
+
+    def reader(self):
+        """读查询使用的引擎，副本标记为不可用期间返回主库"""
+        uri = replica_uri(config)
+        if uri is None or replica_health.is_down():
+            return self.primary()
+        if self._replica is None:
+            self._replica = self._create(uri)
+        return self._replica
+
+    async def dispose(self):
+        for engine in (self._primary, self._replica):
+            if engine is not None:
+                await engine.dispose()
+        self._primary = self._replica = None
+
+
+async_engines = AsyncEngines()
+
+
+async def _fetch_all(statement):
+    """在读引擎上执行查询并返回全部行，副本连接失败时标记不可用并改读主库"""
+    engine = async_engines.reader()
+    try:
+        async with engine.connect() as conn:
+            return (await conn.execute(statement)).all()
+    except OperationalError as e:
+        if engine is async_engines.primary():
+            raise
+        replica_health.mark_down(e)
+    async with async_engines.primary().connect() as conn:
+        return (await conn.execute(statement)).all()
+
+
+def _in_app_context(fn, *args):
+    with app.app_context():
+        return fn(*args)
+
+
+async def run_sync(fn, *args):
+    """
+    在线程池中以应用上下文执行同步函数，不阻塞事件循环
+    用于维护倒排索引、id 池、参考数据快照等仍通过同步会话加载的进程内结构，以及查询计划中生成的函数
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, partial(_in_app_context, fn, *args))
+
+
+async def run_plan(plan):
+    """
+    异步执行 queries 中的查询计划：语句在读引擎上查询并送回全部行，函数放到线程池执行并送回返回值，出错时把异常抛回计划
+    :return: 计划的返回值
+    """
+    value, error = None, None
+    while True:
+        try:
+            step = plan.send(value) if error is None else plan.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = (await run_sync(step) if callable(step) else await _fetch_all(step)), None
+        except Exception as e:
+            value, error = None, e
+
+
+async def query_table_versions(table_names):
+    """
+    查询多张表的版本
+    :return: {表名: 版本}，从未写入过的表版本为0
+    """
+    return await run_plan(queries.table_versions(table_names))
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+# 未命中时 get 返回的哨兵，用于区分“未缓存”与“缓存了 None”（负缓存）
+MISSING = object()
+
+# 已创建的缓存，按名称登记，供统计接口读取
+caches = {}
+
+# 当前请求生成 ETag 时读到的 {表名: 版本}，读穿缓存据此判断条目是否过期，不必再查一次版本
+request_versions = ContextVar('request_versions', default=None)
+
+
+class TTLCache(object):
+    """
+    进程内的 LRU + TTL 缓存，线程安全
+    超过 maxsize 时淘汰最久未使用的条目，条目写入 ttl 秒后过期
+    条目可带上写入时的数据版本，读取时版本不同视为未命中，其他进程写入后不会读到旧值
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        caches[name] = self
+
+    def get(self, key, version=None):
+        """
+        :param version: 当前数据版本，为 None 时不比对
+        :return: 缓存值（可能为 None），未命中、已过期或版本不同时返回 MISSING
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] <= time.monotonic() or (version is not None and item[2] != version):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, version=None):
+        """:param version: 读取 value 之前读到的数据版本"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl, version)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """命中/未命中次数与当前大小，用于评估容量"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None
+        }
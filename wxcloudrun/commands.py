@@ -0,0 +1,68 @@
+import os
+
+import click
+
+from wxcloudrun import app
+from wxcloudrun.ingest import MODELS
+from wxcloudrun.loader import Checkpoint, detect_format, load_corpus
+from wxcloudrun.migrations import upgrade, missing_indexes
+from wxcloudrun.offline_bundle import offline_bundle
+from wxcloudrun.write_queue import write_queue
+
+
+@app.cli.command('load-corpus')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--table', type=click.Choice(sorted(MODELS)), required=True, help='导入的目标表')
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'ndjson', 'json', 'csv']), default='auto',
+              help='语料格式，auto 按扩展名判断')
+@click.option('--chunk-size', type=click.IntRange(1), default=1000, show_default=True, help='每个事务写入的记录数')
+@click.option('--workers', type=click.IntRange(1), default=os.cpu_count() or 1, show_default=True,
+              help='解析校验进程数，为 1 时不启用进程池')
+@click.option('--checkpoint', 'checkpoint_path', default=None, help='断点文件，默认为语料文件名加 .checkpoint')
+@click.option('--restart', is_flag=True, help='忽略已有断点，从头导入')
+def load_corpus_command(path, table, fmt, chunk_size, workers, checkpoint_path, restart):
+    """从 NDJSON/JSON/CSV 语料文件幂等导入知识数据，中断后重新运行会从断点继续"""
+    checkpoint = Checkpoint(checkpoint_path or path + '.checkpoint', os.path.abspath(path))
+    if not restart:
+        try:
+            checkpoint.load()
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    fmt = detect_format(path) if fmt == 'auto' else fmt
+    state = load_corpus(MODELS[table], path, fmt, chunk_size, workers, checkpoint, click.echo)
+    click.echo('导入完成：共 {} 条，新增 {}，更新 {}，失败 {}'.format(
+        state['records'], state['inserted'], state['updated'], state['failed']))
+
+
+@app.cli.command('db-upgrade')
+@click.option('--dedupe', is_flag=True, help='建唯一索引前删除重复的汉字，只保留 id 最小的一行')
+def db_upgrade_command(dedupe):
+    """执行尚未执行的数据库结构迁移（建表、建索引、增加变更序号），有重复的汉字时中止"""
+    try:
+        executed = upgrade(echo=click.echo, dedupe=dedupe)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo('已执行迁移: {}'.format(executed) if executed else '数据库结构已是最新')
+    missing = missing_indexes()
+    if missing:
+        raise click.ClickException('仍缺失索引: {}'.format(', '.join(missing)))
+
+
+@app.cli.command('write-queue-compact')
+@click.option('--keep-days', type=click.FloatRange(0), default=7, show_default=True, help='保留最近几天的写入结果')
+def write_queue_compact_command(keep_days):
+    """去掉异步写入队列中已写库的记录，并清理过期的写入结果"""
+    pending, kept = write_queue.compact(keep_days * 86400)
+    click.echo('压缩完成：待写入 {} 条，保留结果 {} 条'.format(pending, kept))
+
+
+@app.cli.command('offline-bundle-build')
+@click.option('--force', is_flag=True, help='表版本未变化时也重新生成')
+def offline_bundle_build_command(force):
+    """导出字源、历法、天文、文化知识表的离线快照包，表版本未变化时跳过"""
+    manifest, built = offline_bundle.build(force=force)
+    if manifest is None:
+        raise click.ClickException('生成失败，请检查数据库连接')
+    click.echo('{}：{}（{} 字节，since={}，sha256={}）'.format(
+        '已生成' if built else '表版本未变化，沿用', manifest['file'], manifest['size'], manifest['since'],
+        manifest['sha256']))
@@ -0,0 +1,79 @@
+import gzip
+
+from flask import request, Response
+
+import config
+from wxcloudrun import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 需要压缩的响应类型，图片等已压缩的内容不再压缩
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'application/x-ndjson')
+
+
+def _is_compressible(mimetype):
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def negotiate_encoding():
+    """
+    按请求的 Accept-Encoding 选择压缩算法，质量相同时优先 brotli
+    :return: 'br'、'gzip' 或 None
+    """
+    accept = request.accept_encodings
+    candidates = [('gzip', accept.quality('gzip'))]
+    if brotli is not None:
+        candidates.insert(0, ('br', accept.quality('br')))
+    encoding, quality = max(candidates, key=lambda item: item[1])
+    return encoding if quality > 0 else None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config.BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=config.GZIP_LEVEL)
+
+
+class PrecompressedPage(object):
+    """内容固定的页面，启动时压缩好各编码的版本，请求时只做协商"""
+
+    def __init__(self, body, mimetype='text/html'):
+        self.mimetype = mimetype
+        self._bodies = {None: body, 'gzip': compress(body, 'gzip')}
+        if brotli is not None:
+            self._bodies['br'] = compress(body, 'br')
+
+    def response(self):
+        encoding = negotiate_encoding()
+        response = Response(self._bodies[encoding], content_type='{}; charset=utf-8'.format(self.mimetype))
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+@app.after_request
+def compress_response(response):
+    """按协商结果压缩达到最小长度的文本类响应，流式响应与文件不做处理"""
+    if response.direct_passthrough or response.is_streamed \
+            or response.status_code < 200 or response.status_code in (204, 206, 304) \
+            or 'Content-Encoding' in response.headers \
+            or not _is_compressible(response.mimetype or ''):
+        return response
+    data = response.get_data()
+    if len(data) < config.COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # 强 ETag 对应具体字节，压缩后的表示使用带编码后缀的 ETag
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag('{}-{}'.format(etag, encoding), weak)
+    return response
@@ -0,0 +1,112 @@
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+
+import config
+from wxcloudrun import app
+from wxcloudrun.dao import increment_counter_shard, query_counter_total, delete_counter_shards
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+
+def _random_shard():
+    """随机选择一个分片，分片ID为1..COUNTER_SHARDS，1号分片即原先的单行计数"""
+    return random.randint(1, config.COUNTER_SHARDS)
+
+
+class CounterBuffer(object):
+    """
+    进程内的计数写入合并缓冲
+    自增只累加到内存，由后台线程每隔 COUNTER_FLUSH_INTERVAL 秒合并成一次分片更新，写入失败的增量留到下次
+    缓冲记录上次刷新时的清零纪元，任一进程清零后，其他进程清零前累积的增量在刷新时丢弃；
+    纪元只在刷新时比对，清零前后一个刷新间隔内的自增可能被一并丢弃；
+    没有增量时不访问数据库并忘掉纪元，首次刷新与空闲之后第一次刷新的增量不比对
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._epoch = None
+        self._pid = None
+
+    def _ensure_flusher(self):
+        # 线程不会随 fork 复制到子进程，按进程号懒启动
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name='counter-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(config.COUNTER_FLUSH_INTERVAL)
+            self.flush()
+
+    def add(self, delta):
+        with self._lock:
+            self._ensure_flusher()
+            self._pending += delta
+
+    def pending(self):
+        return self._pending
+
+    def discard(self, epoch=None):
+        """丢弃未刷新的增量，epoch 为本进程清零后的新纪元"""
+        with self._lock:
+            self._pending = 0
+            if epoch is not None:
+                self._epoch = epoch
+
+    def flush(self):
+        """把缓冲的增量写入一个随机分片，失败时放回缓冲"""
+        with self._lock:
+            delta, self._pending = self._pending, 0
+            epoch = self._epoch
+            if delta == 0:
+                # 空闲期间其他进程可能已清零，旧纪元会让之后的增量被误丢弃
+                self._epoch = None
+                return
+        current = None
+        try:
+            with app.app_context():
+                current = increment_counter_shard(_random_shard(), delta, epoch)
+        except Exception as e:
+            logger.info("counter flush errorMsg= {} ".format(e))
+        with self._lock:
+            if current is None:
+                self._pending += delta
+            else:
+                self._epoch = current
+
+
+_buffer = CounterBuffer()
+atexit.register(_buffer.flush)
+
+
+def increase_count():
+    """计数加一"""
+    if config.COUNTER_FLUSH_INTERVAL > 0:
+        _buffer.add(1)
+    else:
+        increment_counter_shard(_random_shard())
+
+
+def query_count():
+    """
+    当前计数：全部分片之和加上本进程尚未刷新的增量
+    :return: 计数值
+    """
+    return (query_counter_total(config.COUNTER_SHARDS) or 0) + _buffer.pending()
+
+
+def flush_count():
+    """把本进程尚未刷新的增量写入数据库，进程退出前调用"""
+    _buffer.flush()
+
+
+def clear_count():
+    """计数清零，丢弃本进程尚未刷新的增量，其他进程清零前累积的增量在其下次刷新时丢弃"""
+    _buffer.discard(delete_counter_shards(config.COUNTER_SHARDS))
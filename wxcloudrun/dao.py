@@ -1,212 +1,474 @@
 import logging
+from datetime import datetime
 
-from sqlalchemy.exc import OperationalError
-from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+from sqlalchemy import tuple_
 
+import config
 from wxcloudrun import db
-from wxcloudrun.model import Counters, Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge
+from wxcloudrun import queries
+from wxcloudrun.model import Counters, Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge, \
+    TableVersions, WriteTickets, CHANGE_SEQ_KEY, COUNTER_EPOCH_KEY
+from wxcloudrun.queries import IN_CHUNK_SIZE, etymology_cache, table_version_cache
+from wxcloudrun.reference_data import calendar_snapshot, astronomy_snapshot
+from wxcloudrun.sampler import poetry_id_pool, culture_id_pool
+from wxcloudrun.search_index import poetry_index
+from wxcloudrun.suggest import poetry_suggester, character_suggester, suggest
 
 # 初始化日志
 logger = logging.getLogger('log')
 
 
-def query_counterbyid(id):
+def run_plan(plan):
     """
-    根据ID查询Counter实体
-    :param id: Counter的ID
-    :return: Counter实体
+    在同步会话中执行 queries 中的查询计划：语句在会话中查询并送回全部行，函数直接调用并送回返回值，出错时把异常抛回计划
+    :return: 计划的返回值
     """
-    try:
-        return Counters.query.filter(Counters.id == id).first()
-    except OperationalError as e:
-        logger.info("query_counterbyid errorMsg= {} ".format(e))
-        return None
+    value, error = None, None
+    while True:
+        try:
+            step = plan.send(value) if error is None else plan.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = (step() if callable(step) else db.session.execute(step).all()), None
+        except Exception as e:
+            value, error = None, e
 
 
-def delete_counterbyid(id):
+def current_table_version(model):
+    """表的当前版本，见 queries.current_table_version"""
+    return run_plan(queries.current_table_version(model))
+
+
+def increment_counter_shard(shard_id, delta=1, epoch=None):
     """
-    根据ID删除Counter实体
-    :param id: Counter的ID
+    在数据库内原子地给计数分片加 delta，分片不存在时创建
+    :param shard_id: 分片对应的Counter的ID
+    :param delta: 增量
+    :param epoch: 增量开始累积时的清零纪元，与当前纪元不同说明期间计数已被清零，丢弃增量；为 None 时不检查
+    :return: 当前清零纪元，写入失败时返回 None
     """
     try:
-        counter = Counters.query.get(id)
-        if counter is None:
-            return
-        db.session.delete(counter)
+        # 共享锁读取纪元，与清零事务互斥，清零之后不会再写入清零之前累积的增量
+        current = db.session.query(TableVersions.version) \
+            .filter(TableVersions.table_name == COUNTER_EPOCH_KEY) \
+            .with_for_update(read=True) \
+            .scalar() or 0
+        if delta and (epoch is None or epoch == current):
+            now = datetime.now()
+            updated = Counters.query.filter(Counters.id == shard_id).update(
+                {Counters.count: Counters.count + delta, Counters.updated_at: now}, synchronize_session=False)
+            if updated == 0:
+                db.session.add(Counters(id=shard_id, count=delta, created_at=now, updated_at=now))
         db.session.commit()
+        return current
+    except IntegrityError:
+        # 其他实例并发创建了同一分片，改为更新
+        db.session.rollback()
+        return increment_counter_shard(shard_id, delta, epoch)
     except OperationalError as e:
-        logger.info("delete_counterbyid errorMsg= {} ".format(e))
+        db.session.rollback()
+        logger.info("increment_counter_shard errorMsg= {} ".format(e))
+        return None
 
 
-def insert_counter(counter):
+def query_counter_total(shard_count):
     """
-    插入一个Counter实体
-    :param counter: Counters实体
+    汇总全部计数分片
+    :param shard_count: 分片数，分片ID为1..shard_count
+    :return: 计数总和
     """
     try:
-        db.session.add(counter)
-        db.session.commit()
+        # MySQL 的 SUM 返回 Decimal，转换为 int 以便序列化
+        return int(db.session.query(db.func.coalesce(db.func.sum(Counters.count), 0))
+                   .filter(Counters.id.between(1, shard_count)).scalar())
     except OperationalError as e:
-        logger.info("insert_counter errorMsg= {} ".format(e))
+        logger.info("query_counter_total errorMsg= {} ".format(e))
+        return None
 
 
-def update_counterbyid(counter):
+def delete_counter_shards(shard_count):
     """
-    根据ID更新counter的值
-    :param counter实体
+    删除全部计数分片并把清零纪元加一，各进程缓冲中清零之前累积的增量不再写入
+    :param shard_count: 分片数，分片ID为1..shard_count
+    :return: 新的清零纪元，失败时返回 None
     """
     try:
-        counter = query_counterbyid(counter.id)
-        if counter is None:
-            return
-        db.session.flush()
+        Counters.query.filter(Counters.id.between(1, shard_count)).delete(synchronize_session=False)
+        bump_table_version(COUNTER_EPOCH_KEY)
+        epoch = db.session.query(TableVersions.version) \
+            .filter(TableVersions.table_name == COUNTER_EPOCH_KEY).scalar()
         db.session.commit()
+        return epoch
+    except IntegrityError:
+        # 其他实例并发创建了纪元行，重新清零
+        db.session.rollback()
+        return delete_counter_shards(shard_count)
     except OperationalError as e:
-        logger.info("update_counterbyid errorMsg= {} ".format(e))
+        db.session.rollback()
+        logger.info("delete_counter_shards errorMsg= {} ".format(e))
+        return None
 
 
-# 诗词相关DAO函数
-def query_poetry_by_keyword(keyword):
-    """根据关键词搜索诗词"""
+def bump_table_version(table_name):
+    """
+    在当前事务中把表版本加一，随调用方的 commit 一起提交
+    :param table_name: 表名
+    """
+    updated = TableVersions.query.filter(TableVersions.table_name == table_name).update(
+        {TableVersions.version: TableVersions.version + 1}, synchronize_session=False)
+    if updated == 0:
+        db.session.add(TableVersions(table_name=table_name, version=1))
+
+
+def reserve_change_seqs(count):
+    """
+    在当前事务中预留 count 个连续的全局变更序号，随调用方的 commit 一起提交
+    序号行的行锁保持到事务结束，各写入事务取得序号的顺序与提交顺序一致，
+    增量同步按序号读取时不会漏掉晚提交、序号却更小的记录
+    :return: 第一个序号
+    """
+    updated = TableVersions.query.filter(TableVersions.table_name == CHANGE_SEQ_KEY).update(
+        {TableVersions.version: TableVersions.version + count}, synchronize_session=False)
+    if updated == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.add(TableVersions(table_name=CHANGE_SEQ_KEY, version=count))
+            return 1
+        except IntegrityError:
+            # 并发的首次写入已插入序号行，回滚到保存点后改为在该行上累加
+            TableVersions.query.filter(TableVersions.table_name == CHANGE_SEQ_KEY).update(
+                {TableVersions.version: TableVersions.version + count}, synchronize_session=False)
+    last = db.session.query(TableVersions.version).filter(TableVersions.table_name == CHANGE_SEQ_KEY).scalar()
+    return last - count + 1
+
+
+def _stamp_rows(rows):
+    """为一批待写入的字段字典分配变更序号"""
+    first = reserve_change_seqs(len(rows))
+    return [dict(row, change_seq=first + i) for i, row in enumerate(rows)]
+
+
+def query_change_seq():
+    """
+    查询当前的全局变更序号
+    :return: 序号，尚无写入时为0
+    """
     try:
-        return Poetry.query.filter(
-            or_(
-                Poetry.title.contains(keyword),
-                Poetry.author.contains(keyword),
-                Poetry.content.contains(keyword),
-                Poetry.tags.contains(keyword)
-            )
-        ).all()
+        version = db.session.query(TableVersions.version) \
+            .filter(TableVersions.table_name == CHANGE_SEQ_KEY).scalar()
+        return version or 0
     except OperationalError as e:
-        logger.info("query_poetry_by_keyword errorMsg= {} ".format(e))
+        logger.info("query_change_seq errorMsg= {} ".format(e))
         return None
 
 
-def query_poetry_by_author(author):
-    """根据作者搜索诗词"""
+def iter_changes(model, since, until, columns):
+    """
+    按变更序号升序流式读取序号在 (since, until] 内的记录，服务端游标每次取 SYNC_BATCH_SIZE 行
+    :param columns: 列属性列表
+    """
+    return db.session.query(*columns) \
+        .filter(model.change_seq > since, model.change_seq <= until) \
+        .order_by(model.change_seq) \
+        .yield_per(config.SYNC_BATCH_SIZE)
+
+
+def query_table_versions(table_names):
+    """
+    查询多张表的版本
+    :param table_names: 表名列表
+    :return: {表名: 版本}，从未写入过的表版本为0
+    """
+    return run_plan(queries.table_versions(table_names))
+
+
+def _after_insert(model, rows):
+    """新增记录提交后同步进程内的索引、id 池与缓存"""
+    table_version_cache.invalidate(model.__tablename__)
+    if model is Poetry:
+        poetry_index.on_insert()
+        poetry_id_pool.on_insert()
+        poetry_suggester.on_insert()
+    elif model is CulturalKnowledge:
+        culture_id_pool.on_insert()
+    elif model is CalendarKnowledge:
+        calendar_snapshot.on_insert()
+    elif model is AstronomyKnowledge:
+        astronomy_snapshot.on_insert()
+    elif model is CharacterEtymology:
+        character_suggester.on_insert()
+        for row in rows:
+            etymology_cache.invalidate(row['character'])
+
+
+def insert_rows(model, rows):
+    """
+    用一条多行 INSERT（executemany）插入一批记录并在一个事务中提交
+    与单行插入不同，失败时回滚并抛出异常，由调用方决定如何拆分重试
+    :param model: 模型类
+    :param rows: 字段字典列表
+    """
+    try:
+        db.session.execute(model.__table__.insert(), _stamp_rows(rows))
+        bump_table_version(model.__tablename__)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    _after_insert(model, rows)
+
+
+def insert_entities(model, rows, tickets=None):
+    """
+    以实体逐行 INSERT 一批记录并在一个事务中提交，与 insert_rows 相比可以取回各行的自增 id
+    失败时回滚并抛出异常，由调用方决定如何拆分重试
+    :param model: 模型类
+    :param rows: 字段字典列表
+    :param tickets: 与 rows 顺序一致的写入队列 ticket，给出时在同一事务中写入 WriteTickets
+    :return: 与 rows 顺序一致的 id 列表
+    """
     try:
-        return Poetry.query.filter(Poetry.author.contains(author)).all()
+        entities = [model(**row) for row in _stamp_rows(rows)]
+        db.session.add_all(entities)
+        if tickets is not None:
+            db.session.flush()
+            db.session.add_all(WriteTickets(ticket=ticket, table_name=model.__tablename__, row_id=entity.id)
+                               for ticket, entity in zip(tickets, entities))
+        bump_table_version(model.__tablename__)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    _after_insert(model, rows)
+    return [entity.id for entity in entities]
+
+
+def query_write_tickets(tickets):
+    """
+    查询已写库的写入队列 ticket，失败时抛出异常
+    :return: {ticket: 写入记录的 id}
+    """
+    # 副本可能尚未同步刚提交的 ticket，须读主库
+    db.session().use_primary()
+    written = {}
+    for i in range(0, len(tickets), IN_CHUNK_SIZE):
+        chunk = tickets[i:i + IN_CHUNK_SIZE]
+        written.update(db.session.query(WriteTickets.ticket, WriteTickets.row_id)
+                       .filter(WriteTickets.ticket.in_(chunk)).all())
+    return written
+
+
+def delete_write_tickets(before):
+    """
+    删除 before 之前写入的 ticket
+    :return: 删除的条数，失败时返回 None
+    """
+    try:
+        deleted = WriteTickets.query.filter(WriteTickets.created_at < before).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
     except OperationalError as e:
-        logger.info("query_poetry_by_author errorMsg= {} ".format(e))
+        db.session.rollback()
+        logger.info("delete_write_tickets errorMsg= {} ".format(e))
         return None
 
 
+def upsert_rows(model, key_fields, rows):
+    """
+    按自然键幂等写入一批记录：键不存在时插入，存在且内容不同时更新，内容相同则跳过
+    失败时回滚并抛出异常，由调用方决定如何拆分重试
+    :param model: 模型类
+    :param key_fields: 自然键字段名，如 ('title', 'author')
+    :param rows: 字段相同的字典列表
+    :return: (插入行数, 更新行数)
+    """
+    batch = {}
+    for row in rows:
+        batch[tuple(row[f] for f in key_fields)] = row
+    if not batch:
+        return 0, 0
+    fields = list(rows[0])
+    key_columns = [getattr(model, f) for f in key_fields]
+    # 先读后写，比对的现有记录须来自主库
+    db.session().use_primary()
+    try:
+        existing = {}
+        keys = list(batch)
+        for i in range(0, len(keys), IN_CHUNK_SIZE):
+            chunk = keys[i:i + IN_CHUNK_SIZE]
+            if len(key_columns) == 1:
+                condition = key_columns[0].in_([key[0] for key in chunk])
+            else:
+                condition = tuple_(*key_columns).in_(chunk)
+            for record in db.session.query(model.id, *[getattr(model, f) for f in fields]).filter(condition):
+                existing[tuple(getattr(record, f) for f in key_fields)] = record
+        inserts = [row for key, row in batch.items() if key not in existing]
+        updates = [dict(row, id=existing[key].id) for key, row in batch.items()
+                   if key in existing and any(getattr(existing[key], f) != row[f] for f in fields)]
+        if inserts or updates:
+            stamped = _stamp_rows(inserts + updates)
+            if inserts:
+                db.session.execute(model.__table__.insert(), stamped[:len(inserts)])
+            if updates:
+                db.session.bulk_update_mappings(model, stamped[len(inserts):])
+            bump_table_version(model.__tablename__)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    _after_insert(model, inserts + updates)
+    return len(inserts), len(updates)
+
+
+# 诗词相关DAO函数
+def query_poetry_by_keyword(keyword, cursor=0, limit=None, columns=None):
+    """根据关键词搜索诗词，启用倒排索引时先求候选 id"""
+    return run_plan(queries.poetry_by_keyword(keyword, cursor, limit, columns))
+
+
+def query_poetry_by_author(author, cursor=0, limit=None, columns=None):
+    """根据作者搜索诗词"""
+    return run_plan(queries.poetry_by_author(author, cursor, limit, columns))
+
+
+def query_poetry_by_id(id):
+    """根据ID查询诗词"""
+    return run_plan(queries.poetry_by_id(id))
+
+
 def query_random_poetry():
     """获取随机诗词"""
-    try:
-        return Poetry.query.order_by(db.func.rand()).first()
-    except OperationalError as e:
-        logger.info("query_random_poetry errorMsg= {} ".format(e))
-        return None
+    return run_plan(queries.random_poetry())
 
 
 def insert_poetry(poetry):
     """插入诗词"""
     try:
+        poetry.change_seq = reserve_change_seqs(1)
         db.session.add(poetry)
+        bump_table_version(Poetry.__tablename__)
         db.session.commit()
+        table_version_cache.invalidate(Poetry.__tablename__)
+        poetry_index.on_insert()
+        poetry_id_pool.on_insert()
+        poetry_suggester.on_insert()
     except OperationalError as e:
         logger.info("insert_poetry errorMsg= {} ".format(e))
 
 
-# 汉字字源相关DAO函数
-def query_character_etymology(character):
-    """查询单个汉字的字源信息"""
+def query_suggestions(kind, prefix, limit):
+    """
+    作者、诗题或汉字的前缀联想
+    :param kind: author、title 或 character（按拼音前缀）
+    :return: [(联想词, 权重)]，按权重降序
+    """
     try:
-        return CharacterEtymology.query.filter(CharacterEtymology.character == character).first()
+        return suggest(kind, prefix, limit)
     except OperationalError as e:
-        logger.info("query_character_etymology errorMsg= {} ".format(e))
+        logger.info("query_suggestions errorMsg= {} ".format(e))
         return None
 
 
-def query_characters_by_radical(radical):
+# 汉字字源相关DAO函数
+def query_character_etymology(character):
+    """查询单个汉字的字源信息，先读缓存"""
+    return run_plan(queries.character_etymology(character))
+
+
+def query_character_etymologies(characters):
+    """批量查询汉字字源信息，返回 {汉字: 行或 None}"""
+    return run_plan(queries.character_etymologies(characters))
+
+
+def query_characters_by_radical(radical, cursor=0, limit=None, columns=None):
     """按部首查询汉字"""
-    try:
-        return CharacterEtymology.query.filter(CharacterEtymology.radical == radical).all()
-    except OperationalError as e:
-        logger.info("query_characters_by_radical errorMsg= {} ".format(e))
-        return None
+    return run_plan(queries.characters_by_radical(radical, cursor, limit, columns))
 
 
-def query_characters_by_stroke_count(stroke_count):
+def query_characters_by_stroke_count(stroke_count, cursor=0, limit=None, columns=None):
     """按笔画数查询汉字"""
-    try:
-        return CharacterEtymology.query.filter(CharacterEtymology.stroke_count == stroke_count).all()
-    except OperationalError as e:
-        logger.info("query_characters_by_stroke_count errorMsg= {} ".format(e))
-        return None
+    return run_plan(queries.characters_by_stroke_count(stroke_count, cursor, limit, columns))
 
 
 def insert_character_etymology(etymology):
     """插入汉字字源信息"""
     try:
+        character = etymology.character
+        etymology.change_seq = reserve_change_seqs(1)
         db.session.add(etymology)
+        bump_table_version(CharacterEtymology.__tablename__)
         db.session.commit()
+        table_version_cache.invalidate(CharacterEtymology.__tablename__)
+        etymology_cache.invalidate(character)
+        character_suggester.on_insert()
     except OperationalError as e:
         logger.info("insert_character_etymology errorMsg= {} ".format(e))
 
 
 # 历法知识相关DAO函数
-def query_calendar_knowledge_by_category(category):
+def query_calendar_knowledge_by_category(category, cursor=0, limit=None, columns=None):
     """根据分类查询历法知识"""
-    try:
-        return CalendarKnowledge.query.filter(CalendarKnowledge.category == category).all()
-    except OperationalError as e:
-        logger.info("query_calendar_knowledge_by_category errorMsg= {} ".format(e))
-        return None
+    return run_plan(queries.calendar_knowledge_by_category(category, cursor, limit, columns))
 
 
 def insert_calendar_knowledge(knowledge):
     """插入历法知识"""
     try:
+        knowledge.change_seq = reserve_change_seqs(1)
         db.session.add(knowledge)
+        bump_table_version(CalendarKnowledge.__tablename__)
         db.session.commit()
+        table_version_cache.invalidate(CalendarKnowledge.__tablename__)
+        calendar_snapshot.on_insert()
     except OperationalError as e:
         logger.info("insert_calendar_knowledge errorMsg= {} ".format(e))
 
 
 # 天文知识相关DAO函数
-def query_astronomy_knowledge_by_constellation(constellation):
+def query_astronomy_knowledge_by_constellation(constellation, cursor=0, limit=None, columns=None):
     """根据星宿查询天文知识"""
-    try:
-        return AstronomyKnowledge.query.filter(AstronomyKnowledge.constellation == constellation).all()
-    except OperationalError as e:
-        logger.info("query_astronomy_knowledge_by_constellation errorMsg= {} ".format(e))
-        return None
+    return run_plan(queries.astronomy_knowledge_by_constellation(constellation, cursor, limit, columns))
 
 
 def insert_astronomy_knowledge(knowledge):
     """插入天文知识"""
     try:
+        knowledge.change_seq = reserve_change_seqs(1)
         db.session.add(knowledge)
+        bump_table_version(AstronomyKnowledge.__tablename__)
         db.session.commit()
+        table_version_cache.invalidate(AstronomyKnowledge.__tablename__)
+        astronomy_snapshot.on_insert()
     except OperationalError as e:
         logger.info("insert_astronomy_knowledge errorMsg= {} ".format(e))
 
 
 # 文化百科相关DAO函数
-def query_cultural_knowledge_by_category(category):
+def query_cultural_knowledge_by_category(category, cursor=0, limit=None, columns=None):
     """根据分类查询文化知识"""
-    try:
-        return CulturalKnowledge.query.filter(CulturalKnowledge.category == category).all()
-    except OperationalError as e:
-        logger.info("query_cultural_knowledge_by_category errorMsg= {} ".format(e))
-        return None
+    return run_plan(queries.cultural_knowledge_by_category(category, cursor, limit, columns))
 
 
 def query_random_cultural_knowledge():
     """获取随机文化知识"""
-    try:
-        return CulturalKnowledge.query.order_by(db.func.rand()).first()
-    except OperationalError as e:
-        logger.info("query_random_cultural_knowledge errorMsg= {} ".format(e))
-        return None
+    return run_plan(queries.random_cultural_knowledge())
+
+
+def query_daily_cultural_knowledge(day):
+    """获取某一天的文化知识，同一天内返回同一条"""
+    return run_plan(queries.daily_cultural_knowledge(day))
 
 
 def insert_cultural_knowledge(knowledge):
     """插入文化知识"""
     try:
+        knowledge.change_seq = reserve_change_seqs(1)
         db.session.add(knowledge)
+        bump_table_version(CulturalKnowledge.__tablename__)
         db.session.commit()
+        table_version_cache.invalidate(CulturalKnowledge.__tablename__)
+        culture_id_pool.on_insert()
     except OperationalError as e:
         logger.info("insert_cultural_knowledge errorMsg= {} ".format(e))
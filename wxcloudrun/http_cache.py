@@ -0,0 +1,100 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import request, Response
+
+import config
+from wxcloudrun.cache import request_versions
+from wxcloudrun.dao import query_table_versions
+
+# 压缩后的响应会在 ETag 后追加编码后缀，比较 If-None-Match 时需一并考虑
+ENCODING_SUFFIXES = ('', '-gzip', '-br')
+
+
+def make_etag(versions):
+    """由请求路径、排序后的查询参数与相关表的版本生成强 ETag"""
+    parts = [request.path]
+    parts.extend('{}={}'.format(k, v) for k, v in sorted(request.args.items(multi=True)))
+    parts.extend('{}@{}'.format(table, version) for table, version in sorted(versions.items()))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _cache_control(max_age):
+    return 'public, max-age={}'.format(max_age) if max_age > 0 else 'no-cache'
+
+
+def conditional_response(versions, max_age=0):
+    """
+    由数据版本生成 ETag，请求的 If-None-Match 与之（含编码后缀）匹配时构造 304 响应
+    :return: (ETag, 304 响应或 None)
+    """
+    etag = make_etag(versions)
+    for suffix in ENCODING_SUFFIXES:
+        if request.if_none_match.contains_weak(etag + suffix):
+            response = Response(status=304)
+            response.set_etag(etag + suffix)
+            response.headers['Cache-Control'] = _cache_control(max_age)
+            response.vary.add('Accept-Encoding')
+            return etag, response
+    return etag, None
+
+
+def add_cache_headers(response, etag, max_age=0):
+    """给 200 响应加上 ETag 与 Cache-Control"""
+    if response.status_code == 200:
+        # 视图直接返回预压缩的响应时，ETag 同样带上编码后缀
+        encoding = response.headers.get('Content-Encoding')
+        response.set_etag('{}-{}'.format(etag, encoding) if encoding else etag)
+        response.headers['Cache-Control'] = _cache_control(max_age)
+    return response
+
+
+def cache_by_versions(get_versions, max_age=0):
+    """
+    只读 GET 接口的条件请求支持：ETag 由数据版本生成，版本不变时对 If-None-Match 返回 304
+    :param get_versions: 返回 {表名: 版本} 的函数，返回 None 时不做条件请求处理
+    :param max_age: Cache-Control 的 max-age（秒），为 0 时要求客户端每次重新验证
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            versions = get_versions()
+            if versions is None:
+                return view(*args, **kwargs)
+
+            etag, response = conditional_response(versions, max_age)
+            if response is not None:
+                return response
+            # 视图读缓存时按同一组版本判断条目是否过期，响应内容不会旧于 ETag
+            token = request_versions.set(versions)
+            try:
+                return add_cache_headers(view(*args, **kwargs), etag, max_age)
+            finally:
+                request_versions.reset(token)
+        return wrapper
+    return decorator
+
+
+def cache_by_table_version(*models, max_age=0):
+    """
+    按相关表在数据库中的版本做条件请求，见 cache_by_versions
+    :param models: 接口数据所依赖的模型
+    """
+    table_names = [model.__tablename__ for model in models]
+    return cache_by_versions(lambda: query_table_versions(table_names), max_age)
+
+
+def local_now():
+    """按 LOCAL_TZ_OFFSET_HOURS 配置的本地时间"""
+    return datetime.now(timezone(timedelta(hours=config.LOCAL_TZ_OFFSET_HOURS)))
+
+
+def cache_until_local_midnight(response, now):
+    """设置缓存头，使客户端与 CDN 缓存到本地时间的下一个零点"""
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    response.headers['Cache-Control'] = _cache_control(max(1, int((midnight - now).total_seconds())))
+    response.expires = midnight
+    return response
@@ -0,0 +1,199 @@
+import json
+import logging
+from collections import namedtuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import config
+from wxcloudrun.dao import insert_rows
+from wxcloudrun.model import Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 可写入字段：名称、类型、是否必填、最大长度（None 表示不限）、缺省值
+Field = namedtuple('Field', ['name', 'type', 'required', 'max_length', 'default'])
+
+FIELDS = {
+    Poetry: (
+        Field('title', str, True, 100, None),
+        Field('author', str, True, 50, None),
+        Field('dynasty', str, True, 20, None),
+        Field('content', str, True, None, None),
+        Field('tags', str, False, 200, ''),
+    ),
+    CharacterEtymology: (
+        Field('character', str, True, 10, None),
+        Field('pinyin', str, False, 50, ''),
+        Field('radical', str, False, 20, ''),
+        Field('stroke_count', int, False, None, 0),
+        Field('etymology', str, False, None, ''),
+        Field('ancient_forms', str, False, None, ''),
+        Field('meaning', str, False, None, ''),
+        Field('extended_meanings', str, False, None, ''),
+        Field('examples', str, False, None, ''),
+        Field('stroke_order', str, False, None, ''),
+        Field('dictionary_source', str, False, 100, ''),
+    ),
+    CalendarKnowledge: (
+        Field('title', str, True, 100, None),
+        Field('content', str, True, None, None),
+        Field('category', str, False, 50, ''),
+        Field('date_info', str, False, 50, ''),
+    ),
+    AstronomyKnowledge: (
+        Field('title', str, True, 100, None),
+        Field('content', str, True, None, None),
+        Field('constellation', str, False, 50, ''),
+        Field('period', str, False, 50, ''),
+    ),
+    CulturalKnowledge: (
+        Field('title', str, True, 100, None),
+        Field('content', str, True, None, None),
+        Field('category', str, False, 50, ''),
+        Field('tags', str, False, 200, ''),
+    ),
+}
+
+
+# 幂等导入使用的自然键
+NATURAL_KEYS = {
+    Poetry: ('title', 'author'),
+    CharacterEtymology: ('character',),
+    CalendarKnowledge: ('title', 'category'),
+    AstronomyKnowledge: ('title', 'constellation'),
+    CulturalKnowledge: ('title', 'category'),
+}
+
+# 命令行中使用的表名
+MODELS = {
+    'poetry': Poetry,
+    'etymology': CharacterEtymology,
+    'calendar': CalendarKnowledge,
+    'astronomy': AstronomyKnowledge,
+    'culture': CulturalKnowledge,
+}
+
+
+def validate_row(model, data):
+    """
+    校验一行待写入的数据
+    :param model: 模型类
+    :param data: 请求中的一行 JSON 对象
+    :return: 只包含可写入字段的字典
+    :raises ValueError: 数据不合法
+    """
+    if not isinstance(data, dict):
+        raise ValueError('每行必须是JSON对象')
+    row = {}
+    for field in FIELDS[model]:
+        value = data.get(field.name)
+        if value is None or value == '':
+            if field.required:
+                raise ValueError('缺少{}字段'.format(field.name))
+            value = field.default
+        if field.type is int and isinstance(value, str) and value.isdigit():
+            value = int(value)
+        if not isinstance(value, field.type) or isinstance(value, bool):
+            raise ValueError('{}字段类型错误'.format(field.name))
+        if field.max_length is not None and len(value) > field.max_length:
+            raise ValueError('{}字段超过{}个字符'.format(field.name, field.max_length))
+        row[field.name] = value
+    return row
+
+
+def validate_batch(model, records):
+    """
+    校验一批记录，供进程池并行调用，记录为 NDJSON 行时在此解析
+    :param model: 模型类
+    :param records: [(序号, JSON 行字符串或对象)]
+    :return: [(序号, 字段字典, None) 或 (序号, None, 错误信息)]
+    """
+    result = []
+    for no, record in records:
+        try:
+            if isinstance(record, str):
+                try:
+                    record = json.loads(record)
+                except ValueError as e:
+                    raise ValueError('JSON解析失败: {}'.format(e))
+            result.append((no, validate_row(model, record), None))
+        except ValueError as e:
+            result.append((no, None, str(e)))
+    return result
+
+
+def iter_ndjson(lines):
+    """
+    逐行解析 NDJSON，跳过空行
+    :param lines: 可迭代的字节或字符串行
+    :return: 生成 (行号, 对象或解析异常)
+    """
+    for line_no, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError('JSON解析失败: {}'.format(e))
+
+
+class BulkReport(object):
+    """批量导入结果：成功行数、失败行数与失败明细（最多 BULK_MAX_REPORTED_ERRORS 条）"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line_no, error):
+        self.failed += 1
+        if len(self.errors) < config.BULK_MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_no, 'error': str(error)})
+
+    def to_dict(self):
+        return {'inserted': self.inserted, 'failed': self.failed, 'errors': self.errors}
+
+
+def _flush_chunk(model, chunk, report):
+    """插入一批已校验的行，整批失败时逐行重试以定位出错的行"""
+    try:
+        insert_rows(model, [row for _, row in chunk])
+        report.inserted += len(chunk)
+        return
+    except SQLAlchemyError as e:
+        if len(chunk) == 1:
+            report.add_error(chunk[0][0], getattr(e, 'orig', None) or e)
+            return
+        logger.info("bulk chunk failed, retrying row by row errorMsg= {} ".format(e))
+    for item in chunk:
+        _flush_chunk(model, [item], report)
+
+
+def ingest(model, records, chunk_size):
+    """
+    校验并分批写入记录，单行出错不影响其他行
+    :param model: 模型类
+    :param records: 生成 (行号, 对象或异常) 的迭代器，通常来自 iter_ndjson
+    :param chunk_size: 每个事务插入的行数
+    :return: BulkReport
+    """
+    report = BulkReport()
+    chunk = []
+    for line_no, data in records:
+        try:
+            if isinstance(data, Exception):
+                raise data
+            chunk.append((line_no, validate_row(model, data)))
+        except ValueError as e:
+            report.add_error(line_no, e)
+            continue
+        if len(chunk) >= chunk_size:
+            _flush_chunk(model, chunk, report)
+            chunk = []
+    if chunk:
+        _flush_chunk(model, chunk, report)
+    return report
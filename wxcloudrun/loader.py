@@ -0,0 +1,210 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from wxcloudrun.dao import upsert_rows
+from wxcloudrun.ingest import NATURAL_KEYS, validate_batch
+
+# 读取 JSON 数组文件时每次读入的字符数
+READ_SIZE = 1 << 16
+
+# 断点记录语料文件开头这么多字节的哈希，用于识别被替换的文件
+FINGERPRINT_SIZE = 1 << 16
+
+
+def detect_format(path):
+    """按扩展名判断语料格式：.csv、.json（JSON 数组），其余按 NDJSON 处理"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext == '.json':
+        return 'json'
+    return 'ndjson'
+
+
+def _read_more(f, buf, pos):
+    data = f.read(READ_SIZE)
+    return buf[pos:] + data, 0, not data
+
+
+def _iter_json_array(f):
+    """流式解析顶层为数组的 JSON 文件，逐个生成数组元素"""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+    state = 'start'
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError('JSON数组不完整')
+            buf, pos, eof = _read_more(f, buf, pos)
+            continue
+        if state == 'start':
+            if buf[pos] != '[':
+                raise ValueError('JSON文件顶层必须是数组')
+            pos += 1
+            state = 'first'
+        elif state in ('first', 'next') and buf[pos] == ']':
+            return
+        elif state == 'next':
+            if buf[pos] != ',':
+                raise ValueError('JSON数组元素之间缺少逗号')
+            pos += 1
+            state = 'value'
+        else:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                buf, pos, eof = _read_more(f, buf, pos)
+                continue
+            yield obj
+            pos = end
+            state = 'next'
+
+
+def iter_records(path, fmt):
+    """
+    流式读取语料文件
+    :return: 生成 (序号, 记录)，NDJSON 的记录为未解析的行，留给进程池解析
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            records = csv.DictReader(f)
+        elif fmt == 'json':
+            records = _iter_json_array(f)
+        else:
+            records = (line for line in f if line.strip())
+        for no, record in enumerate(records, 1):
+            yield no, record
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _parallel_map(fn, items, workers):
+    """按输入顺序产出结果的进程池 map，最多同时提交 2 * workers 个任务以限制内存"""
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def file_fingerprint(path):
+    """语料文件的大小、修改时间与开头一块内容的哈希，文件被修改或替换后会变化"""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        head = hashlib.sha256(f.read(FINGERPRINT_SIZE)).hexdigest()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'head_sha256': head}
+
+
+class Checkpoint(object):
+    """导入断点：记录已提交的最后一条记录序号、累计统计与语料文件指纹，原子写入文件"""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.state = {'source': source, 'file': file_fingerprint(source),
+                      'records': 0, 'inserted': 0, 'updated': 0, 'failed': 0}
+
+    def load(self):
+        """读取断点，语料文件路径或指纹与断点记录不符时抛出 ValueError"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('source') != self.source:
+            raise ValueError('断点文件 {} 与语料文件不匹配，请使用 --restart 重新导入'.format(self.path))
+        if state.get('file') != self.state['file']:
+            raise ValueError('语料文件在断点 {} 之后被修改过，记录序号已不可信，请使用 --restart 重新导入'.format(self.path))
+        self.state = state
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+def _upsert(model, rows, on_error):
+    """幂等写入一批行，整批失败时逐行重试以定位出错的行"""
+    try:
+        return upsert_rows(model, NATURAL_KEYS[model], [row for _, row in rows])
+    except SQLAlchemyError as e:
+        if len(rows) == 1:
+            on_error(rows[0][0], getattr(e, 'orig', None) or e)
+            return 0, 0
+    inserted = updated = 0
+    for row in rows:
+        i, u = _upsert(model, [row], on_error)
+        inserted += i
+        updated += u
+    return inserted, updated
+
+
+def load_corpus(model, path, fmt, chunk_size, workers, checkpoint, echo):
+    """
+    导入语料：读取 -> 进程池解析校验 -> 按自然键幂等写入 -> 每批提交后写断点
+    :param model: 模型类
+    :param checkpoint: Checkpoint，已提交的记录在重新运行时跳过
+    :param echo: 输出进度的函数
+    :return: 断点中的累计统计
+    """
+    state = checkpoint.state
+    skip = state['records']
+    if skip:
+        echo('从第 {} 条记录之后继续导入'.format(skip))
+
+    def on_error(no, error):
+        state['failed'] += 1
+        echo('第 {} 条记录导入失败: {}'.format(no, error))
+
+    records = (record for record in iter_records(path, fmt) if record[0] > skip)
+    started = time.monotonic()
+    processed = 0
+    for results in _parallel_map(partial(validate_batch, model), _batches(records, chunk_size), workers):
+        rows = []
+        for no, row, error in results:
+            if error is None:
+                rows.append((no, row))
+            else:
+                on_error(no, error)
+        inserted, updated = _upsert(model, rows, on_error) if rows else (0, 0)
+        state['inserted'] += inserted
+        state['updated'] += updated
+        state['records'] = results[-1][0]
+        checkpoint.save()
+
+        processed += len(results)
+        elapsed = time.monotonic() - started
+        echo('已处理 {} 条，新增 {}，更新 {}，失败 {}，{:.0f} rows/s'.format(
+            state['records'], state['inserted'], state['updated'], state['failed'],
+            processed / elapsed if elapsed else 0))
+    return state
@@ -0,0 +1,291 @@
+import glob
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from flask import g, has_request_context, request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import config
+from wxcloudrun import app, db
+from wxcloudrun.cache import caches
+from wxcloudrun.pool import pool_stats
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 请求耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 慢查询日志中参数的最大长度
+SLOW_QUERY_PARAMS_MAX_LENGTH = 500
+
+# 多进程模式下各工作进程写入指标快照的间隔（秒）
+MULTIPROC_WRITE_SECONDS = 5
+
+# 未配置 OPS_TOKEN 时允许访问运维接口的本机地址
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+
+class Histogram(object):
+    """累计直方图，按 Prometheus 的 le 桶语义输出"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics(object):
+    """按 (接口, 方法) 汇总的请求指标，仅统计本进程"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.requests = {}
+        self.sql_queries = {}
+        self.sql_seconds = {}
+        self.response_bytes = {}
+
+    def record(self, endpoint, method, status, seconds, sql_queries, sql_seconds, response_bytes):
+        key = (endpoint, method)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            status_key = key + (status,)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            self.sql_queries[key] = self.sql_queries.get(key, 0) + sql_queries
+            self.sql_seconds[key] = self.sql_seconds.get(key, 0.0) + sql_seconds
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + response_bytes
+
+
+request_metrics = RequestMetrics()
+
+
+def _labels(**labels):
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels.items())
+
+
+def _counter_family(name, help_text, values, label_names, metric_type='counter'):
+    return name, help_text, metric_type, [(name, dict(zip(label_names, key)), value)
+                                          for key, value in sorted(values.items())]
+
+
+def collect_metrics():
+    """
+    本进程的指标，每个样本带 pid 标签，多个工作进程的同名序列不会互相覆盖
+    :return: [(指标名, 说明, 类型, [(样本名, 标签, 值)])]
+    """
+    families = []
+    with request_metrics._lock:
+        name = 'http_request_duration_seconds'
+        samples = []
+        for (endpoint, method), histogram in sorted(request_metrics.latency.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                samples.append((name + '_bucket', {'endpoint': endpoint, 'method': method, 'le': bound}, cumulative))
+            samples.append((name + '_sum', {'endpoint': endpoint, 'method': method}, histogram.sum))
+            samples.append((name + '_count', {'endpoint': endpoint, 'method': method}, histogram.count))
+        families.append((name, '请求耗时', 'histogram', samples))
+        families.append(_counter_family('http_requests_total', '请求数', request_metrics.requests,
+                                        ('endpoint', 'method', 'status')))
+        families.append(_counter_family('http_request_sql_queries_total', '请求中执行的 SQL 条数',
+                                        request_metrics.sql_queries, ('endpoint', 'method')))
+        families.append(_counter_family('http_request_sql_seconds_total', '请求中执行 SQL 的耗时',
+                                        request_metrics.sql_seconds, ('endpoint', 'method')))
+        families.append(_counter_family('http_response_bytes_total', '响应体字节数（压缩后）',
+                                        request_metrics.response_bytes, ('endpoint', 'method')))
+
+    families.append(_counter_family('cache_hits_total', '进程内缓存命中次数',
+                                    {(name,): cache.hits for name, cache in caches.items()}, ('cache',)))
+    families.append(_counter_family('cache_misses_total', '进程内缓存未命中次数',
+                                    {(name,): cache.misses for name, cache in caches.items()}, ('cache',)))
+
+    stats = pool_stats(db.engine)
+    gauges = {(key,): stats[key] for key in ('size', 'checked_out', 'overflow') if key in stats}
+    families.append(_counter_family('db_pool_connections', '数据库连接池状态', gauges, ('state',),
+                                    metric_type='gauge'))
+    if 'checkouts' in stats:
+        families.append(_counter_family('db_pool_checkout_wait_seconds_total', '取连接累计耗时',
+                                        {(): stats['wait_ms_total'] / 1000}, ()))
+        families.append(_counter_family('db_pool_checkouts_total', '取连接次数', {(): stats['checkouts']}, ()))
+        families.append(_counter_family('db_pool_timeouts_total', '取连接超时次数', {(): stats['timeouts']}, ()))
+
+    pid = str(os.getpid())
+    return [(name, help_text, metric_type,
+             [(sample, dict(labels, pid=pid), value) for sample, labels, value in samples])
+            for name, help_text, metric_type, samples in families]
+
+
+def _snapshot_path(pid):
+    return os.path.join(config.PROMETHEUS_MULTIPROC_DIR, 'metrics-{}.json'.format(pid))
+
+
+def write_snapshot():
+    """把本进程的指标原子写入 PROMETHEUS_MULTIPROC_DIR，供其他工作进程响应 /metrics 时合并"""
+    path = _snapshot_path(os.getpid())
+    tmp = path + '.tmp'
+    with app.app_context():
+        families = collect_metrics()
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(families, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def mark_process_dead(pid):
+    """工作进程退出后删除它的指标快照，由 gunicorn 的 child_exit 调用"""
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        try:
+            os.remove(_snapshot_path(pid))
+        except FileNotFoundError:
+            pass
+
+
+class SnapshotWriter(object):
+    """每隔 MULTIPROC_WRITE_SECONDS 写一次本进程指标快照的后台线程，按进程号懒启动"""
+
+    def __init__(self):
+        self._pid = None
+
+    def ensure_started(self):
+        if not config.PROMETHEUS_MULTIPROC_DIR or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        os.makedirs(config.PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+        threading.Thread(target=self._run, name='metrics-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                write_snapshot()
+            except Exception as e:
+                logger.info("metrics write_snapshot errorMsg= {} ".format(e))
+            time.sleep(MULTIPROC_WRITE_SECONDS)
+
+
+snapshot_writer = SnapshotWriter()
+
+
+def _other_processes():
+    """其他工作进程最近写入的指标快照"""
+    result = []
+    own = _snapshot_path(os.getpid())
+    for path in sorted(glob.glob(_snapshot_path('*'))):
+        if path == own:
+            continue
+        try:
+            with open(path, encoding='utf-8') as f:
+                result.append(json.load(f))
+        except (OSError, ValueError):
+            # 进程恰好退出或文件正在替换
+            continue
+    return result
+
+
+def render_metrics():
+    """
+    以 Prometheus 文本格式输出指标：本进程的实时值，配置了 PROMETHEUS_MULTIPROC_DIR 时
+    再合并其他工作进程的快照（最多滞后 MULTIPROC_WRITE_SECONDS），同名指标的样本归入同一组
+    """
+    merged = {}
+    processes = [collect_metrics()]
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        processes.extend(_other_processes())
+    for families in processes:
+        for name, help_text, metric_type, samples in families:
+            merged.setdefault(name, (help_text, metric_type, []))[2].extend(samples)
+    lines = []
+    for name, (help_text, metric_type, samples) in merged.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for sample, labels, value in samples:
+            lines.append('{}{{{}}} {}'.format(sample, _labels(**labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # 按执行上下文记下开始时间，出错时据此判断栈顶是否属于出错的语句
+    conn.info.setdefault('query_started', []).append((context, time.perf_counter()))
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()[1]
+    if not has_request_context():
+        return
+    g.sql_queries = g.get('sql_queries', 0) + 1
+    g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+    if config.SLOW_QUERY_MS and elapsed * 1000 >= config.SLOW_QUERY_MS:
+        logger.warning("slow query {:.1f}ms view= {} statement= {} params= {} ".format(
+            elapsed * 1000, request.endpoint, statement, str(parameters)[:SLOW_QUERY_PARAMS_MAX_LENGTH]))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # 执行出错时不会触发 after_cursor_execute，弹出 before_cursor_execute 记下的开始时间，以免连接上越积越多
+    conn = exception_context.connection
+    started = conn.info.get('query_started') if conn is not None else None
+    if started and started[-1][0] is exception_context.execution_context:
+        started.pop()
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+
+@app.after_request
+def _record_request(response):
+    # 需在其他 after_request（如压缩）之后执行，本模块须先于它们加载
+    started = g.get('request_started')
+    if started is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    # 流式响应不计算长度，以免提前消费生成器
+    response_bytes = response.content_length
+    if response_bytes is None:
+        response_bytes = 0 if response.is_streamed else response.calculate_content_length() or 0
+    snapshot_writer.ensure_started()
+    request_metrics.record(endpoint, request.method, response.status_code, time.perf_counter() - started,
+                           g.get('sql_queries', 0), g.get('sql_seconds', 0.0), response_bytes)
+    return response
+
+
+def ops_only(view):
+    """运维接口的访问控制：配置了 OPS_TOKEN 时校验 Bearer 令牌，否则只允许本机访问，拒绝时返回 403"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if config.OPS_TOKEN:
+            allowed = hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                          'Bearer {}'.format(config.OPS_TOKEN).encode('utf-8'))
+        else:
+            allowed = request.remote_addr in LOOPBACK_ADDRESSES
+        if not allowed:
+            return Response(status=403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/metrics', methods=['GET'])
+@ops_only
+def metrics():
+    """Prometheus 文本格式的本进程指标"""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
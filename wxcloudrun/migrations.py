@@ -0,0 +1,165 @@
+import logging
+
+from sqlalchemy import delete, func, inspect, select, text, update
+from sqlalchemy.exc import OperationalError
+
+from wxcloudrun import db
+from wxcloudrun.model import Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge, \
+    SchemaMigrations, TableVersions, WriteTickets, CHANGE_SEQ_KEY
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 中止迁移时列出的重复汉字个数
+DUPLICATES_SHOWN = 50
+
+
+def _expected_indexes():
+    """模型中声明的全部索引：[(表名, 索引)]"""
+    return [(table.name, index) for table in db.metadata.sorted_tables for index in table.indexes]
+
+
+def _existing_index_names(conn, table_name):
+    return {index['name'] for index in inspect(conn).get_indexes(table_name)}
+
+
+def _existing_column_names(conn, table_name):
+    return {column['name'] for column in inspect(conn).get_columns(table_name)}
+
+
+def _create_tables(conn, options):
+    """创建尚不存在的数据表（新建的表会同时带上声明的索引）"""
+    db.metadata.create_all(bind=conn, checkfirst=True)
+
+
+def _dedupe_characters(conn, dedupe):
+    """
+    为唯一索引做准备：检查重复的汉字，dedupe 为 True 时同一汉字保留 id 最小的一行
+    存在重复且未指定 dedupe 时抛出 ValueError 列出这些汉字，迁移回滚，不删除任何数据
+    """
+    table = CharacterEtymology.__table__
+    duplicates = conn.execute(select(table.c.character, func.count().label('rows'))
+                              .group_by(table.c.character)
+                              .having(func.count() > 1)
+                              .order_by(table.c.character)).all()
+    if not duplicates:
+        return
+    listed = '、'.join('{}（{} 行）'.format(row.character, row.rows) for row in duplicates[:DUPLICATES_SHOWN])
+    if len(duplicates) > DUPLICATES_SHOWN:
+        listed += ' 等 {} 个汉字'.format(len(duplicates))
+    if not dedupe:
+        raise ValueError('CharacterEtymology 中有重复的汉字：{}。请先手动处理，或以 --dedupe 执行迁移，'
+                         '同一汉字只保留 id 最小的一行'.format(listed))
+    keep = select(func.min(table.c.id).label('id')).group_by(table.c.character).subquery()
+    result = conn.execute(delete(table).where(table.c.id.notin_(select(keep.c.id))))
+    logger.warning("removed duplicate CharacterEtymology rows= {} characters= {} ".format(result.rowcount, listed))
+
+
+def _create_indexes(conn, options):
+    """为已有数据表补建模型中声明但缺失的索引"""
+    _dedupe_characters(conn, options.get('dedupe', False))
+    for table_name, index in _expected_indexes():
+        # 列由后续迁移添加的索引留给该迁移创建
+        if not {column.name for column in index.columns} <= _existing_column_names(conn, table_name):
+            continue
+        if index.name not in _existing_index_names(conn, table_name):
+            index.create(bind=conn)
+            logger.info("created index {}.{} ".format(table_name, index.name))
+
+
+def _add_change_seq(conn, options):
+    """
+    知识表增加全局变更序号列并建索引
+    已有记录按表依次以 id 加上前面各表的最大序号回填，序号行记为回填后的最大值
+    """
+    preparer = conn.dialect.identifier_preparer
+    seq = conn.execute(select(TableVersions.version)
+                       .where(TableVersions.table_name == CHANGE_SEQ_KEY)).scalar() or 0
+    for model in (Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge):
+        table = model.__table__
+        column = table.c.change_seq
+        if column.name not in _existing_column_names(conn, table.name):
+            conn.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                preparer.format_table(table), preparer.quote(column.name), column.type.compile(conn.dialect))))
+        conn.execute(update(table).where(column.is_(None)).values({column: table.c.id + seq}))
+        seq = max(seq, conn.execute(select(func.max(column))).scalar() or 0)
+        for index in table.indexes:
+            if column.name in index.columns and index.name not in _existing_index_names(conn, table.name):
+                index.create(bind=conn)
+                logger.info("created index {}.{} ".format(table.name, index.name))
+    versions = TableVersions.__table__
+    if conn.execute(update(versions).where(versions.c.table_name == CHANGE_SEQ_KEY)
+                    .values(version=seq)).rowcount == 0:
+        conn.execute(versions.insert().values(table_name=CHANGE_SEQ_KEY, version=seq))
+
+
+def _create_write_tickets(conn, options):
+    """创建异步写入队列的 ticket 表"""
+    WriteTickets.__table__.create(bind=conn, checkfirst=True)
+
+
+# 按版本号顺序执行的迁移：(版本号, 说明, 迁移函数)，迁移函数的参数为连接与 upgrade 的选项；
+# 已发布的迁移不要修改，只追加新版本
+MIGRATIONS = [
+    (1, '创建数据表', _create_tables),
+    (2, '汉字去重并为知识表的查询字段创建索引', _create_indexes),
+    (3, '知识表增加全局变更序号', _add_change_seq),
+    (4, '创建写入队列 ticket 表', _create_write_tickets),
+]
+
+
+def applied_versions(conn):
+    if not inspect(conn).has_table(SchemaMigrations.__tablename__):
+        return set()
+    return {row.version for row in conn.execute(select(SchemaMigrations.version))}
+
+
+def upgrade(echo=logger.info, dedupe=False):
+    """
+    依次执行尚未执行的迁移，每个迁移成功后记录版本号
+    :param dedupe: 建唯一索引前是否删除重复的汉字（保留 id 最小的一行），为 False 时有重复则中止
+    :return: 本次执行的版本号列表
+    """
+    options = {'dedupe': dedupe}
+    executed = []
+    with db.engine.connect() as conn:
+        SchemaMigrations.__table__.create(bind=conn, checkfirst=True)
+        applied = applied_versions(conn)
+        for version, description, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            echo('执行迁移 {}: {}'.format(version, description))
+            with conn.begin():
+                migrate(conn, options)
+                conn.execute(SchemaMigrations.__table__.insert().values(version=version, description=description))
+            executed.append(version)
+    return executed
+
+
+def missing_indexes():
+    """
+    比对模型声明与数据库中实际存在的索引
+    :return: 缺失的 '表名.索引名' 列表，表不存在时整表的索引都算缺失
+    """
+    missing = []
+    with db.engine.connect() as conn:
+        inspector = inspect(conn)
+        existing = {}
+        for table_name, index in _expected_indexes():
+            if table_name not in existing:
+                existing[table_name] = _existing_index_names(conn, table_name) \
+                    if inspector.has_table(table_name) else set()
+            if index.name not in existing[table_name]:
+                missing.append('{}.{}'.format(table_name, index.name))
+    return missing
+
+
+def check_indexes():
+    """启动时检查索引，缺失时输出警告，数据库不可用时不影响启动"""
+    try:
+        missing = missing_indexes()
+    except OperationalError as e:
+        logger.warning("check_indexes errorMsg= {} ".format(e))
+        return
+    if missing:
+        logger.warning("missing indexes: {}，请执行 flask db-upgrade ".format(', '.join(missing)))
@@ -11,8 +11,8 @@ class Counters(db.Model):
     # 设定结构体对应表格的字段
     id = db.Column(db.Integer, primary_key=True)
     count = db.Column(db.Integer, default=1)
-    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now())
-    updated_at = db.Column('updatedAt', db.TIMESTAMP, nullable=False, default=datetime.now())
+    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now)
+    updated_at = db.Column('updatedAt', db.TIMESTAMP, nullable=False, default=datetime.now, onupdate=datetime.now)
 
 
 # 诗词表
@@ -21,12 +21,13 @@ class Poetry(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)  # 诗题
-    author = db.Column(db.String(50), nullable=False)   # 作者
+    author = db.Column(db.String(50), nullable=False, index=True)   # 作者
     dynasty = db.Column(db.String(20), nullable=False)  # 朝代
     content = db.Column(db.Text, nullable=False)        # 诗词内容
     tags = db.Column(db.String(200))                    # 标签
-    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now())
-    updated_at = db.Column('updatedAt', db.TIMESTAMP, nullable=False, default=datetime.now())
+    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now)
+    updated_at = db.Column('updatedAt', db.TIMESTAMP, nullable=False, default=datetime.now, onupdate=datetime.now)
+    change_seq = db.Column(db.Integer, index=True)           # 全局变更序号，插入或更新时递增
 
 
 # 汉字字源表
@@ -34,10 +35,10 @@ class CharacterEtymology(db.Model):
     __tablename__ = 'CharacterEtymology'
     
     id = db.Column(db.Integer, primary_key=True)
-    character = db.Column(db.String(10), nullable=False)     # 汉字
+    character = db.Column(db.String(10), nullable=False, unique=True, index=True)  # 汉字
     pinyin = db.Column(db.String(50))                        # 拼音
-    radical = db.Column(db.String(20))                       # 部首
-    stroke_count = db.Column(db.Integer)                     # 笔画数
+    radical = db.Column(db.String(20), index=True)           # 部首
+    stroke_count = db.Column(db.Integer, index=True)         # 笔画数
     etymology = db.Column(db.Text)                          # 字源解释
     ancient_forms = db.Column(db.Text)                      # 古文字形态
     meaning = db.Column(db.Text)                            # 本义
@@ -45,7 +46,8 @@ class CharacterEtymology(db.Model):
     examples = db.Column(db.Text)                           # 例词例句
     stroke_order = db.Column(db.Text)                       # 笔顺说明
     dictionary_source = db.Column(db.String(100))           # 字典来源
-    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now())
+    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now)
+    change_seq = db.Column(db.Integer, index=True)           # 全局变更序号，插入或更新时递增
 
 
 # 历法知识表
@@ -55,9 +57,10 @@ class CalendarKnowledge(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)       # 标题
     content = db.Column(db.Text, nullable=False)            # 内容
-    category = db.Column(db.String(50))                     # 分类（节气、节日等）
+    category = db.Column(db.String(50), index=True)         # 分类（节气、节日等）
     date_info = db.Column(db.String(50))                    # 日期信息
-    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now())
+    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now)
+    change_seq = db.Column(db.Integer, index=True)           # 全局变更序号，插入或更新时递增
 
 
 # 天文知识表
@@ -67,9 +70,10 @@ class AstronomyKnowledge(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)       # 标题
     content = db.Column(db.Text, nullable=False)            # 内容
-    constellation = db.Column(db.String(50))                # 星宿
+    constellation = db.Column(db.String(50), index=True)    # 星宿
     period = db.Column(db.String(50))                      # 时期
-    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now())
+    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now)
+    change_seq = db.Column(db.Integer, index=True)           # 全局变更序号，插入或更新时递增
 
 
 # 文化百科表
@@ -79,7 +83,44 @@ class CulturalKnowledge(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)       # 标题
     content = db.Column(db.Text, nullable=False)            # 内容
-    category = db.Column(db.String(50))                     # 分类
+    category = db.Column(db.String(50), index=True)         # 分类
     tags = db.Column(db.String(200))                       # 标签
-    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now())
-    updated_at = db.Column('updatedAt', db.TIMESTAMP, nullable=False, default=datetime.now())
+    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now)
+    updated_at = db.Column('updatedAt', db.TIMESTAMP, nullable=False, default=datetime.now, onupdate=datetime.now)
+    change_seq = db.Column(db.Integer, index=True)           # 全局变更序号，插入或更新时递增
+
+
+# 表版本表，每次写入知识表时版本加一，用于生成 ETag
+# table_name 为 CHANGE_SEQ_KEY 的一行保存各知识表共用的全局变更序号
+# table_name 为 COUNTER_EPOCH_KEY 的一行保存计数器的清零纪元
+class TableVersions(db.Model):
+    __tablename__ = 'TableVersions'
+
+    table_name = db.Column(db.String(64), primary_key=True)  # 表名
+    version = db.Column(db.Integer, nullable=False, default=0)  # 版本号
+
+
+# TableVersions 中保存全局变更序号的行
+CHANGE_SEQ_KEY = '$change_seq'
+
+# TableVersions 中保存计数器清零纪元的行，每次清零加一
+COUNTER_EPOCH_KEY = '$counter_epoch'
+
+
+# 异步写入队列已写库的 ticket，与记录在同一事务中插入，重放队列时据此跳过已写入的记录
+class WriteTickets(db.Model):
+    __tablename__ = 'WriteTickets'
+
+    ticket = db.Column(db.String(32), primary_key=True)       # 入队时返回的 ticket
+    table_name = db.Column(db.String(64), nullable=False)     # 写入的表名
+    row_id = db.Column(db.Integer, nullable=False)            # 写入记录的 id
+    created_at = db.Column('createdAt', db.TIMESTAMP, nullable=False, default=datetime.now, index=True)
+
+
+# 数据库结构迁移记录表
+class SchemaMigrations(db.Model):
+    __tablename__ = 'SchemaMigrations'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 迁移版本号
+    description = db.Column(db.String(200))                                 # 迁移说明
+    applied_at = db.Column('appliedAt', db.TIMESTAMP, nullable=False, default=datetime.now)
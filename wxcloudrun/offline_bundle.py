@@ -0,0 +1,216 @@
+import fcntl
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import Integer
+
+import config
+from wxcloudrun import app, db
+from wxcloudrun.dao import query_change_seq, query_table_versions
+from wxcloudrun.serializers import sync_serializers
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 快照包格式版本，表结构或 meta 的含义变化时加一
+FORMAT_VERSION = 1
+
+# 打包的表，名称与 /api/sync 一致，客户端可用同一套表名应用增量
+TABLES = ('etymology', 'calendar', 'astronomy', 'culture')
+
+MANIFEST = 'manifest.json'
+BUILD_LOCK = 'build.lock'
+
+# 保留的快照包个数，旧包可能仍在被下载
+KEEP_BUNDLES = 2
+
+
+def _column_type(column):
+    return 'INTEGER' if isinstance(column.type, Integer) else 'TEXT'
+
+
+def _canonical(values):
+    """内容哈希使用的规范编码，与 JSON 编码器的选择无关"""
+    return json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OfflineBundle(object):
+    """
+    离线快照包：把字源、历法、天文、文化知识表导出为一个 gzip 压缩的 SQLite 文件
+    文件中 meta 表记录格式版本、各表版本、内容哈希与导出时的全局变更序号（since），
+    客户端之后以该序号调用 /api/sync 追平；表版本不变时不重新生成
+    同一目录下同时只有一个进程生成，生成完成后原子替换 manifest.json
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._checked_at = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def path(self, manifest):
+        return self._path(manifest['file'])
+
+    def manifest(self):
+        """当前快照包的描述，尚未生成时返回 None"""
+        try:
+            with open(self._path(MANIFEST), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        return manifest if os.path.exists(self.path(manifest)) else None
+
+    def build(self, force=False, blocking=True):
+        """
+        表版本与当前快照包不同（或 force）时重新生成
+        :param blocking: 为 False 时，其他进程正在生成则直接返回现有的快照包
+        :return: (manifest, 是否重新生成)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self._path(BUILD_LOCK), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return self.manifest(), False
+            manifest = self.manifest()
+            table_names = [sync_serializers[name].model.__tablename__ for name in TABLES]
+            # 先读版本与序号再读数据，导出期间的写入由下次生成或增量同步追平
+            versions = query_table_versions(table_names)
+            since = query_change_seq()
+            if versions is None or since is None:
+                return manifest, False
+            if not force and manifest is not None and manifest['versions'] == versions:
+                return manifest, False
+            return self._write(versions, since), True
+        finally:
+            os.close(fd)
+
+    def _export(self, path, versions, since):
+        """导出到未压缩的 SQLite 文件，返回写入 meta 表的内容"""
+        content = hashlib.sha256()
+        rows = {}
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('PRAGMA journal_mode=OFF')
+            conn.execute('PRAGMA synchronous=OFF')
+            for name in TABLES:
+                serializer = sync_serializers[name]
+                model = serializer.model
+                columns = serializer.columns + [model.change_seq]
+                names = [column.key for column in columns]
+                conn.execute('CREATE TABLE "{}" ({})'.format(name, ', '.join(
+                    '"{}" {}{}'.format(key, _column_type(column), ' PRIMARY KEY' if key == 'id' else '')
+                    for key, column in zip(names, columns))))
+                sql = 'INSERT INTO "{}" VALUES ({})'.format(name, ', '.join('?' * len(columns)))
+                count = 0
+                batch = []
+                for row in db.session.query(*columns).order_by(model.id).yield_per(config.SYNC_BATCH_SIZE):
+                    values = tuple(row)
+                    content.update(_canonical([name] + list(values)))
+                    batch.append(values)
+                    if len(batch) >= config.SYNC_BATCH_SIZE:
+                        conn.executemany(sql, batch)
+                        count += len(batch)
+                        batch = []
+                conn.executemany(sql, batch)
+                rows[name] = count + len(batch)
+                # 与服务端相同的查询索引，客户端离线查询时使用
+                for index in sorted(model.__table__.indexes, key=lambda index: index.name):
+                    keys = [column.key for column in index.columns]
+                    if set(keys) <= set(names) and keys != ['change_seq']:
+                        conn.execute('CREATE {}INDEX "{}_{}" ON "{}" ({})'.format(
+                            'UNIQUE ' if index.unique else '', name, '_'.join(keys), name,
+                            ', '.join('"{}"'.format(key) for key in keys)))
+            meta = {'format': FORMAT_VERSION, 'versions': versions, 'since': since, 'rows': rows,
+                    'content_sha256': content.hexdigest()}
+            conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            conn.executemany('INSERT INTO meta VALUES (?, ?)',
+                             [(key, json.dumps(value, ensure_ascii=False)) for key, value in meta.items()])
+            conn.commit()
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+        return meta
+
+    def _write(self, versions, since):
+        started = time.monotonic()
+        raw = self._path('bundle.sqlite.tmp')
+        packed = self._path('bundle.sqlite.gz.tmp')
+        for tmp in (raw, packed):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        try:
+            meta = self._export(raw, versions, since)
+            # mtime 固定为 0，相同内容在不同实例上生成的文件逐字节相同
+            with open(raw, 'rb') as src, open(packed, 'wb') as dst:
+                with gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=dst, mtime=0) as gz:
+                    shutil.copyfileobj(src, gz, 1 << 20)
+                dst.flush()
+                os.fsync(dst.fileno())
+            sha256 = _file_sha256(packed)
+            name = 'knowledge-{}.sqlite.gz'.format(sha256[:16])
+            os.replace(packed, self._path(name))
+        finally:
+            if os.path.exists(raw):
+                os.remove(raw)
+
+        manifest = dict(meta, file=name, sha256=sha256, size=os.path.getsize(self._path(name)),
+                        built_at=time.strftime('%Y-%m-%dT%H:%M:%S%z'))
+        tmp = self._path(MANIFEST + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(MANIFEST))
+
+        bundles = sorted(glob.glob(self._path('knowledge-*.sqlite.gz')), key=os.path.getmtime, reverse=True)
+        for old in bundles[KEEP_BUNDLES:]:
+            if old != self._path(name):
+                os.remove(old)
+        logger.info("offline bundle built file= {} size= {} since= {} cost= {:.1f}s ".format(
+            name, manifest['size'], manifest['since'], time.monotonic() - started))
+        return manifest
+
+    def latest(self):
+        """
+        返回当前快照包的描述，尚未生成时返回 None
+        距上次比对超过 OFFLINE_BUNDLE_CHECK_SECONDS 时在后台线程中比对表版本，有变化则重新生成；
+        生成完成、原子替换 manifest.json 之前继续返回原有的快照包
+        """
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= config.OFFLINE_BUNDLE_CHECK_SECONDS:
+            if self._lock.acquire(blocking=False):
+                self._checked_at = now
+                threading.Thread(target=self._refresh, name='offline-bundle', daemon=True).start()
+        return self.manifest()
+
+    def _refresh(self):
+        try:
+            with app.app_context():
+                self.build(blocking=False)
+        except Exception as e:
+            logger.info("offline bundle build errorMsg= {} ".format(e))
+        finally:
+            self._lock.release()
+
+
+offline_bundle = OfflineBundle(config.OFFLINE_BUNDLE_DIR)
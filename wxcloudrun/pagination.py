@@ -0,0 +1,23 @@
+import config
+
+
+def parse_page_args(args):
+    """
+    解析列表接口的分页参数，limit 超过服务端上限时按上限截断
+    :param args: request.args
+    :return: (cursor, limit)，cursor 为上一页最后一条记录的 id
+    """
+    cursor = args.get('cursor', '0')
+    limit = args.get('limit', str(config.PAGE_SIZE_DEFAULT))
+    if not cursor.isdigit():
+        raise ValueError('cursor参数错误')
+    if not limit.isdigit() or int(limit) == 0:
+        raise ValueError('limit参数错误')
+    return int(cursor), min(int(limit), config.PAGE_SIZE_MAX)
+
+
+def next_cursor(items, limit):
+    """取满一页时返回下一页的游标，否则返回 None"""
+    if len(items) < limit:
+        return None
+    return items[-1].id
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """
+    记录取连接次数、耗时与超时次数的 QueuePool
+    耗时包括等待空闲连接与新建连接，dispose() 重建连接池后统计从零开始
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+def engine_options(config):
+    """
+    根据配置生成 SQLALCHEMY_ENGINE_OPTIONS，MySQL 使用可统计的 TimedQueuePool
+    SQLite 等本地数据库由 Flask-SQLAlchemy 选择连接池，只开启探活
+    """
+    if not config.database_uri or config.database_uri.startswith('mysql'):
+        return {
+            'poolclass': TimedQueuePool,
+            'pool_size': config.DB_POOL_SIZE,
+            'max_overflow': config.DB_MAX_OVERFLOW,
+            'pool_recycle': config.DB_POOL_RECYCLE,
+            'pool_pre_ping': config.DB_POOL_PRE_PING,
+            'pool_timeout': config.DB_POOL_TIMEOUT,
+        }
+    return {'pool_pre_ping': config.DB_POOL_PRE_PING}
+
+
+def async_engine_options(config, url):
+    """
+    异步引擎的连接池参数，MySQL 使用 SQLAlchemy 默认的 AsyncAdaptedQueuePool
+    一个进程内同时等待数据库的请求数受 ASYNC_DB_POOL_SIZE + ASYNC_DB_MAX_OVERFLOW 限制
+    """
+    if url.get_backend_name() == 'mysql':
+        return {
+            'pool_size': config.ASYNC_DB_POOL_SIZE,
+            'max_overflow': config.ASYNC_DB_MAX_OVERFLOW,
+            'pool_recycle': config.DB_POOL_RECYCLE,
+            'pool_pre_ping': config.DB_POOL_PRE_PING,
+            'pool_timeout': config.DB_POOL_TIMEOUT,
+        }
+    return {'pool_pre_ping': config.DB_POOL_PRE_PING}
+
+
+def pool_stats(engine):
+    """
+    连接池当前状态与累计统计
+    :return: 字典，非 QueuePool 时只含 status
+    """
+    pool = engine.pool
+    stats = {'pool_class': pool.__class__.__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'wait_ms_total': round(pool.wait_seconds_total * 1000, 3),
+            'wait_ms_avg': round(pool.wait_seconds_total * 1000 / pool.checkouts, 3) if pool.checkouts else None,
+            'wait_ms_max': round(pool.wait_seconds_max * 1000, 3),
+        })
+    return stats
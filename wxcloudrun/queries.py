@@ -0,0 +1,299 @@
+"""
+读接口的查询计划，同步（dao.py）与异步（async_dao.py）共用
+计划是生成器：生成 SELECT 语句时由执行方查询并送回全部行，生成无参函数时由执行方调用（异步时放到线程池）并送回返回值；
+执行出错时把异常抛回计划，由计划决定记录日志或继续抛出。计划的返回值即查询结果
+"""
+import logging
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from sqlalchemy import or_, select
+from sqlalchemy.exc import OperationalError
+
+import config
+from wxcloudrun.cache import MISSING, TTLCache, request_versions
+from wxcloudrun.model import Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge, \
+    TableVersions
+from wxcloudrun.sampler import poetry_id_pool, culture_id_pool
+from wxcloudrun.search_index import poetry_index
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# IN 查询每批携带的 id 数量
+IN_CHUNK_SIZE = 500
+
+# 随机抽样抽到已删除记录时的最大重试次数
+RANDOM_MAX_RETRIES = 5
+
+# 汉字字源读穿缓存，按汉字缓存整行，查无此字时缓存 None，条目带有 CharacterEtymology 的表版本
+etymology_cache = TTLCache('etymology', config.ETYMOLOGY_CACHE_SIZE, config.ETYMOLOGY_CACHE_TTL)
+
+# 表版本，供不经过 ETag 的请求（如批量字源查询）判断读穿缓存是否过期，本进程写入后立即失效
+table_version_cache = TTLCache('table_version', 64, config.TABLE_VERSION_CACHE_TTL)
+
+# 每日文化知识，按日期缓存当天选中的行，只保留当天与前一天
+daily_culture_cache = TTLCache('daily_culture', 2, 24 * 3600)
+
+
+def select_rows(model, columns=None):
+    """
+    指定 columns 时只查询这些列，否则查询整行；结果均为按字段名取值的行，不纳入会话
+    :param columns: 列属性列表，如 [CharacterEtymology.id, CharacterEtymology.character]
+    """
+    return select(*columns) if columns else select(model.__table__)
+
+
+def page_limit(limit):
+    """每页条数，未指定时取默认值，且不超过 PAGE_SIZE_MAX"""
+    return min(limit or config.PAGE_SIZE_DEFAULT, config.PAGE_SIZE_MAX)
+
+
+def _first(rows):
+    return rows[0] if rows else None
+
+
+def _page(statement, model, cursor, limit):
+    """按 id 做键集分页，只取一页"""
+    return statement.where(model.id > cursor).order_by(model.id).limit(page_limit(limit))
+
+
+def table_versions(table_names):
+    """
+    查询多张表的版本
+    :return: {表名: 版本}，从未写入过的表版本为0，查询失败时返回 None
+    """
+    try:
+        rows = yield select(TableVersions.table_name, TableVersions.version) \
+            .where(TableVersions.table_name.in_(table_names))
+        versions = dict.fromkeys(table_names, 0)
+        versions.update((row.table_name, row.version) for row in rows)
+        for table_name, version in versions.items():
+            table_version_cache.set(table_name, version)
+        return versions
+    except OperationalError as e:
+        logger.info("query_table_versions errorMsg= {} ".format(e))
+        return None
+
+
+def current_table_version(model):
+    """
+    表的当前版本，优先取本次请求生成 ETag 时读到的版本，其次取 TABLE_VERSION_CACHE_TTL 秒内读到的版本，否则查询数据库
+    :return: 版本，查询失败时返回 None
+    """
+    versions = request_versions.get()
+    if versions is not None and model.__tablename__ in versions:
+        return versions[model.__tablename__]
+    version = table_version_cache.get(model.__tablename__)
+    if version is not MISSING:
+        return version
+    versions = yield from table_versions([model.__tablename__])
+    return versions and versions[model.__tablename__]
+
+
+def _random_row(model, pool):
+    """从 id 池均匀抽样后按主键读取，抽到已删除的 id 时移出池并重抽"""
+    for _ in range(RANDOM_MAX_RETRIES):
+        id = yield pool.sample
+        if id is None:
+            return None
+        row = _first((yield select(model.__table__).where(model.id == id)))
+        if row is not None:
+            return row
+        logger.info("random {} id= {} no longer exists ".format(model.__tablename__, id))
+        pool.discard(id)
+    return None
+
+
+def _paged(name, statement, model, cursor, limit):
+    try:
+        return (yield _page(statement, model, cursor, limit))
+    except OperationalError as e:
+        logger.info("{} errorMsg= {} ".format(name, e))
+        return None
+
+
+# 诗词相关查询
+def poetry_by_keyword(keyword, cursor=0, limit=None, columns=None):
+    """
+    根据关键词搜索诗词
+    启用倒排索引时先求交得到候选 id，再用同样的 contains 条件在候选集内校验，结果与全表扫描一致
+    """
+    try:
+        statement = select_rows(Poetry, columns).where(
+            or_(
+                Poetry.title.contains(keyword),
+                Poetry.author.contains(keyword),
+                Poetry.content.contains(keyword),
+                Poetry.tags.contains(keyword)
+            )
+        )
+        # 追平索引可能查库，异步执行时放到线程池
+        candidates = (yield partial(poetry_index.candidates, keyword)) if config.POETRY_INDEX_ENABLED else None
+        if candidates is None:
+            return (yield _page(statement, Poetry, cursor, limit))
+        limit = page_limit(limit)
+        candidates = candidates[bisect_right(candidates, cursor):]
+        result = []
+        for i in range(0, len(candidates), IN_CHUNK_SIZE):
+            chunk = candidates[i:i + IN_CHUNK_SIZE]
+            result.extend((yield statement.where(Poetry.id.in_(chunk)).order_by(Poetry.id).limit(limit - len(result))))
+            if len(result) >= limit:
+                break
+        return result
+    except OperationalError as e:
+        logger.info("query_poetry_by_keyword errorMsg= {} ".format(e))
+        return None
+
+
+def poetry_by_author(author, cursor=0, limit=None, columns=None):
+    """根据作者搜索诗词"""
+    return (yield from _paged('query_poetry_by_author', select_rows(Poetry, columns)
+                              .where(Poetry.author.contains(author)), Poetry, cursor, limit))
+
+
+def poetry_by_id(id):
+    """根据ID查询诗词"""
+    try:
+        return _first((yield select(Poetry.__table__).where(Poetry.id == id)))
+    except OperationalError as e:
+        logger.info("query_poetry_by_id errorMsg= {} ".format(e))
+        return None
+
+
+def random_poetry():
+    """获取随机诗词"""
+    try:
+        return (yield from _random_row(Poetry, poetry_id_pool))
+    except OperationalError as e:
+        logger.info("query_random_poetry errorMsg= {} ".format(e))
+        return None
+
+
+# 汉字字源相关查询
+def character_etymology(character):
+    """查询单个汉字的字源信息，先读缓存"""
+    try:
+        version = yield from current_table_version(CharacterEtymology)
+        etymology = etymology_cache.get(character, version)
+        if etymology is not MISSING:
+            return etymology
+        etymology = _first((yield select(CharacterEtymology.__table__)
+                            .where(CharacterEtymology.character == character)
+                            .order_by(CharacterEtymology.id)
+                            .limit(1)))
+        etymology_cache.set(character, etymology, version)
+        return etymology
+    except OperationalError as e:
+        logger.info("query_character_etymology errorMsg= {} ".format(e))
+        return None
+
+
+def character_etymologies(characters):
+    """
+    批量查询汉字字源信息，先读缓存，未命中的汉字合并为一次 IN 查询并回填缓存
+    :param characters: 去重后的汉字列表
+    :return: {汉字: 行或 None}
+    """
+    try:
+        result = {}
+        version = yield from current_table_version(CharacterEtymology)
+        missing = []
+        for character in characters:
+            etymology = etymology_cache.get(character, version)
+            if etymology is MISSING:
+                missing.append(character)
+            else:
+                result[character] = etymology
+        found = {}
+        for i in range(0, len(missing), IN_CHUNK_SIZE):
+            chunk = missing[i:i + IN_CHUNK_SIZE]
+            for etymology in (yield select(CharacterEtymology.__table__)
+                              .where(CharacterEtymology.character.in_(chunk))
+                              .order_by(CharacterEtymology.id)):
+                found.setdefault(etymology.character, etymology)
+        for character in missing:
+            etymology = found.get(character)
+            etymology_cache.set(character, etymology, version)
+            result[character] = etymology
+        return result
+    except OperationalError as e:
+        logger.info("query_character_etymologies errorMsg= {} ".format(e))
+        return None
+
+
+def characters_by_radical(radical, cursor=0, limit=None, columns=None):
+    """按部首查询汉字"""
+    return (yield from _paged('query_characters_by_radical', select_rows(CharacterEtymology, columns)
+                              .where(CharacterEtymology.radical == radical), CharacterEtymology, cursor, limit))
+
+
+def characters_by_stroke_count(stroke_count, cursor=0, limit=None, columns=None):
+    """按笔画数查询汉字"""
+    return (yield from _paged('query_characters_by_stroke_count', select_rows(CharacterEtymology, columns)
+                              .where(CharacterEtymology.stroke_count == stroke_count),
+                              CharacterEtymology, cursor, limit))
+
+
+# 历法、天文知识相关查询，接口平时读参考数据快照，仅在快照不可用时使用
+def calendar_knowledge_by_category(category, cursor=0, limit=None, columns=None):
+    """根据分类查询历法知识"""
+    return (yield from _paged('query_calendar_knowledge_by_category', select_rows(CalendarKnowledge, columns)
+                              .where(CalendarKnowledge.category == category), CalendarKnowledge, cursor, limit))
+
+
+def astronomy_knowledge_by_constellation(constellation, cursor=0, limit=None, columns=None):
+    """根据星宿查询天文知识"""
+    return (yield from _paged('query_astronomy_knowledge_by_constellation', select_rows(AstronomyKnowledge, columns)
+                              .where(AstronomyKnowledge.constellation == constellation),
+                              AstronomyKnowledge, cursor, limit))
+
+
+# 文化百科相关查询
+def cultural_knowledge_by_category(category, cursor=0, limit=None, columns=None):
+    """根据分类查询文化知识"""
+    return (yield from _paged('query_cultural_knowledge_by_category', select_rows(CulturalKnowledge, columns)
+                              .where(CulturalKnowledge.category == category), CulturalKnowledge, cursor, limit))
+
+
+def random_cultural_knowledge():
+    """获取随机文化知识"""
+    try:
+        return (yield from _random_row(CulturalKnowledge, culture_id_pool))
+    except OperationalError as e:
+        logger.info("query_random_cultural_knowledge errorMsg= {} ".format(e))
+        return None
+
+
+def local_midnight(day):
+    """本地日期 day 的零点（LOCAL_TZ_OFFSET_HOURS），换算为与 created_at 一致的服务器本地时间"""
+    tz = timezone(timedelta(hours=config.LOCAL_TZ_OFFSET_HOURS))
+    return datetime(day.year, day.month, day.day, tzinfo=tz).astimezone().replace(tzinfo=None)
+
+
+def daily_cultural_knowledge(day):
+    """
+    获取某一天的文化知识，由日期在当天零点之前已有的记录中确定性地选出，每个进程每天只查询一次
+    :param day: 本地日期
+    :return: 行，表为空时返回 None
+    """
+    key = day.isoformat()
+    try:
+        knowledge = daily_culture_cache.get(key)
+        if knowledge is not MISSING:
+            return knowledge
+        for _ in range(RANDOM_MAX_RETRIES):
+            id = yield partial(culture_id_pool.pick, key, local_midnight(day))
+            if id is None:
+                return None
+            knowledge = _first((yield select(CulturalKnowledge.__table__).where(CulturalKnowledge.id == id)))
+            if knowledge is not None:
+                daily_culture_cache.set(key, knowledge)
+                return knowledge
+            logger.info("daily {} id= {} no longer exists ".format(CulturalKnowledge.__tablename__, id))
+            culture_id_pool.discard(id)
+        return None
+    except OperationalError as e:
+        logger.info("query_daily_cultural_knowledge errorMsg= {} ".format(e))
+        return None
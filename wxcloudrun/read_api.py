@@ -0,0 +1,159 @@
+"""
+同步视图（views.py）与异步视图（asgi.py）共用的只读接口实现
+每个接口是 queries 中同样形式的计划：解析参数、生成查询并由执行方送回结果，返回响应；
+在请求上下文中由 dao.run_plan 或 async_dao.run_plan 执行
+"""
+from flask import request
+
+from wxcloudrun import queries
+from wxcloudrun.http_cache import cache_until_local_midnight, local_now
+from wxcloudrun.pagination import parse_page_args, next_cursor
+from wxcloudrun.reference_data import calendar_snapshot, astronomy_snapshot
+from wxcloudrun.response import make_succ_response, make_succ_page_response, make_err_response
+from wxcloudrun.serializers import poetry_serializer, etymology_serializer, character_brief_serializer, \
+    culture_serializer
+
+
+def _page_response(serializer, items, limit):
+    if items is None:
+        return make_err_response('查询失败')
+    return make_succ_page_response(serializer.dump_many(items), next_cursor(items, limit))
+
+
+def _reference_page(snapshot, query, key, cursor, limit):
+    """从参考数据快照返回一页，快照不可用时回退为查库"""
+    # 过期快照的版本比对可能查库，异步执行时放到线程池；之后的取页只读内存（需在请求上下文中协商压缩）
+    yield snapshot.current
+    response = snapshot.page_response(key, cursor, limit)
+    if response is not None:
+        return response
+    items = yield from query(key, cursor, limit, snapshot.serializer.columns)
+    return _page_response(snapshot.serializer, items, limit)
+
+
+# 诗词相关API
+def search_poetry():
+    """搜索诗词"""
+    keyword = request.args.get('keyword', '')
+    author = request.args.get('author', '')
+    try:
+        cursor, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return make_err_response(str(e))
+
+    if keyword:
+        poems = yield from queries.poetry_by_keyword(keyword, cursor, limit, poetry_serializer.columns)
+    elif author:
+        poems = yield from queries.poetry_by_author(author, cursor, limit, poetry_serializer.columns)
+    else:
+        poems = []
+    return _page_response(poetry_serializer, poems, limit)
+
+
+def get_random_poetry():
+    """获取随机诗词"""
+    poem = yield from queries.random_poetry()
+    return make_succ_response(poetry_serializer.dump(poem))
+
+
+# 汉字字源相关API
+def search_character_etymology():
+    """查询单个汉字的字源信息"""
+    character = request.args.get('character', '')
+
+    if not character:
+        return make_err_response('请输入要查询的汉字')
+
+    if len(character) > 1:
+        return make_err_response('只能查询单个汉字')
+
+    etymology = yield from queries.character_etymology(character)
+    return make_succ_response(etymology_serializer.dump(etymology))
+
+
+def get_characters_by_radical():
+    """按部首查询汉字"""
+    radical = request.args.get('radical', '')
+
+    if not radical:
+        return make_err_response('请输入部首')
+    try:
+        cursor, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return make_err_response(str(e))
+
+    characters = yield from queries.characters_by_radical(radical, cursor, limit, character_brief_serializer.columns)
+    return _page_response(character_brief_serializer, characters, limit)
+
+
+def get_characters_by_stroke_count():
+    """按笔画数查询汉字"""
+    stroke_count = request.args.get('count', '')
+
+    if not stroke_count or not stroke_count.isdigit():
+        return make_err_response('请输入有效的笔画数')
+    try:
+        cursor, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return make_err_response(str(e))
+
+    characters = yield from queries.characters_by_stroke_count(
+        int(stroke_count), cursor, limit, character_brief_serializer.columns)
+    return _page_response(character_brief_serializer, characters, limit)
+
+
+# 历法知识相关API
+def get_solar_terms():
+    """获取节气信息"""
+    try:
+        cursor, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return make_err_response(str(e))
+    return (yield from _reference_page(calendar_snapshot, queries.calendar_knowledge_by_category,
+                                       '节气', cursor, limit))
+
+
+def get_festivals():
+    """获取传统节日"""
+    try:
+        cursor, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return make_err_response(str(e))
+    return (yield from _reference_page(calendar_snapshot, queries.calendar_knowledge_by_category,
+                                       '节日', cursor, limit))
+
+
+# 天文知识相关API
+def get_constellations():
+    """获取星宿信息"""
+    constellation = request.args.get('constellation', '')
+    try:
+        cursor, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return make_err_response(str(e))
+    if not constellation:
+        return make_succ_page_response([], None)
+    return (yield from _reference_page(astronomy_snapshot, queries.astronomy_knowledge_by_constellation,
+                                       constellation, cursor, limit))
+
+
+# 文化百科相关API
+def get_daily_culture():
+    """获取每日文化知识，同一天内所有请求返回同一条"""
+    now = local_now()
+    knowledge = yield from queries.daily_cultural_knowledge(now.date())
+    response = make_succ_response(culture_serializer.dump(knowledge))
+    if knowledge is not None:
+        cache_until_local_midnight(response, now)
+    return response
+
+
+def get_culture_by_category():
+    """根据分类获取文化知识"""
+    category = request.args.get('category', '')
+    try:
+        cursor, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return make_err_response(str(e))
+    knowledge = yield from queries.cultural_knowledge_by_category(category, cursor, limit, culture_serializer.columns)
+    return _page_response(culture_serializer, knowledge, limit)
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import config
+from wxcloudrun import db
+from wxcloudrun.compression import PrecompressedPage
+from wxcloudrun.model import CalendarKnowledge, AstronomyKnowledge, TableVersions
+from wxcloudrun.response import dumps, make_succ_page_response
+from wxcloudrun.serializers import calendar_serializer, astronomy_serializer
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 某一版本的只读快照
+# groups: {分组键: (升序 id 元组, 序列化后的字典元组)}
+# pages: {(分组键, 游标): 默认每页条数下预先序列化并压缩好的整页响应}
+Snapshot = namedtuple('Snapshot', ['version', 'groups', 'pages'])
+
+
+def _page_body(items, ids, start, limit):
+    page = items[start:start + limit]
+    cursor = ids[start + limit - 1] if len(page) == limit else None
+    return list(page), cursor
+
+
+class ReferenceSnapshot(object):
+    """
+    小而稳定的参考数据表的进程内快照，按分组列预先序列化，请求时不访问数据库
+    本进程写入后整体重建并替换引用；定期比对表版本，追平其他实例的写入
+    """
+
+    def __init__(self, model, group_column, serializer):
+        self.model = model
+        self.serializer = serializer
+        self._group_column = group_column
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0
+
+    def _version(self):
+        version = db.session.query(TableVersions.version) \
+            .filter(TableVersions.table_name == self.model.__tablename__).scalar()
+        return version or 0
+
+    def _fresh(self):
+        return self._snapshot is not None \
+            and time.monotonic() - self._checked_at < config.REFERENCE_SNAPSHOT_REFRESH_SECONDS
+
+    def load(self):
+        """全量读取并替换快照，先读版本再读数据，读取期间的写入会在下次比对时追平"""
+        with self._lock:
+            version = self._version()
+            rows = db.session.query(self._group_column, *self.serializer.columns).order_by(self.model.id).all()
+            grouped = {}
+            for row in rows:
+                ids, items = grouped.setdefault(row[0], ([], []))
+                ids.append(row.id)
+                items.append(self.serializer.dump(row))
+            groups = {key: (tuple(ids), tuple(items)) for key, (ids, items) in grouped.items()}
+
+            pages = {}
+            limit = config.PAGE_SIZE_DEFAULT
+            for key, (ids, items) in groups.items():
+                cursor, start = 0, 0
+                while cursor is not None:
+                    data, next_cursor = _page_body(items, ids, start, limit)
+                    body = dumps({'code': 0, 'data': data, 'nextCursor': next_cursor})
+                    pages[(key, cursor)] = PrecompressedPage(body, 'application/json')
+                    cursor, start = next_cursor, start + limit
+
+            self._snapshot = Snapshot(version, groups, pages)
+            self._checked_at = time.monotonic()
+            logger.info("reference snapshot loaded table= {} version= {} rows= {} ".format(
+                self.model.__tablename__, version, len(rows)))
+
+    def on_insert(self):
+        """本进程写入提交后调用，快照尚未加载时不做任何事"""
+        if self._snapshot is not None:
+            self.load()
+
+    def current(self):
+        """
+        返回当前快照，超过 REFERENCE_SNAPSHOT_REFRESH_SECONDS 时比对表版本，版本变化则重建
+        比对由一个线程进行，其余线程继续使用旧快照
+        :return: 快照，数据库不可用且从未加载成功时返回 None
+        """
+        if self._fresh():
+            return self._snapshot
+        if not self._refresh_lock.acquire(blocking=self._snapshot is None):
+            return self._snapshot
+        try:
+            if not self._fresh():
+                if self._snapshot is None or self._version() != self._snapshot.version:
+                    self.load()
+                self._checked_at = time.monotonic()
+        except SQLAlchemyError as e:
+            logger.info("reference snapshot refresh table= {} errorMsg= {} ".format(self.model.__tablename__, e))
+            db.session.rollback()
+        finally:
+            self._refresh_lock.release()
+        return self._snapshot
+
+    def versions(self):
+        """{表名: 快照版本}，用于生成 ETag"""
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+        return {self.model.__tablename__: snapshot.version}
+
+    def page_response(self, key, cursor, limit):
+        """
+        从快照返回一页数据的响应，默认每页条数时直接使用预先压缩好的响应
+        :return: 响应，快照不可用时返回 None
+        """
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+        if limit == config.PAGE_SIZE_DEFAULT:
+            page = snapshot.pages.get((key, cursor))
+            if page is not None:
+                return page.response()
+        ids, items = snapshot.groups.get(key, ((), ()))
+        data, next_cursor = _page_body(items, ids, bisect_right(ids, cursor), limit)
+        return make_succ_page_response(data, next_cursor)
+
+
+calendar_snapshot = ReferenceSnapshot(CalendarKnowledge, CalendarKnowledge.category, calendar_serializer)
+astronomy_snapshot = ReferenceSnapshot(AstronomyKnowledge, AstronomyKnowledge.constellation, astronomy_serializer)
+
+
+def load_snapshots():
+    """启动时加载参考数据快照，数据库不可用时不影响启动，首次请求时再加载"""
+    for snapshot in (calendar_snapshot, astronomy_snapshot):
+        try:
+            snapshot.load()
+        except SQLAlchemyError as e:
+            logger.warning("load_snapshots table= {} errorMsg= {} ".format(snapshot.model.__tablename__, e))
+            db.session.rollback()
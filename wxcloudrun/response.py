@@ -1,18 +1,48 @@
 import json
 
-from flask import Response
+from flask import Response, stream_with_context
+
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson; charset=utf-8'
+
+
+def dumps(obj):
+    """
+    序列化为紧凑的 UTF-8 JSON 字节，中文不转义为 \\uXXXX
+    安装了 orjson 且 JSON_FAST_ENCODER 开启时使用 orjson，否则使用标准库
+    """
+    if orjson is not None and config.JSON_FAST_ENCODER:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
 
 def make_succ_empty_response():
-    data = json.dumps({'code': 0, 'data': {}})
-    return Response(data, mimetype='application/json')
+    data = dumps({'code': 0, 'data': {}})
+    return Response(data, content_type=JSON_CONTENT_TYPE)
 
 
 def make_succ_response(data):
-    data = json.dumps({'code': 0, 'data': data})
-    return Response(data, mimetype='application/json')
+    data = dumps({'code': 0, 'data': data})
+    return Response(data, content_type=JSON_CONTENT_TYPE)
+
+
+def make_succ_page_response(data, next_cursor):
+    data = dumps({'code': 0, 'data': data, 'nextCursor': next_cursor})
+    return Response(data, content_type=JSON_CONTENT_TYPE)
 
 
 def make_err_response(err_msg):
-    data = json.dumps({'code': -1, 'errorMsg': err_msg})
-    return Response(data, mimetype='application/json')
+    data = dumps({'code': -1, 'errorMsg': err_msg})
+    return Response(data, content_type=JSON_CONTENT_TYPE)
+
+
+def make_ndjson_response(lines):
+    """流式输出 NDJSON：lines 为逐行对象的生成器，在请求上下文中迭代"""
+    return Response(stream_with_context(dumps(line) + b'\n' for line in lines), content_type=NDJSON_CONTENT_TYPE)
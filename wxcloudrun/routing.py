@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm, text
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.sql import Select
+
+import config
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 只读副本在 SQLALCHEMY_BINDS 中的名称
+REPLICA_BIND = 'replica'
+
+
+def replica_uri(config):
+    """
+    只读副本的连接串，DATABASE_READ_URI 优先，其次由 MYSQL_READ_ADDRESS 与主库账号拼出
+    :return: 连接串，未配置副本时返回 None
+    """
+    if config.database_read_uri:
+        return config.database_read_uri
+    if config.db_read_address:
+        return 'mysql://{}:{}@{}/flask_demo'.format(config.username, config.password, config.db_read_address)
+    return None
+
+
+class ReplicaHealth(object):
+    """
+    副本的可用状态。连接失败时标记为不可用，REPLICA_RETRY_SECONDS 内的读查询走主库，
+    到期后先探活再恢复使用
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._down_until = 0
+        self._registered = set()
+
+    def watch(self, engine):
+        """在副本引擎上登记错误回调，连接类错误时标记不可用"""
+        if engine in self._registered:
+            return
+        with self._lock:
+            if engine not in self._registered:
+                event.listen(engine, 'handle_error', self._on_error)
+                self._registered.add(engine)
+
+    def _on_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.original_exception)
+
+    def mark_down(self, error):
+        now = time.monotonic()
+        was_down = now < self._down_until
+        self._down_until = now + config.REPLICA_RETRY_SECONDS
+        if not was_down:
+            logger.warning("replica unavailable, reads fall back to primary for {}s errorMsg= {} ".format(
+                config.REPLICA_RETRY_SECONDS, error))
+
+    def is_down(self):
+        """是否仍处于标记不可用的时段内，到期后由下一次使用副本的查询探活"""
+        return time.monotonic() < self._down_until
+
+    def available(self, engine):
+        if not self._down_until:
+            return True
+        if time.monotonic() < self._down_until or not self._lock.acquire(blocking=False):
+            return False
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            self._down_until = 0
+            logger.info("replica recovered")
+            return True
+        except SQLAlchemyError as e:
+            self.mark_down(e)
+            return False
+        finally:
+            self._lock.release()
+
+
+replica_health = ReplicaHealth()
+
+
+class RoutingSession(SignallingSession):
+    """
+    读写分离的会话：SELECT 走只读副本，flush、加锁的 SELECT（FOR UPDATE / 共享锁）与 INSERT/UPDATE/DELETE 等其他语句走主库
+    会话一旦写过主库，之后的读查询也走主库（同一请求内读到自己的写入）；会话在每个请求结束时移除
+    副本上的 SELECT 失败（OperationalError，含连接断开）时标记副本不可用并在主库上重试一次，与异步接口一致
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+        self._replica_enabled = REPLICA_BIND in (self.app.config['SQLALCHEMY_BINDS'] or {})
+        self._read_replica = False
+
+    def execute(self, statement, *args, **kwargs):
+        self._read_replica = False
+        try:
+            return super(RoutingSession, self).execute(statement, *args, **kwargs)
+        except OperationalError as e:
+            if not self._read_replica:
+                raise
+            replica_health.mark_down(e.orig or e)
+        # 走副本说明本会话尚未写过主库，回滚只丢弃失效的副本连接
+        self.rollback()
+        return super(RoutingSession, self).execute(statement, *args, **kwargs)
+
+    def use_primary(self):
+        """之后的查询都走主库，用于先读后写、需要读到最新数据的场景"""
+        self.info['primary'] = True
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = super(RoutingSession, self).get_bind(mapper, clause)
+        if not self._replica_enabled:
+            return primary
+        if self._flushing or not isinstance(clause, Select) or clause._for_update_arg is not None:
+            self.info['primary'] = True
+            return primary
+        if self.info.get('primary'):
+            return primary
+        replica = self.db.get_engine(self.app, bind=REPLICA_BIND)
+        replica_health.watch(replica)
+        if not replica_health.available(replica):
+            return primary
+        self._read_replica = True
+        return replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """使用 RoutingSession 的 SQLAlchemy，未配置副本时与原来一致"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
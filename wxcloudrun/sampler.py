@@ -0,0 +1,94 @@
+import hashlib
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy import func
+
+import config
+from wxcloudrun import db
+from wxcloudrun.model import Poetry, CulturalKnowledge
+
+
+# 每个 id 池保留的 pick 候选上界个数（当天与前一天）
+PINS_KEEP = 2
+
+
+class IdPool(object):
+    """
+    某张表全部 id 的进程内快照，用于与表大小无关的均匀随机抽样
+    按 id 定期增量追平其他实例新增的记录，抽到已删除的 id 时由调用方 discard
+    """
+
+    def __init__(self, model):
+        self._model = model
+        self._lock = threading.Lock()
+        self._ids = array('I')
+        self._loaded = False
+        self._refreshed_at = 0
+        self._pins = {}
+
+    def refresh(self):
+        """增量加载 id 大于池中最大 id 的记录"""
+        with self._lock:
+            max_id = self._ids[-1] if self._ids else 0
+            rows = db.session.query(self._model.id) \
+                .filter(self._model.id > max_id) \
+                .order_by(self._model.id)
+            self._ids.extend(row.id for row in rows)
+            self._loaded = True
+            self._refreshed_at = time.monotonic()
+
+    def on_insert(self):
+        """插入记录后调用，id 池尚未加载时不做任何事"""
+        if self._loaded:
+            self.refresh()
+
+    def discard(self, id):
+        """从池中移除已不存在的 id"""
+        with self._lock:
+            i = bisect_left(self._ids, id)
+            if i < len(self._ids) and self._ids[i] == id:
+                del self._ids[i]
+
+    def sample(self):
+        """
+        均匀随机取一个 id
+        :return: id，表为空时返回 None
+        """
+        if not self._ids or time.monotonic() - self._refreshed_at >= config.RANDOM_POOL_REFRESH_SECONDS:
+            self.refresh()
+        with self._lock:
+            return random.choice(self._ids) if self._ids else None
+
+    def _pin(self, key, until):
+        """created_at 早于 until 的记录的最大 id，按 key 缓存；表在 until 之前为空时为 None"""
+        if key not in self._pins:
+            self._pins[key] = db.session.query(func.max(self._model.id)) \
+                .filter(self._model.created_at < until) \
+                .scalar()
+            while len(self._pins) > PINS_KEEP:
+                del self._pins[next(iter(self._pins))]
+        return self._pins[key]
+
+    def pick(self, key, until):
+        """
+        按 key 确定性地选取一个 id：候选为 created_at 早于 until 的记录（以其最大 id 为上界），
+        取其中 sha256(key:id) 最大的 id（最高随机权重哈希）
+        各进程对同一 key 的候选与选择一致，until 之后新增的记录不参与；删除未被选中的记录不改变结果，
+        被选中的记录删除后改选其余候选中哈希最大的；until 之前表为空时在当前全部记录中选取，结果会随新增记录变化
+        :param until: 候选记录的创建时间上界，与 created_at 同为服务器本地时间
+        :return: id，表为空时返回 None
+        """
+        self.refresh()
+        prefix = key.encode('utf-8') + b':'
+        with self._lock:
+            pin = self._pin(key, until)
+            ids = self._ids[:bisect_right(self._ids, pin)] if pin is not None else self._ids
+            return max(ids, key=lambda id: hashlib.sha256(prefix + str(id).encode('ascii')).digest(), default=None)
+
+
+poetry_id_pool = IdPool(Poetry)
+culture_id_pool = IdPool(CulturalKnowledge)
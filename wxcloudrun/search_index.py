@@ -0,0 +1,337 @@
+import logging
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from sqlalchemy import func
+
+import config
+from wxcloudrun import app, db
+from wxcloudrun.model import Poetry
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 参与检索的字段，需与 queries.poetry_by_keyword 中 contains 的字段保持一致
+INDEXED_FIELDS = ('title', 'author', 'content', 'tags')
+
+# LIKE 的通配符与转义符，含有这些字符的关键词无法用索引等价表达，回退为全表扫描
+LIKE_SPECIAL_CHARS = ('%', '_', '\\')
+
+# 建索引与后台追平时每批读取的行数
+BUILD_BATCH_SIZE = 1000
+
+# 每段冻结的倒排表包含的诗词数，建索引时未冻结部分的内存只与一段的大小有关
+SEGMENT_ROWS = 20000
+
+# 请求线程中一次追平的最多行数，更多时转入后台线程，追平前检索回退为全表扫描
+REFRESH_MAX_ROWS = 1000
+
+
+def _fold(text):
+    """
+    归一化文本：兼容分解、去掉附加符号并做大小写折叠
+    归一化只会让候选集变大（MySQL 排序规则下相等的字符折叠后也相等），最终结果仍由数据库校验
+    """
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def _bigram_key(a, b):
+    """双字编码为 (首字码位 + 1) << 21 | 次字码位，总大于任何单字的码位"""
+    return ((a + 1) << 21) | b
+
+
+def _document_keys(text):
+    """返回文本中全部单字与相邻双字的整数键"""
+    codes = [ord(c) for c in _fold(text)]
+    keys = set(codes)
+    keys.update(_bigram_key(a, b) for a, b in zip(codes, codes[1:]))
+    return keys
+
+
+def _keyword_keys(keyword):
+    """返回关键词求交所需的键，单字关键词用单字，其余用全部相邻双字"""
+    codes = [ord(c) for c in _fold(keyword)]
+    if len(codes) <= 1:
+        return set(codes)
+    return {_bigram_key(a, b) for a, b in zip(codes, codes[1:])}
+
+
+def _contains(posting, item):
+    """在有序的倒排表中二分查找"""
+    i = bisect_left(posting, item)
+    return i < len(posting) and posting[i] == item
+
+
+class _Segment(object):
+    """
+    冻结的一段倒排表：升序的键、各键在 ids 中的起始偏移与按键拼接的 id，全部存放在 array 中
+    只有几个对象头，fork 后各工作进程共享这段内存，不会因引用计数而被复制
+    """
+
+    def __init__(self, postings):
+        self.keys = array('q', sorted(postings))
+        self.offsets = array('I')
+        self.ids = array('I')
+        for key in self.keys:
+            self.offsets.append(len(self.ids))
+            self.ids.extend(postings.pop(key))
+        self.offsets.append(len(self.ids))
+
+    def get(self, key):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.ids[self.offsets[i]:self.offsets[i + 1]]
+        return None
+
+
+class PoetryIndex(object):
+    """
+    诗词的单字/双字倒排索引
+    由 gunicorn master 在 fork 之前建立（见 gunicorn.conf.py），按 SEGMENT_ROWS 冻结为紧凑的分段；
+    未经 master 建立时在后台线程中建立，请求线程不做全量建立，建立完成前检索回退为全表扫描
+    检索时定期追平其他实例的写入：按 id 索引新增的诗词，按变更序号把被更新的诗词补入新内容的倒排表，
+    更新前内容留下的 id 只会让候选集变大，最终结果仍由数据库校验
+    键与 id 的总数超过 POETRY_INDEX_MAX_POSTINGS 时放弃索引，始终回退为全表扫描
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # 追平锁，同时至多一个线程查库追平；self._lock 只在合并倒排表与检索时持有
+        self._catching_up = threading.Lock()
+        self._background = threading.Lock()
+        self._segments = ()
+        self._delta = {}
+        self._delta_rows = 0
+        self._size = 0
+        self._max_id = 0
+        self._max_seq = 0
+        self._built = False
+        self._disabled = False
+        self._lagging = False
+        self._refreshed_at = 0
+
+    @property
+    def max_id(self):
+        """已索引的最大诗词 id，可用于判断索引是否有增量，建立完成前为 0"""
+        return self._max_id if self._built else 0
+
+    @property
+    def ready(self):
+        """索引已建立、已追平且已启用，可直接用于检索；与 candidates 不同，不会触发建立"""
+        return config.POETRY_INDEX_ENABLED and self._built and not self._disabled and not self._lagging
+
+    def _reset(self):
+        self._segments = ()
+        self._delta = {}
+        self._delta_rows = 0
+        self._size = 0
+        self._max_id = 0
+        self._max_seq = 0
+
+    def _add(self, row):
+        if self._disabled:
+            return
+        keys = set()
+        for field in INDEXED_FIELDS:
+            keys |= _document_keys(getattr(row, field) or '')
+        for key in keys:
+            posting = self._delta.get(key)
+            if posting is None:
+                posting = self._delta[key] = array('I')
+            if not posting or posting[-1] < row.id:
+                posting.append(row.id)
+            elif not _contains(posting, row.id):
+                posting.insert(bisect_left(posting, row.id), row.id)
+        self._max_id = max(self._max_id, row.id)
+        self._delta_rows += 1
+        self._size += len(keys)
+        if self._size > config.POETRY_INDEX_MAX_POSTINGS:
+            self._reset()
+            self._disabled = True
+            logger.warning("poetry index exceeds POETRY_INDEX_MAX_POSTINGS= {}, keyword search falls back to "
+                           "table scan ".format(config.POETRY_INDEX_MAX_POSTINGS))
+        elif self._delta_rows >= SEGMENT_ROWS:
+            self._freeze()
+
+    def _freeze(self):
+        if self._delta:
+            self._segments += (_Segment(self._delta),)
+        self._delta = {}
+        self._delta_rows = 0
+
+    def _catch_up(self, limit, blocking=True):
+        """
+        索引至多 limit 行新增的诗词与 limit 行被更新的诗词
+        查库时只持有追平锁，检索不必等待数据库往返，取回的行在 self._lock 内合并
+        :param blocking: 为 False 时其他线程正在追平则立即返回
+        :return: 是否已追平，未取得追平锁时返回 None
+        """
+        if not self._catching_up.acquire(blocking=blocking):
+            return None
+        try:
+            if self._disabled:
+                return True
+            columns = (Poetry.id, Poetry.title, Poetry.author, Poetry.content, Poetry.tags, Poetry.change_seq)
+            # 只有持有追平锁的线程修改 _max_id 与 _max_seq，查库期间二者不变
+            max_id = self._max_id
+            built = self._built
+            updated = ()
+            if built:
+                # 先取当前最大序号作为本次的上界，之后提交的更新序号更大，留到下次追平
+                max_seq = db.session.query(func.max(Poetry.change_seq)).scalar() or 0
+                updated = db.session.query(*columns) \
+                    .filter(Poetry.change_seq > self._max_seq, Poetry.change_seq <= max_seq, Poetry.id <= max_id) \
+                    .order_by(Poetry.change_seq) \
+                    .limit(limit) \
+                    .all()
+            rows = db.session.query(*columns) \
+                .filter(Poetry.id > max_id) \
+                .order_by(Poetry.id) \
+                .limit(limit) \
+                .all()
+            with self._lock:
+                for row in updated:
+                    self._add(row)
+                if built:
+                    self._max_seq = updated[-1].change_seq if len(updated) == limit else max_seq
+                for row in rows:
+                    self._add(row)
+            return len(updated) < limit and len(rows) < limit
+        finally:
+            self._catching_up.release()
+
+    def build(self):
+        """全量建立索引，在 gunicorn master 中或后台线程中调用"""
+        started = time.monotonic()
+        with self._catching_up:
+            max_seq = db.session.query(func.max(Poetry.change_seq)).scalar() or 0
+            with self._lock:
+                self._reset()
+                self._disabled = False
+                self._built = False
+        while not self._catch_up(BUILD_BATCH_SIZE):
+            pass
+        with self._catching_up, self._lock:
+            if self._disabled:
+                return
+            self._freeze()
+            self._max_seq = max_seq
+            self._built = True
+            self._lagging = False
+            self._refreshed_at = time.monotonic()
+        logger.info("poetry index built max_id= {} postings= {} segments= {} cost= {:.1f}s ".format(
+            self._max_id, self._size, len(self._segments), time.monotonic() - started))
+
+    def _catch_up_all(self):
+        while not self._catch_up(BUILD_BATCH_SIZE):
+            pass
+        self._lagging = False
+        self._refreshed_at = time.monotonic()
+
+    def _in_background(self, fn):
+        """在后台线程中执行建立或追平，同时至多一个"""
+        if not self._background.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                with app.app_context():
+                    fn()
+            except Exception as e:
+                logger.warning("poetry index background errorMsg= {} ".format(e))
+            finally:
+                self._background.release()
+
+        threading.Thread(target=run, name='poetry-index', daemon=True).start()
+
+    def build_in_background(self):
+        """尚未建立时在后台线程中建立"""
+        if not self._built and not self._disabled and config.POETRY_INDEX_ENABLED:
+            self._in_background(self.build)
+
+    def _usable(self):
+        """索引可直接用于检索；尚未建立时在后台建立"""
+        if self._disabled or not config.POETRY_INDEX_ENABLED:
+            return False
+        if not self._built:
+            self._in_background(self.build)
+            return False
+        return not self._lagging
+
+    def refresh(self):
+        """
+        追平其他实例的写入，积压较多时转入后台线程
+        :return: 索引是否已追平
+        """
+        if not self._usable():
+            return False
+        done = self._catch_up(REFRESH_MAX_ROWS, blocking=False)
+        if done is None:
+            # 其他线程正在追平，沿用当前索引，与两次追平之间的检索相同
+            return not self._lagging
+        if done:
+            self._refreshed_at = time.monotonic()
+            return True
+        self._lagging = True
+        self._in_background(self._catch_up_all)
+        return False
+
+    def on_insert(self):
+        """插入诗词后调用，索引尚未建立时不做任何事"""
+        if self._built:
+            self.refresh()
+
+    def _posting(self, key):
+        """合并各段与未冻结部分中该键的 id，返回升序且不重复的 id 序列"""
+        parts = [posting for posting in (segment.get(key) for segment in self._segments) if posting]
+        posting = self._delta.get(key)
+        if posting:
+            parts.append(posting)
+        if not parts:
+            return ()
+        if len(parts) == 1:
+            return parts[0]
+        if all(a[-1] < b[0] for a, b in zip(parts, parts[1:])):
+            merged = array('I')
+            for part in parts:
+                merged.extend(part)
+            return merged
+        # 被更新的诗词会在后面的段中再次出现
+        return array('I', sorted(set().union(*parts)))
+
+    def document_frequency(self, text):
+        """包含该单字或双字的诗词数，索引尚不可用时返回 0"""
+        keys = _keyword_keys(text)
+        if len(keys) != 1 or not self._usable():
+            return 0
+        with self._lock:
+            return len(self._posting(keys.pop()))
+
+    def candidates(self, keyword):
+        """
+        返回可能匹配关键词的诗词 id（升序）
+        :param keyword: 检索关键词
+        :return: id 列表；关键词无法使用索引或索引尚不可用时返回 None
+        """
+        if any(c in keyword for c in LIKE_SPECIAL_CHARS):
+            return None
+        keys = _keyword_keys(keyword)
+        if not keys or not self._usable():
+            return None
+        if time.monotonic() - self._refreshed_at >= config.POETRY_INDEX_REFRESH_SECONDS and not self.refresh():
+            return None
+        with self._lock:
+            postings = sorted((self._posting(key) for key in keys), key=len)
+            ids = list(postings[0])
+            for posting in postings[1:]:
+                if not ids:
+                    break
+                ids = [i for i in ids if _contains(posting, i)]
+        return ids
+
+
+poetry_index = PoetryIndex()
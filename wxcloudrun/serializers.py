@@ -0,0 +1,49 @@
+from operator import attrgetter
+
+from wxcloudrun.model import Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge
+
+
+class Serializer(object):
+    """
+    声明式的响应序列化：按字段列表从实体或查询行中取值
+    columns 可直接传给 DAO 做列投影，只查询需要的字段
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+        self._getter = attrgetter(*self.fields)
+
+    @property
+    def columns(self):
+        return [getattr(self.model, field) for field in self.fields]
+
+    def dump(self, obj):
+        """实体或行转为字典，obj 为 None 时返回 None"""
+        if obj is None:
+            return None
+        return dict(zip(self.fields, self._getter(obj)))
+
+    def dump_many(self, objs):
+        return [self.dump(obj) for obj in objs]
+
+
+# 各接口的响应字段
+poetry_serializer = Serializer(Poetry, ('id', 'title', 'author', 'dynasty', 'content', 'tags'))
+etymology_serializer = Serializer(CharacterEtymology, (
+    'id', 'character', 'pinyin', 'radical', 'stroke_count', 'etymology', 'ancient_forms', 'meaning',
+    'extended_meanings', 'examples', 'stroke_order', 'dictionary_source'))
+character_brief_serializer = Serializer(CharacterEtymology, (
+    'id', 'character', 'pinyin', 'radical', 'stroke_count', 'meaning'))
+calendar_serializer = Serializer(CalendarKnowledge, ('id', 'title', 'content', 'date_info'))
+astronomy_serializer = Serializer(AstronomyKnowledge, ('id', 'title', 'content', 'constellation', 'period'))
+culture_serializer = Serializer(CulturalKnowledge, ('id', 'title', 'content', 'category', 'tags'))
+
+# 增量同步输出的完整字段，按 /api/sync 的表名
+sync_serializers = {
+    'poetry': poetry_serializer,
+    'etymology': etymology_serializer,
+    'calendar': Serializer(CalendarKnowledge, ('id', 'title', 'content', 'category', 'date_info')),
+    'astronomy': astronomy_serializer,
+    'culture': culture_serializer,
+}
@@ -0,0 +1,303 @@
+import heapq
+import re
+import threading
+import time
+import logging
+import unicodedata
+from bisect import bisect_left, insort
+
+import config
+from wxcloudrun import app, db
+from wxcloudrun.cache import MISSING, TTLCache
+from wxcloudrun.model import Poetry, CharacterEtymology
+from wxcloudrun.search_index import poetry_index
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 前缀区间的上界，拼在前缀后与任何以该前缀开头的键比较都更大
+PREFIX_END = chr(0x10FFFF)
+
+# 汉字联想键中拼音与汉字的分隔符
+CHARACTER_KEY_SEPARATOR = '\x00'
+
+# 一次增量加载新增键较多时整体重排，少时逐个插入
+MERGE_THRESHOLD = 64
+
+# 不超过该长度的前缀预先保存权重最高的键，候选最多的短前缀补全时不再扫描整个区间
+TOP_PREFIX_LENGTH = 2
+# 每个短前缀保存的键数，汉字联想按两倍条数取键后按字去重
+TOP_N = 2 * config.SUGGEST_LIMIT_MAX
+
+# 初次建索引时每批读取的行数
+BUILD_BATCH_SIZE = 1000
+
+# 联想结果缓存，新增记录后清空
+suggest_cache = TTLCache('suggest', config.SUGGEST_CACHE_SIZE, config.SUGGEST_CACHE_TTL)
+
+
+def strip_tones(pinyin):
+    """
+    去掉拼音声调并拆成各个读音，如 'hǎo, hào' -> ['hao']
+    ü 保留为 v，与常见输入法一致
+    """
+    pinyin = unicodedata.normalize('NFKD', pinyin.replace('ü', 'v').replace('Ü', 'v'))
+    pinyin = ''.join(c for c in pinyin if not unicodedata.combining(c)).lower()
+    return list(dict.fromkeys(re.findall('[a-z]+', pinyin)))
+
+
+class PrefixIndex(object):
+    """
+    有序键列表与键的权重，按前缀二分定位区间后取权重最高的若干个
+    长度不超过 TOP_PREFIX_LENGTH 的前缀另存权重最高的 TOP_N 个键（按 (-权重, 键) 升序），直接截取
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._weights = {}
+        self._top = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, counts):
+        """累加各键的权重，新键插入有序列表"""
+        new_keys = [key for key in counts if key not in self._weights]
+        for key, count in counts.items():
+            self._weights[key] = self._weights.get(key, 0) + count
+        if len(new_keys) > MERGE_THRESHOLD:
+            self._keys.extend(new_keys)
+            self._keys.sort()
+        else:
+            for key in new_keys:
+                insort(self._keys, key)
+        if len(counts) > MERGE_THRESHOLD:
+            self._rebuild_top()
+        else:
+            for key in counts:
+                self._offer(key)
+
+    def keys(self):
+        """全部键的副本"""
+        return list(self._keys)
+
+    def reweigh(self, weights):
+        """用 {键: 权重} 替换各键的权重，不在其中的键（重算期间新增）保留原权重"""
+        self._weights = {key: weights.get(key, self._weights[key]) for key in self._keys}
+        self._rebuild_top()
+
+    def _short_prefixes(self, key):
+        return [key[:n] for n in range(1, min(len(key), TOP_PREFIX_LENGTH) + 1)]
+
+    def _rebuild_top(self):
+        groups = {}
+        for key, weight in self._weights.items():
+            for prefix in self._short_prefixes(key):
+                groups.setdefault(prefix, []).append((-weight, key))
+        self._top = {prefix: heapq.nsmallest(TOP_N, entries) for prefix, entries in groups.items()}
+
+    def _offer(self, key):
+        """权重只增不减，增加后的键要么已在短前缀的列表中、要么与列表末尾比较决定是否进入"""
+        entry = (-self._weights[key], key)
+        for prefix in self._short_prefixes(key):
+            top = self._top.setdefault(prefix, [])
+            for i, (_, k) in enumerate(top):
+                if k == key:
+                    del top[i]
+                    break
+            if len(top) < TOP_N or entry < top[-1]:
+                insort(top, entry)
+                del top[TOP_N:]
+
+    def complete(self, prefix, limit):
+        """
+        以 prefix 开头、权重最高的 limit 个键，权重相同时按键排序
+        :return: [(键, 权重)]
+        """
+        if len(prefix) <= TOP_PREFIX_LENGTH and limit <= TOP_N:
+            best = self._top.get(prefix, [])[:limit]
+        else:
+            weights = self._weights
+            start = bisect_left(self._keys, prefix)
+            end = bisect_left(self._keys, prefix + PREFIX_END, start)
+            best = heapq.nsmallest(limit, ((-weights[key], key) for key in self._keys[start:end]))
+        return [(key, -w) for w, key in best]
+
+
+class _Suggester(object):
+    """
+    按 id 增量加载某张表的联想索引，每次至多间隔 SUGGEST_REFRESH_SECONDS 追平其他实例的写入
+    由 gunicorn master 在 fork 之前建立（见 gunicorn.conf.py），未经 master 建立时在后台线程中建立，建立完成前没有联想结果
+    """
+
+    def __init__(self, model, columns, add):
+        """
+        :param columns: 除 id 外需要加载的列
+        :param add: 把一批新加载的行加入索引的函数
+        """
+        self._model = model
+        self._columns = columns
+        self._add = add
+        self._lock = threading.RLock()
+        self._background = threading.Lock()
+        self._max_id = 0
+        self._built = False
+        self._refreshed_at = 0
+
+    def refresh(self):
+        """增量加载 id 大于已加载最大 id 的记录"""
+        with self._lock:
+            query = db.session.query(self._model.id, *self._columns) \
+                .filter(self._model.id > self._max_id) \
+                .order_by(self._model.id) \
+                .yield_per(BUILD_BATCH_SIZE)
+            rows = list(query)
+            if rows:
+                self._add(rows)
+                self._max_id = rows[-1].id
+                suggest_cache.clear()
+            self._built = True
+            self._refreshed_at = time.monotonic()
+
+    def build(self):
+        """全量建立联想索引，在 gunicorn master 中或后台线程中调用"""
+        self.refresh()
+
+    def _in_background(self, fn):
+        """在后台线程中执行建立或重算权重，同时至多一个"""
+        if not self._background.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                with app.app_context():
+                    fn()
+            except Exception as e:
+                logger.warning("suggest background errorMsg= {} ".format(e))
+            finally:
+                self._background.release()
+
+        threading.Thread(target=run, name='suggest', daemon=True).start()
+
+    def _ready(self):
+        """索引已建立；尚未建立时在后台建立"""
+        if not self._built:
+            self._in_background(self.build)
+            return False
+        return True
+
+    def on_insert(self):
+        """插入记录后调用，索引尚未建立时不做任何事"""
+        if self._built:
+            self.refresh()
+
+    def _ensure_fresh(self):
+        if time.monotonic() - self._refreshed_at >= config.SUGGEST_REFRESH_SECONDS:
+            self.refresh()
+
+
+class PoetrySuggester(_Suggester):
+    """作者与诗题的联想，权重为诗词数"""
+
+    def __init__(self):
+        super(PoetrySuggester, self).__init__(Poetry, (Poetry.author, Poetry.title), self._index_rows)
+        self._indexes = {'author': PrefixIndex(), 'title': PrefixIndex()}
+
+    def _index_rows(self, rows):
+        for field, index in self._indexes.items():
+            counts = {}
+            for row in rows:
+                key = getattr(row, field)
+                if key:
+                    counts[key] = counts.get(key, 0) + 1
+            index.update(counts)
+
+    def complete(self, field, prefix, limit):
+        """:return: [(键, 权重)]，索引尚未建立时返回 None"""
+        if not self._ready():
+            return None
+        self._ensure_fresh()
+        with self._lock:
+            return self._indexes[field].complete(prefix, limit)
+
+
+class CharacterSuggester(_Suggester):
+    """
+    按不带声调的拼音前缀联想汉字，权重为诗词中包含该字的诗数（来自诗词倒排索引）
+    字源或诗词有新增时在后台线程中整体重算权重，重算完成前与诗词索引不可用时沿用原权重
+    """
+
+    def __init__(self):
+        super(CharacterSuggester, self).__init__(
+            CharacterEtymology, (CharacterEtymology.character, CharacterEtymology.pinyin), self._index_rows)
+        self._index = PrefixIndex()
+        self._weighed_at = None
+
+    def _index_rows(self, rows):
+        counts = {}
+        for row in rows:
+            for reading in strip_tones(row.pinyin or ''):
+                counts[reading + CHARACTER_KEY_SEPARATOR + row.character] = 1
+        self._index.update(counts)
+
+    def reweigh(self):
+        """按诗词倒排索引的文档频率重算全部汉字的权重，在 gunicorn master 中或后台线程中调用"""
+        weighed_at = (self._max_id, poetry_index.max_id)
+        if not poetry_index.ready:
+            return
+        with self._lock:
+            keys = self._index.keys()
+        weights = {key: poetry_index.document_frequency(key[-1]) for key in keys}
+        # 重算期间索引变为不可用时文档频率为 0，放弃本次结果
+        if not poetry_index.ready:
+            return
+        with self._lock:
+            self._index.reweigh(weights)
+            self._weighed_at = weighed_at
+        suggest_cache.clear()
+
+    def complete(self, prefix, limit):
+        """:return: [(汉字, 权重)]，索引尚未建立时返回 None"""
+        if not self._ready():
+            return None
+        self._ensure_fresh()
+        prefix = ''.join(strip_tones(prefix))
+        if not prefix:
+            return []
+        if self._weighed_at != (self._max_id, poetry_index.max_id):
+            if poetry_index.ready:
+                self._in_background(self.reweigh)
+            else:
+                poetry_index.build_in_background()
+        with self._lock:
+            keys = self._index.complete(prefix, limit * 2)
+        # 多音字只保留权重最高的一个读音
+        result = {}
+        for key, weight in keys:
+            result.setdefault(key.rpartition(CHARACTER_KEY_SEPARATOR)[2], weight)
+        return list(result.items())[:limit]
+
+
+poetry_suggester = PoetrySuggester()
+character_suggester = CharacterSuggester()
+
+
+def suggest(kind, prefix, limit):
+    """
+    前缀联想
+    :param kind: author、title 或 character
+    :return: [(联想词, 权重)]，按权重降序
+    """
+    key = (kind, prefix, limit)
+    result = suggest_cache.get(key)
+    if result is not MISSING:
+        return result
+    if kind == 'character':
+        result = character_suggester.complete(prefix, limit)
+    else:
+        result = poetry_suggester.complete(kind, prefix, limit)
+    if result is None:
+        # 索引正在后台建立，不缓存空结果
+        return []
+    suggest_cache.set(key, result)
+    return result
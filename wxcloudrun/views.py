@@ -1,16 +1,58 @@
-from datetime import datetime
-from flask import render_template, request, jsonify
+import unicodedata
+
+from flask import render_template, request, jsonify, send_file
 from run import app
+import config
+from wxcloudrun import db
+from wxcloudrun.cache import caches
+from wxcloudrun.compression import PrecompressedPage
+from wxcloudrun.counter import increase_count, query_count, clear_count
 from wxcloudrun.dao import (
-    delete_counterbyid, query_counterbyid, insert_counter, update_counterbyid,
-    query_poetry_by_keyword, query_poetry_by_author, query_random_poetry, insert_poetry,
-    query_character_etymology, query_characters_by_radical, query_characters_by_stroke_count, insert_character_etymology,
-    query_calendar_knowledge_by_category, insert_calendar_knowledge,
-    query_astronomy_knowledge_by_constellation, insert_astronomy_knowledge,
-    query_cultural_knowledge_by_category, query_random_cultural_knowledge, insert_cultural_knowledge
+    query_poetry_by_id, insert_poetry, query_suggestions, query_character_etymologies, insert_character_etymology,
+    insert_calendar_knowledge, insert_astronomy_knowledge, insert_cultural_knowledge,
+    upsert_rows, query_change_seq, iter_changes, run_plan
 )
-from wxcloudrun.model import Counters, Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge
-from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response
+from wxcloudrun.http_cache import cache_by_table_version, cache_by_versions
+from wxcloudrun.ingest import NATURAL_KEYS, ingest, iter_ndjson, validate_row
+from wxcloudrun.metrics import ops_only
+from wxcloudrun.model import Poetry, CharacterEtymology, CalendarKnowledge, AstronomyKnowledge, CulturalKnowledge
+from wxcloudrun.offline_bundle import offline_bundle
+from wxcloudrun.pool import pool_stats
+from wxcloudrun import read_api
+from wxcloudrun.reference_data import calendar_snapshot, astronomy_snapshot
+from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response, make_ndjson_response
+from wxcloudrun.serializers import poetry_serializer, etymology_serializer, sync_serializers
+from wxcloudrun.write_queue import write_queue
+
+
+def _is_hanzi(c):
+    """是否为汉字（中日韩统一表意文字及兼容表意文字），标点等不需要查字源"""
+    return unicodedata.name(c, '').startswith(('CJK UNIFIED IDEOGRAPH', 'CJK COMPATIBILITY IDEOGRAPH'))
+
+
+# index页面没有动态内容，启动时渲染一次并预先压缩
+with app.app_context():
+    index_page = PrecompressedPage(render_template('index.html').encode('utf-8'))
+
+
+def _bulk_ingest(model):
+    """以 NDJSON 流读取请求体，逐行校验后按 chunk_size 分批写入"""
+    chunk_size = request.args.get('chunk_size', str(config.BULK_CHUNK_SIZE))
+    if not chunk_size.isdigit() or int(chunk_size) == 0:
+        return make_err_response('chunk_size参数错误')
+    chunk_size = min(int(chunk_size), config.BULK_CHUNK_SIZE_MAX)
+
+    report = ingest(model, iter_ndjson(request.stream), chunk_size)
+    return make_succ_response(report.to_dict())
+
+
+def _enqueue_write(model):
+    """异步写入模式：校验后追加到本地写入队列，立即返回 ticket"""
+    try:
+        row = validate_row(model, request.get_json(silent=True))
+    except ValueError as e:
+        return make_err_response(str(e))
+    return make_succ_response({'ticket': write_queue.enqueue(model, row), 'status': 'pending'})
 
 
 @app.route('/')
@@ -18,7 +60,7 @@ def index():
     """
     :return: 返回index页面
     """
-    return render_template('index.html')
+    return index_page.response()
 
 
 @app.route('/api/count', methods=['POST'])
@@ -39,24 +81,12 @@ def count():
 
     # 执行自增操作
     if action == 'inc':
-        counter = query_counterbyid(1)
-        if counter is None:
-            counter = Counters()
-            counter.id = 1
-            counter.count = 1
-            counter.created_at = datetime.now()
-            counter.updated_at = datetime.now()
-            insert_counter(counter)
-        else:
-            counter.id = 1
-            counter.count += 1
-            counter.updated_at = datetime.now()
-            update_counterbyid(counter)
-        return make_succ_response(counter.count)
+        increase_count()
+        return make_succ_response(query_count())
 
     # 执行清0操作
     elif action == 'clear':
-        delete_counterbyid(1)
+        clear_count()
         return make_succ_empty_response()
 
     # action参数错误
@@ -69,58 +99,62 @@ def get_count():
     """
     :return: 计数的值
     """
-    counter = Counters.query.filter(Counters.id == 1).first()
-    return make_succ_response(0) if counter is None else make_succ_response(counter.count)
+    return make_succ_response(query_count())
 
 
 # 诗词相关API
 @app.route('/api/poetry/search', methods=['GET'])
+@cache_by_table_version(Poetry, max_age=60)
 def search_poetry():
     """搜索诗词"""
-    keyword = request.args.get('keyword', '')
-    author = request.args.get('author', '')
-    
-    if keyword:
-        poems = query_poetry_by_keyword(keyword)
-    elif author:
-        poems = query_poetry_by_author(author)
-    else:
-        poems = []
-    
-    result = []
-    for poem in poems:
-        result.append({
-            'id': poem.id,
-            'title': poem.title,
-            'author': poem.author,
-            'dynasty': poem.dynasty,
-            'content': poem.content,
-            'tags': poem.tags
-        })
-    
-    return make_succ_response(result)
+    return run_plan(read_api.search_poetry())
+
+
+@app.route('/api/suggest', methods=['GET'])
+def get_suggestions():
+    """作者、诗题或汉字（按拼音）的前缀联想，按出现次数降序"""
+    prefix = request.args.get('prefix', '').strip()
+    kind = request.args.get('type', 'author')
+    limit = request.args.get('limit', str(config.SUGGEST_LIMIT_DEFAULT))
+    if not prefix:
+        return make_err_response('请输入前缀')
+    if kind not in ('author', 'title', 'character'):
+        return make_err_response('type参数错误')
+    if not limit.isdigit() or int(limit) == 0:
+        return make_err_response('limit参数错误')
+
+    suggestions = query_suggestions(kind, prefix, min(int(limit), config.SUGGEST_LIMIT_MAX))
+    if suggestions is None:
+        return make_err_response('查询失败')
+    return make_succ_response([{'text': text, 'count': count} for text, count in suggestions])
 
 
 @app.route('/api/poetry/random', methods=['GET'])
 def get_random_poetry():
     """获取随机诗词"""
-    poem = query_random_poetry()
-    if poem:
-        result = {
-            'id': poem.id,
-            'title': poem.title,
-            'author': poem.author,
-            'dynasty': poem.dynasty,
-            'content': poem.content,
-            'tags': poem.tags
-        }
-        return make_succ_response(result)
-    return make_succ_response(None)
+    return run_plan(read_api.get_random_poetry())
+
+
+@app.route('/api/poetry/<int:poetry_id>/annotated', methods=['GET'])
+@cache_by_table_version(Poetry, CharacterEtymology, max_age=300)
+def get_annotated_poetry(poetry_id):
+    """获取诗词及其中每个汉字的字源信息"""
+    poem = query_poetry_by_id(poetry_id)
+    if poem is None:
+        return make_err_response('诗词不存在')
+
+    characters = list(dict.fromkeys(c for c in poem.title + poem.content if _is_hanzi(c)))
+    etymologies = query_character_etymologies(characters)
+    result = poetry_serializer.dump(poem)
+    result['etymology'] = {c: etymology_serializer.dump(e) for c, e in etymologies.items()}
+    return make_succ_response(result)
 
 
 @app.route('/api/poetry/add', methods=['POST'])
 def add_poetry():
     """添加诗词"""
+    if config.WRITE_BEHIND_ENABLED:
+        return _enqueue_write(Poetry)
     data = request.get_json()
     try:
         poetry = Poetry(
@@ -136,88 +170,64 @@ def add_poetry():
         return make_err_response(str(e))
 
 
+@app.route('/api/poetry/bulk', methods=['POST'])
+def bulk_add_poetry():
+    """批量导入诗词，请求体为每行一个JSON对象的NDJSON"""
+    return _bulk_ingest(Poetry)
+
+
 # 汉字字源相关API
 @app.route('/api/etymology/search', methods=['GET'])
+@cache_by_table_version(CharacterEtymology, max_age=300)
 def search_character_etymology():
     """查询单个汉字的字源信息"""
-    character = request.args.get('character', '')
-    
-    if not character:
-        return make_err_response('请输入要查询的汉字')
-    
-    if len(character) > 1:
-        return make_err_response('只能查询单个汉字')
-    
-    etymology = query_character_etymology(character)
-    if etymology:
-        result = {
-            'id': etymology.id,
-            'character': etymology.character,
-            'pinyin': etymology.pinyin,
-            'radical': etymology.radical,
-            'stroke_count': etymology.stroke_count,
-            'etymology': etymology.etymology,
-            'ancient_forms': etymology.ancient_forms,
-            'meaning': etymology.meaning,
-            'extended_meanings': etymology.extended_meanings,
-            'examples': etymology.examples,
-            'stroke_order': etymology.stroke_order,
-            'dictionary_source': etymology.dictionary_source
-        }
-        return make_succ_response(result)
+    return run_plan(read_api.search_character_etymology())
+
+
+@app.route('/api/etymology/batch', methods=['GET', 'POST'])
+@cache_by_table_version(CharacterEtymology, max_age=300)
+def batch_character_etymology():
+    """批量查询汉字字源信息，characters 可以是字符串或汉字列表"""
+    if request.method == 'POST':
+        characters = (request.get_json(silent=True) or {}).get('characters', '')
     else:
-        return make_succ_response(None)
+        characters = request.args.get('characters', '')
+
+    if isinstance(characters, str):
+        characters = list(characters)
+    if not isinstance(characters, list) or not all(isinstance(c, str) and len(c) == 1 for c in characters):
+        return make_err_response('characters参数错误')
+
+    # 去重并保持原有顺序
+    characters = list(dict.fromkeys(characters))
+    if not characters:
+        return make_err_response('请输入要查询的汉字')
+    if len(characters) > config.ETYMOLOGY_BATCH_MAX:
+        return make_err_response('单次最多查询{}个汉字'.format(config.ETYMOLOGY_BATCH_MAX))
+
+    etymologies = query_character_etymologies(characters)
+    return make_succ_response({c: etymology_serializer.dump(e) for c, e in etymologies.items()})
 
 
 @app.route('/api/etymology/radical', methods=['GET'])
+@cache_by_table_version(CharacterEtymology, max_age=300)
 def get_characters_by_radical():
     """按部首查询汉字"""
-    radical = request.args.get('radical', '')
-    
-    if not radical:
-        return make_err_response('请输入部首')
-    
-    characters = query_characters_by_radical(radical)
-    result = []
-    for char in characters:
-        result.append({
-            'id': char.id,
-            'character': char.character,
-            'pinyin': char.pinyin,
-            'radical': char.radical,
-            'stroke_count': char.stroke_count,
-            'meaning': char.meaning
-        })
-    
-    return make_succ_response(result)
+    return run_plan(read_api.get_characters_by_radical())
 
 
 @app.route('/api/etymology/strokes', methods=['GET'])
+@cache_by_table_version(CharacterEtymology, max_age=300)
 def get_characters_by_stroke_count():
     """按笔画数查询汉字"""
-    stroke_count = request.args.get('count', '')
-    
-    if not stroke_count or not stroke_count.isdigit():
-        return make_err_response('请输入有效的笔画数')
-    
-    characters = query_characters_by_stroke_count(int(stroke_count))
-    result = []
-    for char in characters:
-        result.append({
-            'id': char.id,
-            'character': char.character,
-            'pinyin': char.pinyin,
-            'radical': char.radical,
-            'stroke_count': char.stroke_count,
-            'meaning': char.meaning
-        })
-    
-    return make_succ_response(result)
+    return run_plan(read_api.get_characters_by_stroke_count())
 
 
 @app.route('/api/etymology/add', methods=['POST'])
 def add_character_etymology():
     """添加汉字字源信息"""
+    if config.WRITE_BEHIND_ENABLED:
+        return _enqueue_write(CharacterEtymology)
     data = request.get_json()
     try:
         etymology = CharacterEtymology(
@@ -239,40 +249,32 @@ def add_character_etymology():
         return make_err_response(str(e))
 
 
+@app.route('/api/etymology/bulk', methods=['POST'])
+def bulk_add_character_etymology():
+    """批量导入汉字字源信息，请求体为每行一个JSON对象的NDJSON"""
+    return _bulk_ingest(CharacterEtymology)
+
+
 # 历法知识相关API
 @app.route('/api/calendar/solar-terms', methods=['GET'])
+@cache_by_versions(calendar_snapshot.versions, max_age=300)
 def get_solar_terms():
     """获取节气信息"""
-    solar_terms = query_calendar_knowledge_by_category('节气')
-    result = []
-    for term in solar_terms:
-        result.append({
-            'id': term.id,
-            'title': term.title,
-            'content': term.content,
-            'date_info': term.date_info
-        })
-    return make_succ_response(result)
+    return run_plan(read_api.get_solar_terms())
 
 
 @app.route('/api/calendar/festivals', methods=['GET'])
+@cache_by_versions(calendar_snapshot.versions, max_age=300)
 def get_festivals():
     """获取传统节日"""
-    festivals = query_calendar_knowledge_by_category('节日')
-    result = []
-    for festival in festivals:
-        result.append({
-            'id': festival.id,
-            'title': festival.title,
-            'content': festival.content,
-            'date_info': festival.date_info
-        })
-    return make_succ_response(result)
+    return run_plan(read_api.get_festivals())
 
 
 @app.route('/api/calendar/add', methods=['POST'])
 def add_calendar_knowledge():
     """添加历法知识"""
+    if config.WRITE_BEHIND_ENABLED:
+        return _enqueue_write(CalendarKnowledge)
     data = request.get_json()
     try:
         knowledge = CalendarKnowledge(
@@ -287,31 +289,25 @@ def add_calendar_knowledge():
         return make_err_response(str(e))
 
 
+@app.route('/api/calendar/bulk', methods=['POST'])
+def bulk_add_calendar_knowledge():
+    """批量导入历法知识，请求体为每行一个JSON对象的NDJSON"""
+    return _bulk_ingest(CalendarKnowledge)
+
+
 # 天文知识相关API
 @app.route('/api/astronomy/constellations', methods=['GET'])
+@cache_by_versions(astronomy_snapshot.versions, max_age=300)
 def get_constellations():
     """获取星宿信息"""
-    constellation = request.args.get('constellation', '')
-    if constellation:
-        knowledge = query_astronomy_knowledge_by_constellation(constellation)
-    else:
-        knowledge = []
-    
-    result = []
-    for item in knowledge:
-        result.append({
-            'id': item.id,
-            'title': item.title,
-            'content': item.content,
-            'constellation': item.constellation,
-            'period': item.period
-        })
-    return make_succ_response(result)
+    return run_plan(read_api.get_constellations())
 
 
 @app.route('/api/astronomy/add', methods=['POST'])
 def add_astronomy_knowledge():
     """添加天文知识"""
+    if config.WRITE_BEHIND_ENABLED:
+        return _enqueue_write(AstronomyKnowledge)
     data = request.get_json()
     try:
         knowledge = AstronomyKnowledge(
@@ -326,44 +322,31 @@ def add_astronomy_knowledge():
         return make_err_response(str(e))
 
 
+@app.route('/api/astronomy/bulk', methods=['POST'])
+def bulk_add_astronomy_knowledge():
+    """批量导入天文知识，请求体为每行一个JSON对象的NDJSON"""
+    return _bulk_ingest(AstronomyKnowledge)
+
+
 # 文化百科相关API
 @app.route('/api/culture/daily', methods=['GET'])
 def get_daily_culture():
-    """获取每日文化知识"""
-    knowledge = query_random_cultural_knowledge()
-    if knowledge:
-        result = {
-            'id': knowledge.id,
-            'title': knowledge.title,
-            'content': knowledge.content,
-            'category': knowledge.category,
-            'tags': knowledge.tags
-        }
-        return make_succ_response(result)
-    return make_succ_response(None)
+    """获取每日文化知识，同一天内所有请求返回同一条"""
+    return run_plan(read_api.get_daily_culture())
 
 
 @app.route('/api/culture/category', methods=['GET'])
+@cache_by_table_version(CulturalKnowledge, max_age=300)
 def get_culture_by_category():
     """根据分类获取文化知识"""
-    category = request.args.get('category', '')
-    knowledge = query_cultural_knowledge_by_category(category)
-    
-    result = []
-    for item in knowledge:
-        result.append({
-            'id': item.id,
-            'title': item.title,
-            'content': item.content,
-            'category': item.category,
-            'tags': item.tags
-        })
-    return make_succ_response(result)
+    return run_plan(read_api.get_culture_by_category())
 
 
 @app.route('/api/culture/add', methods=['POST'])
 def add_cultural_knowledge():
     """添加文化知识"""
+    if config.WRITE_BEHIND_ENABLED:
+        return _enqueue_write(CulturalKnowledge)
     data = request.get_json()
     try:
         knowledge = CulturalKnowledge(
@@ -378,6 +361,88 @@ def add_cultural_knowledge():
         return make_err_response(str(e))
 
 
+@app.route('/api/culture/bulk', methods=['POST'])
+def bulk_add_cultural_knowledge():
+    """批量导入文化知识，请求体为每行一个JSON对象的NDJSON"""
+    return _bulk_ingest(CulturalKnowledge)
+
+
+# 异步写入API
+@app.route('/api/write/status', methods=['GET'])
+def get_write_status():
+    """查询异步写入的结果：pending 尚未写库，done 已写入（附 id），failed 写入失败（附 error）"""
+    ticket = request.args.get('ticket', '')
+    if not ticket:
+        return make_err_response('请输入ticket')
+    state = write_queue.status(ticket)
+    if state is None:
+        return make_err_response('ticket不存在')
+    return make_succ_response({key: state[key] for key in ('ticket', 'table', 'status', 'id', 'error')
+                               if key in state})
+
+
+# 增量同步API
+@app.route('/api/sync', methods=['GET'])
+def sync_changes():
+    """
+    按全局变更序号增量同步知识表，逐行输出 since 之后插入或更新的记录（NDJSON）
+    最后一行为 {"nextSince": 序号}，下次以它作为 since；缺少该行说明传输中断，应以原 since 重试
+    """
+    since = request.args.get('since', '0')
+    if not since.isdigit():
+        return make_err_response('since参数错误')
+    names = list(dict.fromkeys(name for name in request.args.get('tables', '').split(',') if name)) \
+        or list(sync_serializers)
+    unknown = [name for name in names if name not in sync_serializers]
+    if unknown:
+        return make_err_response('不支持同步的表: {}'.format(','.join(unknown)))
+    # 序号上界在开始输出前确定，之后提交的写入序号更大，留到下次同步
+    until = query_change_seq()
+    if until is None:
+        return make_err_response('查询失败')
+
+    def changes():
+        for name in names:
+            serializer = sync_serializers[name]
+            columns = serializer.columns + [serializer.model.change_seq]
+            for row in iter_changes(serializer.model, int(since), until, columns):
+                yield {'table': name, 'seq': row.change_seq, 'row': serializer.dump(row)}
+        yield {'nextSince': max(until, int(since))}
+
+    return make_ndjson_response(changes())
+
+
+@app.route('/api/snapshot/latest', methods=['GET'])
+def get_latest_snapshot():
+    """
+    下载离线快照包（gzip 压缩的 SQLite 文件），ETag 为文件的 SHA-256，支持 If-None-Match 与 Range 断点续传
+    表版本有变化时按 OFFLINE_BUNDLE_CHECK_SECONDS 的间隔重新生成
+    """
+    manifest = offline_bundle.latest()
+    if manifest is None:
+        return make_err_response('快照尚未生成')
+    response = send_file(offline_bundle.path(manifest), mimetype='application/gzip', as_attachment=True,
+                         download_name=manifest['file'], conditional=True, etag=manifest['sha256'], max_age=0)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['X-Snapshot-Since'] = str(manifest['since'])
+    return response
+
+
+# 运维API，需通过 ops_only 的访问控制
+@app.route('/api/cache/stats', methods=['GET'])
+@ops_only
+def get_cache_stats():
+    """查看进程内缓存的命中统计"""
+    return make_succ_response({name: cache.stats() for name, cache in caches.items()})
+
+
+@app.route('/api/pool/stats', methods=['GET'])
+@ops_only
+def get_pool_stats():
+    """查看本进程数据库连接池的状态与等待统计"""
+    return make_succ_response(pool_stats(db.engine))
+
+
 # 数据初始化API
 @app.route('/api/init-data', methods=['POST'])
 def init_data():
@@ -401,9 +466,7 @@ def init_data():
             }
         ]
         
-        for poem_data in sample_poems:
-            poetry = Poetry(**poem_data)
-            insert_poetry(poetry)
+        upsert_rows(Poetry, NATURAL_KEYS[Poetry], sample_poems)
         
         # 添加示例汉字字源数据
         sample_etymology = [
@@ -448,9 +511,7 @@ def init_data():
             }
         ]
         
-        for etymology_data in sample_etymology:
-            etymology = CharacterEtymology(**etymology_data)
-            insert_character_etymology(etymology)
+        upsert_rows(CharacterEtymology, NATURAL_KEYS[CharacterEtymology], sample_etymology)
         
         return make_succ_response({'message': '数据初始化成功'})
     except Exception as e:
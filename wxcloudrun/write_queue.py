@@ -0,0 +1,336 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+import config
+from wxcloudrun import app
+from wxcloudrun.dao import insert_entities, query_write_tickets, delete_write_tickets
+from wxcloudrun.ingest import MODELS
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 队列日志：每行一条待写入的记录 {ticket, table, row, at}
+QUEUE_LOG = 'queue.log'
+# 状态日志：每行一条已处理记录的结果 {ticket, table, status, id 或 error, at}
+STATUS_LOG = 'status.log'
+# 队列中已处理到的字节偏移
+OFFSET_FILE = 'queue.offset'
+# 持有该文件锁的进程负责刷新，同一目录同时只有一个进程写库
+FLUSH_LOCK = 'flush.lock'
+# 后台线程自动压缩的间隔（秒）
+COMPACT_INTERVAL = 3600
+
+# 表名到模型
+TABLES = {model.__tablename__: model for model in MODELS.values()}
+
+
+def _locked_fd(path):
+    """
+    打开并以排他锁锁住追加日志；拿到锁后文件已被压缩替换时重新打开
+    :return: 文件描述符，关闭即释放锁
+    """
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def _encode(entries):
+    return b''.join(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n' for entry in entries)
+
+
+def _write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _replace(path, data):
+    """写临时文件后原子替换，替换前 fsync"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class _LogTail(object):
+    """增量读取追加日志中的完整行，文件被压缩替换（inode 变化或变短）时从头读取"""
+
+    def __init__(self, path):
+        self.path = path
+        self._inode = None
+        self._offset = 0
+
+    def reset(self):
+        self._inode, self._offset = None, 0
+
+    def read(self):
+        """
+        :return: (是否从头读取, 新增的行对象列表)
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False, []
+        with f:
+            stat = os.fstat(f.fileno())
+            reset = stat.st_ino != self._inode or stat.st_size < self._offset
+            if reset:
+                self._inode, self._offset = stat.st_ino, 0
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        return reset, [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+
+
+class WriteQueue(object):
+    """
+    /add 接口的本地持久化写入队列
+    入队时追加到队列日志并 fsync 后返回 ticket；后台线程按 WRITE_QUEUE_BATCH_SIZE 分批在一个事务中写库，
+    把每条记录的结果追加到状态日志，再推进已处理的偏移
+    结果已写入状态日志、偏移尚未推进时中断，重启后按状态日志跳过这些记录；
+    记录与 ticket 在同一事务中写入 WriteTickets 表，写库提交后、结果写入前中断的一批重放时按 ticket 跳过，不会重复写入
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._queue_tail = _LogTail(self._path(QUEUE_LOG))
+        self._status_tail = _LogTail(self._path(STATUS_LOG))
+        self._tickets = {}
+        self._pid = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _append(self, name, entries):
+        os.makedirs(self.directory, exist_ok=True)
+        fd = _locked_fd(self._path(name))
+        try:
+            _write_all(fd, _encode(entries))
+            if config.WRITE_QUEUE_FSYNC:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def ensure_flusher(self):
+        """启动本进程的后台刷新线程，线程不会随 fork 复制到子进程，按进程号懒启动"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='write-queue-flusher', daemon=True).start()
+
+    def _run(self):
+        # 启动后先压缩一次，之后每 COMPACT_INTERVAL 一次，内存中的 ticket 随压缩后的日志重建，不会无限增长
+        compacted_at = None
+        while True:
+            time.sleep(config.WRITE_QUEUE_FLUSH_INTERVAL)
+            try:
+                self.flush()
+                if config.WRITE_QUEUE_KEEP_SECONDS > 0 and (
+                        compacted_at is None or time.monotonic() - compacted_at >= COMPACT_INTERVAL):
+                    compacted_at = time.monotonic()
+                    self.compact(config.WRITE_QUEUE_KEEP_SECONDS)
+            except Exception as e:
+                logger.info("write queue flush errorMsg= {} ".format(e))
+
+    def enqueue(self, model, row):
+        """
+        追加一条已校验的记录
+        :return: ticket，用于查询写入结果
+        """
+        ticket = uuid.uuid4().hex
+        self._append(QUEUE_LOG, [{'ticket': ticket, 'table': model.__tablename__, 'row': row, 'at': time.time()}])
+        self.ensure_flusher()
+        return ticket
+
+    def _catch_up(self):
+        """读入两份日志的新增内容，任一份被压缩替换时重建"""
+        queue_reset, queued = self._queue_tail.read()
+        status_reset, statuses = self._status_tail.read()
+        if queue_reset or status_reset:
+            if self._tickets:
+                self._tickets = {}
+                self._queue_tail.reset()
+                self._status_tail.reset()
+                _, queued = self._queue_tail.read()
+                _, statuses = self._status_tail.read()
+        for entry in queued:
+            self._tickets.setdefault(entry['ticket'], {'ticket': entry['ticket'], 'table': entry['table'],
+                                                       'status': 'pending'})
+        for entry in statuses:
+            self._tickets[entry['ticket']] = entry
+
+    def status(self, ticket):
+        """
+        查询 ticket 的写入结果
+        :return: {ticket, table, status: pending/done/failed, id 或 error}，ticket 不存在时返回 None
+        """
+        self.ensure_flusher()
+        with self._lock:
+            self._catch_up()
+            return self._tickets.get(ticket)
+
+    def _read_offset(self):
+        try:
+            with open(self._path(OFFSET_FILE)) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _read_batch(self, offset):
+        """从偏移处读取至多 WRITE_QUEUE_BATCH_SIZE 条完整的记录，返回 (记录列表, 新的偏移)"""
+        try:
+            f = open(self._path(QUEUE_LOG), 'rb')
+        except FileNotFoundError:
+            return [], offset
+        entries = []
+        with f:
+            f.seek(offset)
+            while len(entries) < config.WRITE_QUEUE_BATCH_SIZE:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if line.strip():
+                    entries.append(json.loads(line))
+        return entries, offset
+
+    def _insert(self, model, entries, statuses):
+        """
+        在一个事务中写入同一张表的一批记录，结果追加到 statuses；整批失败时逐条重试以定位出错的记录
+        数据库不可用（OperationalError）时抛出，尚未写入的记录留待下次刷新
+        """
+        now = time.time()
+        try:
+            ids = insert_entities(model, [entry['row'] for entry in entries], [entry['ticket'] for entry in entries])
+            statuses.extend({'ticket': entry['ticket'], 'table': entry['table'], 'status': 'done', 'id': id,
+                             'at': now} for entry, id in zip(entries, ids))
+            return
+        except OperationalError:
+            raise
+        except SQLAlchemyError as e:
+            if len(entries) == 1:
+                statuses.append({'ticket': entries[0]['ticket'], 'table': entries[0]['table'], 'status': 'failed',
+                                 'error': str(getattr(e, 'orig', None) or e), 'at': now})
+                return
+            logger.info("write queue batch failed, retrying one by one errorMsg= {} ".format(e))
+        for entry in entries:
+            self._insert(model, [entry], statuses)
+
+    def _write_batch(self, entries):
+        """写入一批记录并把结果追加到状态日志，中途数据库不可用时先记下已写入的部分再抛出"""
+        with self._lock:
+            self._catch_up()
+            finished = {ticket for ticket, state in self._tickets.items() if state['status'] != 'pending'}
+        groups = {}
+        for entry in entries:
+            # 上次写库后、推进偏移前中断的记录已有结果，跳过
+            if entry['ticket'] not in finished:
+                groups.setdefault(entry['table'], []).append(entry)
+        statuses = []
+        try:
+            with app.app_context():
+                # 上次写库提交后、记下结果前中断的记录已在 WriteTickets 中，补记结果，不再写入
+                written = query_write_tickets([entry['ticket'] for group in groups.values() for entry in group])
+                now = time.time()
+                for table, group in groups.items():
+                    statuses.extend({'ticket': entry['ticket'], 'table': table, 'status': 'done',
+                                     'id': written[entry['ticket']], 'at': now}
+                                    for entry in group if entry['ticket'] in written)
+                    group = [entry for entry in group if entry['ticket'] not in written]
+                    if group:
+                        self._insert(TABLES[table], group, statuses)
+        finally:
+            if statuses:
+                self._append(STATUS_LOG, statuses)
+
+    def flush(self):
+        """
+        把队列中尚未写入的记录分批写库，其他进程正在刷新时直接返回
+        :return: 本次处理的记录数
+        """
+        with self._flush_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(self._path(FLUSH_LOCK), os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0
+                processed = 0
+                while True:
+                    entries, offset = self._read_batch(self._read_offset())
+                    if not entries:
+                        return processed
+                    self._write_batch(entries)
+                    _replace(self._path(OFFSET_FILE), str(offset).encode('ascii'))
+                    processed += len(entries)
+            finally:
+                os.close(fd)
+
+    def compact(self, keep_seconds):
+        """
+        去掉队列中已处理的记录，只保留最近 keep_seconds 秒内的写入结果，并删除同样过期的 WriteTickets
+        持有刷新锁进行，期间入队会短暂等待
+        :return: (保留的待处理记录数, 保留的结果数)
+        """
+        with self._flush_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            lock_fd = os.open(self._path(FLUSH_LOCK), os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                cutoff = time.time() - keep_seconds
+                status_fd = _locked_fd(self._path(STATUS_LOG))
+                try:
+                    with open(self._path(STATUS_LOG), 'rb') as f:
+                        lines = [line for line in f if line.endswith(b'\n') and json.loads(line)['at'] >= cutoff]
+                    _replace(self._path(STATUS_LOG), b''.join(lines))
+                finally:
+                    os.close(status_fd)
+                queue_fd = _locked_fd(self._path(QUEUE_LOG))
+                try:
+                    with open(self._path(QUEUE_LOG), 'rb') as f:
+                        f.seek(self._read_offset())
+                        pending = f.read()
+                    _replace(self._path(QUEUE_LOG), pending)
+                    _replace(self._path(OFFSET_FILE), b'0')
+                finally:
+                    os.close(queue_fd)
+                # 待处理的记录可能已写库而结果未记下，它们的 ticket 晚于入队时间，须保留
+                for line in pending.splitlines():
+                    if line.strip():
+                        cutoff = min(cutoff, json.loads(line)['at'])
+                with app.app_context():
+                    delete_write_tickets(datetime.fromtimestamp(cutoff))
+                return pending.count(b'\n'), len(lines)
+            finally:
+                os.close(lock_fd)
+
+
+write_queue = WriteQueue(config.WRITE_QUEUE_DIR)
+
+
+if config.WRITE_BEHIND_ENABLED:
+    @app.before_first_request
+    def _start_write_queue_flusher():
+        # 重启后即使没有新的写入，也要把队列中遗留的记录写库
+        write_queue.ensure_flusher()